@@ -0,0 +1,35 @@
+import unittest
+
+from xmrgprocessing.boundary.boundariesparse import find_hrap_extents_from_boundaries
+from xmrgprocessing.geoXmrg import geoXmrg
+
+from tests.xmrg_test_data import square_boundary
+
+
+class FindHrapExtentsTests(unittest.TestCase):
+    def test_extent_covers_boundary_with_padding(self):
+        boundary = square_boundary('Inlet', -79.0, 33.0, 0.1)
+        extents = find_hrap_extents_from_boundaries([boundary], pad_cells=1)
+        self.assertEqual(len(extents), 1)
+
+        columns, rows = geoXmrg(None, None).latLongsToHRAP([33.0, 33.1, 33.1, 33.0], [-79.0, -79.0, -78.9, -78.9])
+        start_col, start_row, end_col, end_row = extents[0]
+        self.assertEqual(start_col, int(columns.min()) - 1)
+        self.assertEqual(start_row, int(rows.min()) - 1)
+        self.assertEqual(end_col, int(columns.max()) + 2)
+        self.assertEqual(end_row, int(rows.max()) + 2)
+
+    def test_overlapping_extents_are_merged(self):
+        boundaries = [square_boundary('North', -79.0, 33.0, 0.1),
+                      square_boundary('North Adjacent', -78.92, 33.05, 0.1),
+                      square_boundary('South', -81.0, 30.0, 0.1)]
+        extents = find_hrap_extents_from_boundaries(boundaries, pad_cells=1)
+        self.assertEqual(len(extents), 2)
+        north, north_adjacent, south = [find_hrap_extents_from_boundaries([boundary], pad_cells=1)[0]
+                                        for boundary in boundaries]
+        self.assertIn(south, extents)
+        self.assertIn((min(north[0], north_adjacent[0]), min(north[1], north_adjacent[1]),
+                       max(north[2], north_adjacent[2]), max(north[3], north_adjacent[3])), extents)
+
+if __name__ == "__main__":
+    unittest.main()
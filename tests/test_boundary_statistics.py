@@ -0,0 +1,47 @@
+import unittest
+
+import numpy as np
+
+from xmrgprocessing.boundary.boundary_statistics import (aggregate_statistics, dry_statistics, missing_statistics,
+                                                         STATISTICS)
+
+
+class AggregateStatisticsTests(unittest.TestCase):
+    def setUp(self):
+        # Boundary 0 has a missing data cell, boundary 1 only missing data, boundary 2 no cells at all.
+        self.boundary_index = np.array([0, 0, 0, 0, 1])
+        self.weight = np.array([0.25, 0.25, 0.25, 0.25, 1.0])
+        self.values = np.array([0.0, 10.0, 30.0, -1.0, -1.0])
+        self.statistics = aggregate_statistics(self.boundary_index, self.weight, self.values, 3,
+                                               np.array([100.0, 50.0, 10.0]), threshold=25.4)
+
+    def test_masks_missing_data(self):
+        self.assertAlmostEqual(self.statistics['weighted_average'][0], 40.0 / 3.0)
+        self.assertEqual(self.statistics['max'][0], 30.0)
+        self.assertAlmostEqual(self.statistics['covered_area_fraction'][0], 2.0 / 3.0)
+        self.assertAlmostEqual(self.statistics['area_over_threshold'][0], 25.0)
+        self.assertAlmostEqual(self.statistics['valid_cell_fraction'][0], 0.75)
+
+    def test_boundaries_without_valid_cells(self):
+        for boundary in (1, 2):
+            self.assertTrue(np.isnan(self.statistics['weighted_average'][boundary]))
+            self.assertTrue(np.isnan(self.statistics['max'][boundary]))
+            self.assertTrue(np.isnan(self.statistics['covered_area_fraction'][boundary]))
+            self.assertEqual(self.statistics['area_over_threshold'][boundary], 0.0)
+            self.assertEqual(self.statistics['valid_cell_fraction'][boundary], 0.0)
+
+    def test_dry_statistics(self):
+        statistics = dry_statistics(2)
+        self.assertEqual(sorted(statistics), sorted(STATISTICS))
+        self.assertEqual(list(statistics['weighted_average']), [0.0, 0.0])
+        self.assertTrue(np.isnan(statistics['valid_cell_fraction']).all())
+
+    def test_missing_statistics_match_boundaries_without_valid_cells(self):
+        statistics = missing_statistics(3)
+        self.assertEqual(sorted(statistics), sorted(STATISTICS))
+        for statistic, values in statistics.items():
+            np.testing.assert_array_equal(values[1:], self.statistics[statistic][1:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,231 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from xmrgprocessing.boundary.boundariesparse import find_hrap_extents_from_boundaries
+from xmrgprocessing.boundary import boundary_weights as boundary_weights_module
+from xmrgprocessing.boundary.boundary_weights import boundary_weights, boundary_geometry
+from xmrgprocessing.geoXmrg import geoXmrg
+
+from tests.xmrg_test_data import (BOUNDARIES, XOR, YOR, build_xmrg_bytes, overlay_weighted_average,
+                                   square_boundary)
+
+# The weights treat boundary edges as straight in HRAP and the reference treats cell edges as straight in lat/lon,
+# so they only agree to about 1e-4.
+OVERLAY_RTOL = 2e-4
+
+
+class BoundaryWeightsTestCase(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._temp_dir.cleanup)
+        self.grid = np.random.default_rng(1).integers(-1, 300, (30, 40)).astype(np.int16)
+
+    def read_xmrg(self, grid=None, hrap_extents=None):
+        file_path = os.path.join(self._temp_dir.name, 'xmrg0501202412z')
+        with open(file_path, 'wb') as xmrg_file:
+            xmrg_file.write(build_xmrg_bytes(self.grid if grid is None else grid, XOR, YOR))
+        xmrg = geoXmrg(None, None, hrap_extents=hrap_extents)
+        xmrg.openFile(file_path)
+        self.assertTrue(xmrg.readFileHeader())
+        self.assertTrue(xmrg.readAllRows())
+        xmrg.cleanUp(False, False)
+        return xmrg
+
+
+class BoundaryWeightsTests(BoundaryWeightsTestCase):
+    def test_weighted_averages_match_per_boundary_overlay(self):
+        xmrg = self.read_xmrg()
+        weights = boundary_weights(BOUNDARIES)
+        self.assertFalse(weights.is_current(xmrg))
+        weights.build(xmrg)
+        self.assertTrue(weights.is_current(xmrg))
+
+        expected = [overlay_weighted_average(xmrg, boundary) for boundary in BOUNDARIES]
+        np.testing.assert_allclose(weights.weighted_averages(xmrg), expected, rtol=OVERLAY_RTOL)
+
+    def test_boundary_windows_give_the_same_averages(self):
+        full_grid = self.read_xmrg()
+        expected = [overlay_weighted_average(full_grid, boundary) for boundary in BOUNDARIES]
+        xmrg = self.read_xmrg(hrap_extents=find_hrap_extents_from_boundaries(BOUNDARIES, 1))
+        self.assertLess(xmrg.cell_mask.sum(), 30 * 40)
+        weights = boundary_weights(BOUNDARIES)
+        weights.build(xmrg)
+        np.testing.assert_allclose(weights.weighted_averages(xmrg), expected, rtol=OVERLAY_RTOL)
+
+    def test_weights_are_reused_for_the_next_hour(self):
+        weights = boundary_weights(BOUNDARIES)
+        weights.build(self.read_xmrg())
+        next_hour = self.read_xmrg(grid=self.grid[::-1].copy())
+        self.assertTrue(weights.is_current(next_hour))
+        expected = [overlay_weighted_average(next_hour, boundary) for boundary in BOUNDARIES]
+        np.testing.assert_allclose(weights.weighted_averages(next_hour), expected, rtol=OVERLAY_RTOL)
+
+    def test_weighted_averages_from_the_sparse_grid(self):
+        xmrg = self.read_xmrg(hrap_extents=find_hrap_extents_from_boundaries(BOUNDARIES, 1))
+        weights = boundary_weights(BOUNDARIES)
+        weights.build(xmrg)
+        sparse_grid = xmrg.sparseGrid()
+        self.assertTrue(weights.is_current(sparse_grid))
+        np.testing.assert_allclose(weights.weighted_averages(sparse_grid), weights.weighted_averages(xmrg),
+                                   rtol=1e-12)
+
+    def test_batch_statistics_match_each_hour(self):
+        boundaries = BOUNDARIES + [square_boundary('Offshore', -60.0, 20.0, 0.2)]
+        xmrg = self.read_xmrg(hrap_extents=find_hrap_extents_from_boundaries(BOUNDARIES, 1))
+        weights = boundary_weights(boundaries)
+        weights.build(xmrg)
+        hours = [xmrg.sparseGrid(),
+                 self.read_xmrg(grid=self.grid[::-1].copy(),
+                                hrap_extents=find_hrap_extents_from_boundaries(BOUNDARIES, 1)).sparseGrid(),
+                 self.read_xmrg(grid=np.full((30, 40), -1, dtype=np.int16),
+                                hrap_extents=find_hrap_extents_from_boundaries(BOUNDARIES, 1))]
+        batch = weights.batch_statistics(hours, threshold=1.5)
+        for hour, xmrg in enumerate(hours):
+            for statistic, values in weights.statistics(xmrg, threshold=1.5).items():
+                self.assertEqual(batch[statistic].shape, (3, len(boundaries)))
+                np.testing.assert_allclose(batch[statistic][hour], values, rtol=1e-12, equal_nan=True)
+        self.assertTrue(np.isnan(batch['weighted_average'][2]).all())
+        self.assertTrue(np.isnan(batch['max'][:, -1]).all())
+
+    def test_grid_cells_and_boundary_frame(self):
+        xmrg = self.read_xmrg()
+        weights = boundary_weights(BOUNDARIES)
+        weights.build(xmrg)
+        cells = list(weights.grid_cells(xmrg))
+        self.assertEqual(len(cells), len(weights.weight))
+        self.assertEqual({cell[0] for cell in cells}, {'Creek', 'Inlet', 'Marsh'})
+
+        frame = weights.boundary_frame(xmrg, 1)
+        self.assertEqual(set(frame.Name), {'Inlet'})
+        self.assertAlmostEqual(frame.percent.sum(), 1.0)
+        self.assertAlmostEqual(frame['weighted average'].sum(), weights.weighted_averages(xmrg)[1])
+
+    def test_weights_of_whole_cells_are_their_analytic_areas(self):
+        xmrg = self.read_xmrg()
+        # A boundary covering HRAP cells 1010-1012 x 310-311 exactly.
+        latitudes, longitudes = xmrg.hrapCoordsToLatLongs([1010, 1010, 1013, 1013, 1010], [310, 312, 312, 310, 310])
+        boundary = ('Cells', {'type': 'Polygon', 'coordinates': [list(zip(-longitudes, latitudes))]})
+        weights = boundary_weights([boundary])
+        weights.build(xmrg)
+
+        columns = np.array([1010, 1011, 1012, 1010, 1011, 1012])
+        rows = np.array([310, 310, 310, 311, 311, 311])
+        areas = xmrg.hrapCellAreas(columns, rows)
+        cells = (rows - YOR) * 40 + columns - XOR
+        order = np.argsort(weights.cell_index)
+        np.testing.assert_array_equal(weights.cell_index[order], np.sort(cells))
+        np.testing.assert_allclose(weights.weight[order], (areas / areas.sum())[np.argsort(cells)], rtol=1e-9)
+
+    def test_cells_are_classified_interior_edge_and_exterior(self):
+        hrap_geometry = shapely.Polygon([(10.5, 20.5), (10.5, 25.5), (16.5, 25.5), (16.5, 20.5)])
+        start_col, start_row, cell_state = boundary_weights_module.classify_cells(hrap_geometry)
+        self.assertEqual((start_col, start_row, cell_state.shape), (10, 20, (6, 7)))
+        interior = cell_state == boundary_weights_module.INTERIOR_CELL
+        self.assertTrue(interior[1:-1, 1:-1].all())
+        self.assertEqual(interior.sum(), 4 * 5)
+        self.assertEqual((cell_state == boundary_weights_module.EDGE_CELL).sum(), 6 * 7 - 4 * 5)
+
+        # Cells inside the hole of a polygon are exterior.
+        with_hole = shapely.Polygon(hrap_geometry.exterior, [[(12.2, 22.2), (12.2, 23.8), (14.8, 23.8),
+                                                               (14.8, 22.2)]])
+        start_col, start_row, cell_state = boundary_weights_module.classify_cells(with_hole)
+        self.assertEqual(cell_state[2:4, 2:5].tolist(), [[boundary_weights_module.EDGE_CELL] * 3] * 2)
+        self.assertEqual((cell_state == boundary_weights_module.INTERIOR_CELL).sum(), 4 * 5 - 6)
+        self.assertEqual((cell_state == boundary_weights_module.EXTERIOR_CELL).sum(), 0)
+
+
+class ApproximateWeightsTests(BoundaryWeightsTestCase):
+    def test_supersampled_weights_are_within_the_error_bound(self):
+        xmrg = self.read_xmrg()
+        exact = boundary_weights(BOUNDARIES)
+        exact.build(xmrg)
+        approximate = boundary_weights(BOUNDARIES, coverage_error=0.05)
+        approximate.build(xmrg)
+        self.assertEqual(approximate._samples, 20)
+
+        exact_weights = pd.Series(exact.weight, index=[exact.boundary_index, exact.cell_index])
+        approximate_weights = pd.Series(approximate.weight, index=[approximate.boundary_index,
+                                                                   approximate.cell_index])
+        exact_weights, approximate_weights = exact_weights.align(approximate_weights, fill_value=0.0)
+        self.assertGreater((exact_weights - approximate_weights).abs().max(), 0.0)
+        # Each cell weight is its coverage times its share of the boundary area, so the error is bounded by it.
+        cell_shares = exact_weights.groupby(level=0).transform('max')
+        self.assertTrue(((exact_weights - approximate_weights).abs() <= 0.05 * cell_shares * 1.01).all())
+        np.testing.assert_allclose(approximate.weighted_averages(xmrg), exact.weighted_averages(xmrg), rtol=0.02)
+
+    def test_deviation_report(self):
+        xmrg = self.read_xmrg()
+        weights = boundary_weights(BOUNDARIES, coverage_error=0.1)
+        weights.build(xmrg)
+        report = weights.deviation_report(xmrg, sample_size=2, random_seed=4)
+        self.assertEqual(len(report), 2)
+        self.assertTrue(set(report.Name) <= {'Creek', 'Inlet', 'Marsh'})
+        np.testing.assert_allclose(report.weighted_average_deviation,
+                                   report.weighted_average - report.overlay_weighted_average)
+        self.assertTrue((report.max_weight_deviation > 0.0).all())
+
+        exact = boundary_weights(BOUNDARIES)
+        exact.build(xmrg)
+        exact_report = exact.deviation_report(xmrg, sample_size=3)
+        self.assertLess(exact_report.max_weight_deviation.max(), 1e-4)
+        np.testing.assert_allclose(exact_report.weighted_average, exact_report.overlay_weighted_average,
+                                   rtol=OVERLAY_RTOL)
+
+
+class WeightCacheTests(BoundaryWeightsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache_directory = os.path.join(self._temp_dir.name, 'weights')
+        self.computed = []
+        compute = boundary_weights_module.boundary_cell_weights.compute
+
+        def counting_compute(geometry, xmrg, samples=0):
+            self.computed.append(geometry)
+            return compute(geometry, xmrg, samples)
+        patcher = mock.patch.object(boundary_weights_module.boundary_cell_weights, 'compute',
+                                    side_effect=counting_compute)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cached_weights_are_loaded(self):
+        xmrg = self.read_xmrg()
+        weights = boundary_weights(BOUNDARIES, self.cache_directory)
+        weights.build(xmrg)
+        self.assertEqual(len(self.computed), 3)
+        self.assertEqual(len(os.listdir(self.cache_directory)), 3)
+
+        cached = boundary_weights(BOUNDARIES, self.cache_directory)
+        cached.build(xmrg)
+        self.assertEqual(len(self.computed), 3)
+        np.testing.assert_array_equal(cached.cell_index, weights.cell_index)
+        np.testing.assert_allclose(cached.weighted_averages(xmrg), weights.weighted_averages(xmrg))
+
+    def test_only_changed_boundary_is_recomputed(self):
+        xmrg = self.read_xmrg()
+        boundary_weights(BOUNDARIES, self.cache_directory).build(xmrg)
+        changed = [BOUNDARIES[0], square_boundary('Inlet', -79.25, 30.7, 0.15), BOUNDARIES[2]]
+        weights = boundary_weights(changed, self.cache_directory)
+        weights.build(xmrg)
+        self.assertEqual(len(self.computed), 4)
+        self.assertTrue(self.computed[-1].equals(boundary_geometry(changed[1][1])))
+        expected = [overlay_weighted_average(xmrg, boundary) for boundary in changed]
+        np.testing.assert_allclose(weights.weighted_averages(xmrg), expected, rtol=OVERLAY_RTOL)
+
+    def test_cached_weights_map_onto_boundary_windows(self):
+        boundary_weights(BOUNDARIES, self.cache_directory).build(self.read_xmrg())
+        xmrg = self.read_xmrg(hrap_extents=find_hrap_extents_from_boundaries(BOUNDARIES, 1))
+        weights = boundary_weights(BOUNDARIES, self.cache_directory)
+        weights.build(xmrg)
+        self.assertEqual(len(self.computed), 3)
+        expected = [overlay_weighted_average(xmrg, boundary) for boundary in BOUNDARIES]
+        np.testing.assert_allclose(weights.weighted_averages(xmrg), expected, rtol=OVERLAY_RTOL)
+
+
+if __name__ == "__main__":
+    unittest.main()
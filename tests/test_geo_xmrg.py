@@ -0,0 +1,354 @@
+import gzip
+import os
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+import shapely
+
+from xmrgprocessing.archive.archive_utilities import xmrg_archive_utilities
+from xmrgprocessing.geoXmrg import geoXmrg, hrapCoord, hrapWindow, LatLong
+from xmrgprocessing.xmrg_seek_index import xmrg_seek_index
+
+from tests.xmrg_test_data import build_xmrg_bytes
+
+
+class GeoXmrgTestCase(unittest.TestCase):
+    XOR = 1000
+    YOR = 300
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.grid = np.arange(30 * 40, dtype=np.int16).reshape(30, 40) - 5
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def write_xmrg_file(self, file_name='xmrg0501202412z', byte_order='<', contents=None):
+        if contents is None:
+            contents = build_xmrg_bytes(self.grid, self.XOR, self.YOR, byte_order)
+        file_path = os.path.join(self._temp_dir.name, file_name)
+        with open(file_path, 'wb') as xmrg_file:
+            xmrg_file.write(contents)
+        return file_path
+
+    def write_compressed_xmrg_file(self, file_name='xmrg0501202412z.gz', byte_order='<'):
+        contents = gzip.compress(build_xmrg_bytes(self.grid, self.XOR, self.YOR, byte_order))
+        return self.write_xmrg_file(file_name, contents=contents)
+
+    def open_xmrg(self, file_path, min_lat_lon=None, max_lat_lon=None, hrap_extents=None, **kwargs):
+        xmrg = geoXmrg(min_lat_lon, max_lat_lon, hrap_extents=hrap_extents)
+        xmrg.openFile(file_path, **kwargs)
+        self.addCleanup(xmrg.xmrgFile.close)
+        self.assertTrue(xmrg.readFileHeader())
+        return xmrg
+
+
+class ReadGridTests(GeoXmrgTestCase):
+    def test_reads_grid_in_both_byte_orders(self):
+        for byte_order in ('<', '>'):
+            with self.subTest(byte_order=byte_order):
+                xmrg = self.open_xmrg(self.write_xmrg_file(byte_order=byte_order))
+                grid = xmrg.readGrid()
+                self.assertEqual(grid.shape, (30, 40))
+                np.testing.assert_array_equal(grid, self.grid)
+
+    def test_grid_matches_row_by_row_reader(self):
+        file_path = self.write_xmrg_file(byte_order='>')
+        grid = self.open_xmrg(file_path).readGrid()
+        xmrg = self.open_xmrg(file_path)
+        rows = [list(xmrg.readRow()) for row in range(xmrg.MAXY)]
+        np.testing.assert_array_equal(grid, np.array(rows))
+
+    def test_bad_record_tag_fails(self):
+        contents = bytearray(build_xmrg_bytes(self.grid, self.XOR, self.YOR))
+        # Corrupt the trailing tag of the 4th row.
+        record_size = 40 * 2 + 8
+        tail_offset = 24 + 74 + (3 * record_size) + record_size - 4
+        contents[tail_offset:tail_offset + 4] = struct.pack('<I', 12)
+        xmrg = self.open_xmrg(self.write_xmrg_file(contents=bytes(contents)))
+        self.assertIsNone(xmrg.readGrid())
+        self.assertIn('row: 3', xmrg.lastErrorMsg)
+
+    def test_truncated_file_fails(self):
+        contents = build_xmrg_bytes(self.grid, self.XOR, self.YOR)
+        xmrg = self.open_xmrg(self.write_xmrg_file(contents=contents[:-10]))
+        self.assertIsNone(xmrg.readGrid())
+
+
+class WindowedReadTests(GeoXmrgTestCase):
+    def test_reads_only_the_window(self):
+        window = hrapWindow(self.XOR, self.YOR, 40, 30, 5, 12, 17, 20)
+        for open_args in ({}, {'use_mmap': True}):
+            with self.subTest(**open_args):
+                xmrg = self.open_xmrg(self.write_xmrg_file(byte_order='>'), **open_args)
+                np.testing.assert_array_equal(xmrg.readGrid(window), self.grid[12:20, 5:17])
+                self.assertEqual(xmrg.window, window)
+        xmrg = self.open_xmrg(self.write_compressed_xmrg_file(), in_memory=True)
+        np.testing.assert_array_equal(xmrg.readGrid(window), self.grid[12:20, 5:17])
+
+    def test_bad_record_tag_outside_window_is_not_read(self):
+        contents = bytearray(build_xmrg_bytes(self.grid, self.XOR, self.YOR))
+        record_size = 40 * 2 + 8
+        contents[24 + 74 + (25 * record_size)] = 0
+        xmrg = self.open_xmrg(self.write_xmrg_file(contents=bytes(contents)))
+        window = hrapWindow(self.XOR, self.YOR, 40, 30, 0, 2, 40, 10)
+        np.testing.assert_array_equal(xmrg.readGrid(window), self.grid[2:10])
+        self.assertIsNone(xmrg.readGrid())
+
+    def test_window_from_bbox_is_clipped_to_grid(self):
+        xmrg = self.open_xmrg(self.write_xmrg_file())
+        lower_left = xmrg.hrapCoordToLatLong(hrapCoord(self.XOR - 20, self.YOR + 4.75))
+        upper_right = xmrg.hrapCoordToLatLong(hrapCoord(self.XOR + 12.75, self.YOR + 90))
+        xmrg._minimum_lat_lon = LatLong(lower_left.latitude, -lower_left.longitude)
+        xmrg._maximum_lat_lon = LatLong(upper_right.latitude, -upper_right.longitude)
+        self.assertEqual(xmrg.getWindow(), hrapWindow(self.XOR, self.YOR, 40, 30, 0, 4, 12, 29))
+
+
+class MultiWindowReadTests(GeoXmrgTestCase):
+    def test_reads_only_the_cells_in_the_extents(self):
+        hrap_extents = [(self.XOR + 2, self.YOR + 3, self.XOR + 6, self.YOR + 5),
+                        (self.XOR + 30, self.YOR + 20, self.XOR + 50, self.YOR + 22),
+                        (self.XOR + 100, self.YOR, self.XOR + 110, self.YOR + 5)]
+        xmrg = self.open_xmrg(self.write_xmrg_file(byte_order='>'), hrap_extents=hrap_extents)
+        self.assertEqual(len(xmrg.getWindows()), 2)
+        self.assertTrue(xmrg.readAllRows())
+
+        self.assertEqual(xmrg.window, hrapWindow(self.XOR, self.YOR, 40, 30, 2, 3, 40, 22))
+        self.assertEqual(xmrg.cell_mask.sum(), 4 * 2 + 10 * 2)
+        np.testing.assert_array_equal(xmrg.grid[xmrg.cell_mask],
+                                      np.concatenate([self.grid[3:5, 2:6].ravel(), self.grid[20:22, 30:40].ravel()]))
+        geo_data_frame = xmrg.geo_data_frame
+        self.assertEqual(len(geo_data_frame), 28)
+        np.testing.assert_allclose(geo_data_frame.Precipitation.iloc[-1], self.grid[21, 39] * 0.01)
+
+    def test_missing_data_is_not_dry(self):
+        hrap_extents = [(self.XOR + 2, self.YOR + 3, self.XOR + 6, self.YOR + 5),
+                        (self.XOR + 30, self.YOR + 20, self.XOR + 40, self.YOR + 22)]
+        # The cells between the extents are 0 in the grid, but they weren't read.
+        self.grid[:] = -1
+        xmrg = self.open_xmrg(self.write_xmrg_file(contents=build_xmrg_bytes(self.grid, self.XOR, self.YOR,
+                                                                             max_value=-1)),
+                              hrap_extents=hrap_extents)
+        self.assertFalse(xmrg.headerIsDry())
+        self.assertTrue(xmrg.headerIsMissing())
+        self.assertTrue(xmrg.readAllRows())
+        self.assertFalse(xmrg.windowIsDry())
+        self.assertTrue(xmrg.windowIsMissing())
+
+        # A header max of 0 says nothing about the missing cells.
+        self.grid[21, 39] = 0
+        xmrg = self.open_xmrg(self.write_xmrg_file(), hrap_extents=hrap_extents)
+        self.assertTrue(xmrg.headerIsDry())
+        self.assertTrue(xmrg.readAllRows())
+        self.assertFalse(xmrg.windowIsDry())
+        self.assertFalse(xmrg.windowIsMissing())
+
+        self.grid[:] = 0
+        xmrg = self.open_xmrg(self.write_xmrg_file(), hrap_extents=hrap_extents)
+        self.assertTrue(xmrg.readAllRows())
+        self.assertTrue(xmrg.windowIsDry())
+        self.assertFalse(xmrg.windowIsMissing())
+
+
+class RasterApiTests(GeoXmrgTestCase):
+    def test_geo_data_frame_is_built_on_first_use(self):
+        xmrg = self.open_xmrg(self.write_xmrg_file())
+        self.assertTrue(xmrg.readAllRows())
+        self.assertIsNone(xmrg._geo_data_frame)
+        np.testing.assert_array_equal(xmrg.nodata_mask, self.grid < 0)
+        self.assertEqual(xmrg.window.transform, (1.0, 0.0, self.XOR, 0.0, 1.0, self.YOR))
+
+        geo_data_frame = xmrg.geo_data_frame
+        self.assertIs(geo_data_frame, xmrg.geo_data_frame)
+        np.testing.assert_allclose(geo_data_frame.Precipitation, self.grid.ravel() * xmrg.data_multiplier)
+
+
+class InMemoryDecompressTests(GeoXmrgTestCase):
+    def test_decompresses_without_writing_a_file(self):
+        file_path = self.write_compressed_xmrg_file(byte_order='>')
+        xmrg = self.open_xmrg(file_path, in_memory=True)
+        np.testing.assert_array_equal(xmrg.readGrid(), self.grid)
+        self.assertEqual(os.listdir(self._temp_dir.name), ['xmrg0501202412z.gz'])
+        self.assertEqual(xmrg.fileName, os.path.join(self._temp_dir.name, 'xmrg0501202412z'))
+
+        xmrg.cleanUp(True, True)
+        self.assertEqual(os.listdir(self._temp_dir.name), [])
+
+    def test_decompresses_to_file_by_default(self):
+        xmrg = self.open_xmrg(self.write_compressed_xmrg_file())
+        np.testing.assert_array_equal(xmrg.readGrid(), self.grid)
+        xmrg.cleanUp(True, False)
+        self.assertEqual(os.listdir(self._temp_dir.name), ['xmrg0501202412z.gz'])
+
+
+class MemoryMapTests(GeoXmrgTestCase):
+    def test_grid_is_a_view_over_the_memory_map(self):
+        xmrg = self.open_xmrg(self.write_xmrg_file(byte_order='>'), use_mmap=True)
+        grid = xmrg.readGrid()
+        np.testing.assert_array_equal(grid, self.grid)
+        self.assertIsInstance(grid.base, np.memmap)
+
+    def test_compressed_in_memory_file_is_not_memory_mapped(self):
+        xmrg = self.open_xmrg(self.write_compressed_xmrg_file(), in_memory=True, use_mmap=True)
+        self.assertNotIsInstance(xmrg.readGrid().base, np.memmap)
+
+    def test_truncated_file_fails(self):
+        contents = build_xmrg_bytes(self.grid, self.XOR, self.YOR)
+        xmrg = self.open_xmrg(self.write_xmrg_file(contents=contents[:-10]), use_mmap=True)
+        self.assertIsNone(xmrg.readGrid())
+
+
+class SeekIndexTests(GeoXmrgTestCase):
+    def test_window_read_through_seek_index(self):
+        file_path = self.write_compressed_xmrg_file(byte_order='>')
+        index_directory = os.path.join(self._temp_dir.name, 'index')
+        os.makedirs(index_directory)
+        xmrg_seek_index.build(file_path, index_directory, chunk_size=200)
+        seek_index = xmrg_seek_index.open(file_path, index_directory)
+        self.assertIsNotNone(seek_index)
+
+        contents = build_xmrg_bytes(self.grid, self.XOR, self.YOR, '>')
+        self.assertEqual(seek_index.uncompressed_size, len(contents))
+        self.assertEqual(seek_index.read(150, 450), contents[150:600])
+        self.assertEqual(seek_index.read(len(contents) - 5, 100), contents[-5:])
+
+        xmrg = self.open_xmrg(file_path, seek_index=seek_index)
+        window = hrapWindow(self.XOR, self.YOR, 40, 30, 5, 12, 17, 20)
+        np.testing.assert_array_equal(xmrg.readGrid(window), self.grid[12:20, 5:17])
+        xmrg.cleanUp(True, False)
+        self.assertEqual(sorted(os.listdir(self._temp_dir.name)), ['index', 'xmrg0501202412z.gz'])
+
+    def test_index_is_stale_when_source_changes(self):
+        file_path = self.write_compressed_xmrg_file()
+        xmrg_seek_index.build(file_path)
+        self.assertTrue(os.path.exists(f"{file_path}.idx"))
+        stat = os.stat(file_path)
+        os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertIsNone(xmrg_seek_index.open(file_path))
+
+
+class HeaderScanTests(GeoXmrgTestCase):
+    def test_reads_header_metadata_without_data(self):
+        month_directory = os.path.join(self._temp_dir.name, '2024', 'May')
+        os.makedirs(month_directory)
+        contents = build_xmrg_bytes(self.grid, self.XOR, self.YOR, '>', max_value=1234)
+        with open(os.path.join(month_directory, 'xmrg0501202412z.gz'), 'wb') as xmrg_file:
+            xmrg_file.write(gzip.compress(contents))
+        # Only the header is present, the data records are never needed.
+        with open(os.path.join(month_directory, 'xmrg0501202413z'), 'wb') as xmrg_file:
+            xmrg_file.write(build_xmrg_bytes(self.grid[:1], self.XOR, self.YOR, '<', max_value=0)[:100])
+        with open(os.path.join(month_directory, 'xmrg0501202414z'), 'wb') as xmrg_file:
+            xmrg_file.write(b'not an xmrg file')
+
+        headers = xmrg_archive_utilities(self._temp_dir.name).scan_file_headers(worker_count=2)
+        self.assertEqual(list(headers.file_name), ['xmrg0501202412z', 'xmrg0501202413z', 'xmrg0501202414z'])
+        self.assertEqual(list(headers.max_value[:2]), [1234, 0])
+        self.assertEqual(list(headers.byte_swapped[:2]), [True, False])
+        self.assertEqual(headers.valid_date[0], '2024-05-01')
+        self.assertEqual(headers.maxx[0], 40)
+        self.assertTrue(headers.error[:2].isna().all())
+        self.assertIsNotNone(headers.error[2])
+
+
+class HrapTransformTests(GeoXmrgTestCase):
+    def test_array_transforms_match_point_transforms(self):
+        xmrg = self.open_xmrg(self.write_xmrg_file())
+        columns = np.array([self.XOR, self.XOR + 7.5, self.XOR + 40])
+        rows = np.array([self.YOR, self.YOR + 12.25, self.YOR + 30])
+        latitudes, longitudes = xmrg.hrapCoordsToLatLongs(columns, rows)
+        for column, row, latitude, longitude in zip(columns, rows, latitudes, longitudes):
+            lat_lon = xmrg.hrapCoordToLatLong(hrapCoord(column, row))
+            self.assertAlmostEqual(latitude, lat_lon.latitude, places=10)
+            self.assertAlmostEqual(longitude, lat_lon.longitude, places=10)
+
+        hrap_columns, hrap_rows = xmrg.latLongsToHRAP(latitudes, -longitudes, True, True)
+        for latitude, longitude, hrap_column, hrap_row in zip(latitudes, longitudes, hrap_columns, hrap_rows):
+            hrap = xmrg.latLongToHRAP(LatLong(latitude, -longitude), True, True)
+            self.assertEqual(hrap_column, hrap.column)
+            self.assertEqual(hrap_row, hrap.row)
+
+    def test_read_all_rows_cells_match_point_transforms(self):
+        xmrg = self.open_xmrg(self.write_xmrg_file())
+        lower_left = xmrg.hrapCoordToLatLong(hrapCoord(self.XOR + 5.75, self.YOR + 4.75))
+        upper_right = xmrg.hrapCoordToLatLong(hrapCoord(self.XOR + 12.75, self.YOR + 9.75))
+        xmrg._minimum_lat_lon = LatLong(lower_left.latitude, -lower_left.longitude)
+        xmrg._maximum_lat_lon = LatLong(upper_right.latitude, -upper_right.longitude)
+        self.assertTrue(xmrg.readAllRows())
+
+        geo_data_frame = xmrg.geo_data_frame
+        self.assertEqual(len(geo_data_frame), 5 * 7)
+        # First cell is the lower left cell of the bbox.
+        self.assertAlmostEqual(geo_data_frame.Precipitation.iloc[0], self.grid[4, 5] * 0.01)
+        corners = [(self.XOR + 5, self.YOR + 4), (self.XOR + 5, self.YOR + 5),
+                   (self.XOR + 6, self.YOR + 5), (self.XOR + 6, self.YOR + 4)]
+        expected = []
+        for column, row in corners:
+            lat_lon = xmrg.hrapCoordToLatLong(hrapCoord(column, row))
+            expected.append((-lat_lon.longitude, lat_lon.latitude))
+        np.testing.assert_allclose(list(geo_data_frame.geometry.iloc[0].exterior.coords)[:4], expected)
+
+    def test_cell_geometries_are_reused_for_the_same_grid(self):
+        file_path = self.write_xmrg_file()
+        first = self.open_xmrg(file_path).cellGeometries(hrapWindow(self.XOR, self.YOR, 40, 30, 2, 3, 10, 8))
+        second = self.open_xmrg(file_path).cellGeometries(hrapWindow(self.XOR, self.YOR, 40, 30, 2, 3, 10, 8))
+        self.assertIs(first, second)
+        self.assertEqual(len(first), 5 * 8)
+        third = self.open_xmrg(file_path).cellGeometries(hrapWindow(self.XOR, self.YOR, 40, 30, 2, 3, 10, 9))
+        self.assertIsNot(first, third)
+
+
+class CellTreeTests(GeoXmrgTestCase):
+    def test_query_finds_the_cells_a_geometry_touches(self):
+        xmrg = self.open_xmrg(self.write_xmrg_file())
+        self.assertTrue(xmrg.readAllRows())
+        latitudes, longitudes = xmrg.hrapCoordsToLatLongs([self.XOR + 10.5, self.XOR + 12.5],
+                                                          [self.YOR + 20.5, self.YOR + 21.5])
+        line = shapely.LineString(zip(-longitudes, latitudes))
+        cells = xmrg.queryCells(line)
+        expected = shapely.intersects(xmrg.geo_data_frame.geometry.values, line).nonzero()[0]
+        np.testing.assert_array_equal(cells, expected)
+        self.assertIn(20 * 40 + 10, cells)
+        self.assertIn(21 * 40 + 12, cells)
+
+        next_hour = self.open_xmrg(self.write_xmrg_file('xmrg0501202413z'))
+        self.assertTrue(next_hour.readAllRows())
+        self.assertIs(next_hour.cellTree(), xmrg.cellTree())
+
+    def test_geometry_off_the_grid_is_skipped(self):
+        xmrg = self.open_xmrg(self.write_xmrg_file())
+        self.assertTrue(xmrg.readAllRows())
+        self.assertEqual(len(xmrg.queryCells(shapely.box(-100.0, 45.0, -99.0, 46.0))), 0)
+
+
+class SparseGridTests(GeoXmrgTestCase):
+    def test_sparse_grid_holds_the_non_zero_cells(self):
+        self.grid[self.grid > 100] = 0
+        self.grid[2, 3] = -1
+        xmrg = self.open_xmrg(self.write_xmrg_file(),
+                              hrap_extents=[(self.XOR + 2, self.YOR + 1, self.XOR + 8, self.YOR + 4),
+                                            (self.XOR + 20, self.YOR + 2, self.XOR + 25, self.YOR + 3)])
+        self.assertTrue(xmrg.readAllRows())
+        sparse_grid = xmrg.sparseGrid()
+        np.testing.assert_array_equal(sparse_grid.dense(), xmrg.grid)
+        self.assertEqual(sparse_grid.cell_count, np.count_nonzero(xmrg.grid))
+        # Missing data flags are kept.
+        self.assertIn(-1, sparse_grid.values)
+
+        all_cells = np.arange(xmrg.grid.size)
+        np.testing.assert_array_equal(sparse_grid.values_at(all_cells), xmrg.grid.ravel())
+        columns, rows = sparse_grid.hrap_cells(all_cells)
+        np.testing.assert_array_equal(self.grid[rows - self.YOR, columns - self.XOR][xmrg.cell_mask.ravel()],
+                                      xmrg.grid.ravel()[xmrg.cell_mask.ravel()])
+
+    def test_cell_polygons_match_cell_geometries(self):
+        xmrg = self.open_xmrg(self.write_xmrg_file())
+        window = hrapWindow(self.XOR, self.YOR, 40, 30, 2, 3, 6, 5)
+        columns, rows = np.meshgrid(np.arange(2, 6) + self.XOR, np.arange(3, 5) + self.YOR)
+        polygons = xmrg.hrapCellPolygons(columns.ravel(), rows.ravel())
+        self.assertTrue(shapely.equals_exact(polygons, xmrg.cellGeometries(window), tolerance=1e-12).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+
+import numpy as np
+import shapely
+
+from xmrgprocessing.boundary.hrap_clipping import (cell_coverage, clip_ring_to_half_plane, samples_for_error,
+                                                   supersampled_cell_coverage)
+
+
+def shapely_coverage(hrap_geometry, columns, rows):
+    return shapely.area(shapely.intersection(hrap_geometry, shapely.box(columns, rows, columns + 1, rows + 1)))
+
+
+class CellCoverageTests(unittest.TestCase):
+    def setUp(self):
+        columns, rows = np.meshgrid(np.arange(20, 80), np.arange(30, 90))
+        self.columns = columns.ravel()
+        self.rows = rows.ravel()
+        rng = np.random.default_rng(3)
+        angles = np.sort(rng.uniform(0.0, 2.0 * np.pi, 120))
+        radii = rng.uniform(6.0, 22.0, 120)
+        # A concave star shaped polygon with vertices at arbitrary fractions of a cell.
+        self.star = np.column_stack([50.3 + radii * np.cos(angles), 60.6 + radii * np.sin(angles)])
+
+    def assert_matches_shapely(self, hrap_geometry):
+        self.assertTrue(hrap_geometry.is_valid)
+        coverage = cell_coverage(hrap_geometry, self.columns, self.rows)
+        np.testing.assert_allclose(coverage, shapely_coverage(hrap_geometry, self.columns, self.rows), atol=1e-10)
+        self.assertAlmostEqual(coverage.sum(), hrap_geometry.area, places=9)
+
+    def test_concave_polygon(self):
+        self.assert_matches_shapely(shapely.Polygon(self.star))
+
+    def test_clockwise_polygon_with_hole(self):
+        hole = [(47.2, 57.5), (52.0, 57.5), (52.0, 63.25), (47.2, 63.25)]
+        self.assert_matches_shapely(shapely.Polygon(self.star[::-1], [hole]))
+
+    def test_multipolygon(self):
+        self.assert_matches_shapely(shapely.MultiPolygon([shapely.Polygon(self.star),
+                                                          shapely.box(74.25, 32.5, 79.0, 35.75)]))
+
+    def test_cells_outside_the_polygon(self):
+        coverage = cell_coverage(shapely.box(30.5, 40.5, 31.5, 41.5), np.array([30, 31, 10]), np.array([40, 41, 10]))
+        np.testing.assert_allclose(coverage, [0.25, 0.25, 0.0])
+
+    def test_clip_ring_to_half_plane(self):
+        square = np.array([(0.0, 0.0), (0.0, 2.0), (2.0, 2.0), (2.0, 0.0)])
+        clipped = clip_ring_to_half_plane(square, 1, 0.5, True)
+        self.assertAlmostEqual(shapely.Polygon(clipped).area, 1.0)
+        self.assertEqual(len(clip_ring_to_half_plane(square, 0, 3.0, False)), 0)
+
+    def test_supersampled_coverage_is_within_the_error_bound(self):
+        polygon = shapely.Polygon(self.star)
+        samples = samples_for_error(0.1)
+        self.assertEqual(samples, 10)
+        exact = cell_coverage(polygon, self.columns, self.rows)
+        approximate = supersampled_cell_coverage(polygon, self.columns, self.rows, samples, chunk_size=500)
+        # Cells with a vertex in them aren't crossed by a single straight edge, they can be off by more.
+        vertex_cells = set(zip(np.floor(self.star[:, 0]).astype(int), np.floor(self.star[:, 1]).astype(int)))
+        straight = np.array([cell not in vertex_cells for cell in zip(self.columns, self.rows)])
+        self.assertLessEqual(np.abs(exact - approximate)[straight].max(), 0.1)
+        self.assertAlmostEqual(approximate.sum(), exact.sum(), delta=0.01 * exact.sum())
+
+
+if __name__ == "__main__":
+    unittest.main()
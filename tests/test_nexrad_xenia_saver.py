@@ -0,0 +1,97 @@
+import importlib.util
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from shapely.geometry import shape
+
+from xmrgprocessing.xmrg_results import xmrg_results
+
+from tests.xmrg_test_data import BOUNDARIES
+
+HAS_XENIA = importlib.util.find_spec('xeniadbutilities') is not None
+if HAS_XENIA:
+    from xmrgprocessing.xmrgdatasaver import nexrad_xenia_saver
+
+
+def hour_results(datetime, weighted_average, with_centroids=True, period_hours=1):
+    results = xmrg_results()
+    results.datetime = datetime
+    results.period_hours = period_hours
+    for name, boundary in BOUNDARIES:
+        results.add_boundary_result(name, 'weighted_average', weighted_average)
+        if with_centroids:
+            results.add_boundary_centroid(name, shape(boundary).centroid)
+    return results
+
+
+@unittest.skipUnless(HAS_XENIA, "xeniadbutilities is not installed")
+class NexradXeniaSaverTests(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(nexrad_xenia_saver, 'xeniaAlchemy')
+        self.addCleanup(patcher.stop)
+        self.xenia_db = patcher.start().return_value
+        self.platforms = {}
+        self.observations = []
+
+        def add(record):
+            if isinstance(record, nexrad_xenia_saver.platform):
+                self.platforms[record.platform_handle] = record
+            else:
+                self.observations.append(record)
+        self.xenia_db.session.add.side_effect = add
+        self.xenia_db.organizationExists.return_value = 1
+        self.xenia_db.platformExists.side_effect = lambda platform_handle: self.platforms.get(platform_handle)
+        self.xenia_db.session.query.return_value.filter.return_value.one.side_effect = \
+            lambda: SimpleNamespace(fixed_latitude=0.0, fixed_longitude=0.0)
+        self.saver = nexrad_xenia_saver.nexrad_xenia_sqlite_saver(':memory:')
+
+    def test_dry_first_hour_adds_the_platforms(self):
+        # A file with no rain carries no grid cells.
+        self.saver.save(hour_results('2024-05-01T12:00:00', 0.0))
+        self.saver.save(hour_results('2024-05-01T13:00:00', 1.5))
+        self.assertEqual(sorted(self.platforms), sorted(f"nws.{name}.radarcoverage" for name, _ in BOUNDARIES))
+        for name, boundary in BOUNDARIES:
+            centroid = shape(boundary).centroid
+            platform_rec = self.platforms[f"nws.{name}.radarcoverage"]
+            self.assertAlmostEqual(platform_rec.fixed_latitude, centroid.y)
+            self.assertAlmostEqual(platform_rec.fixed_longitude, centroid.x)
+        self.assertEqual([(record.m_date, record.m_value) for record in self.observations],
+                         [('2024-05-01T12:00:00', 0.0)] * len(BOUNDARIES) +
+                         [('2024-05-01T13:00:00', 1.5)] * len(BOUNDARIES))
+
+    def test_platforms_are_checked_until_they_exist(self):
+        self.xenia_db.session.query.return_value.filter.return_value.one.side_effect = Exception("No platform")
+        # Nothing to locate the platforms from, the hour's values are dropped.
+        self.saver.save(hour_results('2024-05-01T12:00:00', 0.0, with_centroids=False))
+        self.assertEqual(self.platforms, {})
+        self.assertEqual(self.observations, [])
+
+        self.xenia_db.session.query.return_value.filter.return_value.one.side_effect = \
+            lambda: SimpleNamespace(fixed_latitude=0.0, fixed_longitude=0.0)
+        self.saver.save(hour_results('2024-05-01T13:00:00', 1.5))
+        self.assertEqual(len(self.platforms), len(BOUNDARIES))
+        self.assertEqual(len(self.observations), len(BOUNDARIES))
+
+    def test_daily_totals_are_saved_as_their_own_type(self):
+        self.xenia_db.mTypeExists.side_effect = lambda obs_type, uom: obs_type
+        self.xenia_db.sensorExists.side_effect = lambda obs_type, uom, platform_handle, sensor_number: obs_type
+        self.saver.save(hour_results('2024-05-02T00:00:00', 1.5))
+        # The 24 hour file for 05/02 ends at 12Z.
+        self.saver.save(hour_results('2024-05-02T12:00:00', 20.0, period_hours=24))
+        self.assertEqual([(record.m_date, record.m_type_id, record.sensor_id, record.m_value)
+                          for record in self.observations],
+                         [('2024-05-02T00:00:00', nexrad_xenia_saver.HOURLY_OBS_TYPE,
+                           nexrad_xenia_saver.HOURLY_OBS_TYPE, 1.5)] * len(BOUNDARIES) +
+                         [('2024-05-02T12:00:00', nexrad_xenia_saver.DAILY_OBS_TYPE,
+                           nexrad_xenia_saver.DAILY_OBS_TYPE, 20.0)] * len(BOUNDARIES))
+        # Each platform gets a sensor for both types.
+        added_sensors = sorted((call.args[0], call.args[2]) for call in self.xenia_db.addNewSensor.call_args_list)
+        self.assertEqual(added_sensors,
+                         sorted((obs_type, f"nws.{name}.radarcoverage")
+                                for obs_type in (nexrad_xenia_saver.DAILY_OBS_TYPE, nexrad_xenia_saver.HOURLY_OBS_TYPE)
+                                for name, _ in BOUNDARIES))
+
+
+if __name__ == '__main__':
+    unittest.main()
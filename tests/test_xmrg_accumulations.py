@@ -0,0 +1,110 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from xmrgprocessing.xmrg_accumulations import pending_hours_for_workers, rolling_accumulator
+from xmrgprocessing.xmrg_results import xmrg_results
+
+START = datetime(2024, 5, 1, 0)
+
+
+def hour_results(hour, values):
+    results = xmrg_results()
+    results.datetime = (START + timedelta(hours=hour)).strftime('%Y-%m-%dT%H:%M:%S')
+    for name, value in values.items():
+        results.add_boundary_result(name, 'weighted_average', value)
+    return results
+
+
+def totals(results, window):
+    return {name: (data[f'rolling_{window}h'], data[f'rolling_{window}h_missing_hours'])
+            for name, data in results.get_boundary_data()}
+
+
+class RollingAccumulatorTests(unittest.TestCase):
+    def test_totals_with_gaps(self):
+        accumulator = rolling_accumulator(windows=(2, 3))
+        accumulator.set_start(START)
+        released = accumulator.add(hour_results(0, {'Creek': 1.0, 'Inlet': 2.0}))
+        released += accumulator.add(hour_results(1, {'Creek': 3.0, 'Inlet': None}))
+        # No file for hour 2.
+        released += accumulator.add(hour_results(3, {'Creek': 5.0, 'Inlet': 4.0}))
+        self.assertEqual(len(released), 2)
+        released += accumulator.flush()
+        self.assertEqual([results.datetime for results in released],
+                         ['2024-05-01T00:00:00', '2024-05-01T01:00:00', '2024-05-01T03:00:00'])
+
+        self.assertEqual(totals(released[0], 3), {'Creek': (1.0, 2), 'Inlet': (2.0, 2)})
+        self.assertEqual(totals(released[1], 2), {'Creek': (4.0, 0), 'Inlet': (2.0, 1)})
+        self.assertEqual(totals(released[1], 3), {'Creek': (4.0, 1), 'Inlet': (2.0, 2)})
+        self.assertEqual(totals(released[2], 2), {'Creek': (5.0, 1), 'Inlet': (4.0, 1)})
+        self.assertEqual(totals(released[2], 3), {'Creek': (8.0, 1), 'Inlet': (4.0, 2)})
+
+    def test_out_of_order_hours_are_accumulated_in_time_order(self):
+        accumulator = rolling_accumulator(windows=(3,), max_pending_hours=2)
+        accumulator.set_start(START)
+        self.assertEqual(accumulator.add(hour_results(1, {'Creek': 2.0})), [])
+        released = accumulator.add(hour_results(0, {'Creek': 1.0}))
+        self.assertEqual([totals(results, 3)['Creek'] for results in released], [(1.0, 2), (3.0, 1)])
+
+        # Hour 3 never arrives, it's skipped once more than 2 later hours are held.
+        self.assertEqual(accumulator.add(hour_results(4, {'Creek': 8.0})), [])
+        self.assertEqual(accumulator.add(hour_results(5, {'Creek': 16.0})), [])
+        released = accumulator.add(hour_results(2, {'Creek': 4.0}))
+        self.assertEqual(len(released), 1)
+        released += accumulator.add(hour_results(6, {'Creek': 32.0}))
+        self.assertEqual([totals(results, 3)['Creek'] for results in released],
+                         [(7.0, 0), (12.0, 1), (24.0, 1), (56.0, 0)])
+
+    def test_interleaved_worker_bursts_are_accumulated_in_time_order(self):
+        worker_count = 4
+        batch_hours = 24
+        values = [float(hour % 7) for hour in range(worker_count * batch_hours * 3)]
+        in_order = rolling_accumulator(windows=(24, 72))
+        expected = [in_order.add(hour_results(hour, {'Creek': value}))[0] for hour, value in enumerate(values)]
+
+        # Each worker takes every 4th hour from the queue and sends 24 at a time, the last worker's burst first.
+        bursts = []
+        for start in range(0, len(values), worker_count * batch_hours):
+            for worker in reversed(range(worker_count)):
+                bursts.append(range(start + worker, start + worker_count * batch_hours, worker_count))
+        accumulator = rolling_accumulator(windows=(24, 72),
+                                          max_pending_hours=pending_hours_for_workers(worker_count, batch_hours))
+        accumulator.set_start(START)
+        released = []
+        for burst in bursts:
+            for hour in burst:
+                released += accumulator.add(hour_results(hour, {'Creek': values[hour]}))
+        released += accumulator.flush()
+        self.assertEqual([results.datetime for results in released], [results.datetime for results in expected])
+        for window in (24, 72):
+            self.assertEqual([totals(results, window) for results in released],
+                             [totals(results, window) for results in expected])
+        self.assertEqual(totals(released[-1], 72)['Creek'][1], 0)
+
+    def test_saved_state_continues_the_windows(self):
+        values = [1.0, 2.0, 4.0, 8.0, 16.0, 32.0]
+        continuous = rolling_accumulator(windows=(3, 4))
+        expected = [continuous.add(hour_results(hour, {'Creek': value}))[0] for hour, value in enumerate(values)]
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            state_file = os.path.join(temp_dir, 'accumulations.npz')
+            first_run = rolling_accumulator(windows=(3, 4))
+            for hour, value in enumerate(values[:3]):
+                first_run.add(hour_results(hour, {'Creek': value}))
+            first_run.save(state_file)
+
+            second_run = rolling_accumulator(windows=(3, 4))
+            second_run.load(state_file)
+            second_run.set_start(START + timedelta(hours=3))
+            released = []
+            for hour, value in enumerate(values[3:], start=3):
+                released += second_run.add(hour_results(hour, {'Creek': value}))
+        for window in (3, 4):
+            self.assertEqual([totals(results, window) for results in released],
+                             [totals(results, window) for results in expected[3:]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+from xmrgprocessing.geoXmrg import geoXmrg, LatLong
+from xmrgprocessing.xmrgfileiterator.xmrg_cube_builder import xmrg_cube_builder
+
+from tests.xmrg_test_data import XOR, YOR, write_xmrg_file
+
+
+class XmrgCubeBuilderTests(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._temp_dir.cleanup)
+        rng = np.random.default_rng(3)
+        self.grids = {}
+        # No file for 14z.
+        for hour in (12, 13, 15):
+            date_time = datetime(2024, 5, 1, hour)
+            self.grids[date_time] = rng.integers(-1, 300, (30, 40)).astype(np.int16)
+            write_xmrg_file(os.path.join(self._temp_dir.name, date_time.strftime('xmrg%m%d%Y%Hz.gz')),
+                            self.grids[date_time])
+        self.builder = xmrg_cube_builder(full_xmrg_path=self._temp_dir.name, thread_count=2)
+
+    def test_cube_has_each_hour_and_masks_missing_files(self):
+        # The extent runs off the west and south edges of the grid.
+        cube = self.builder.build(datetime(2024, 5, 1, 12), datetime(2024, 5, 1, 16),
+                                  hrap_extent=(XOR - 2, YOR - 3, XOR + 10, YOR + 8))
+        self.assertEqual(cube.times, [datetime(2024, 5, 1, hour) for hour in range(12, 16)])
+        self.assertEqual(cube.data.shape, (4, 11, 12))
+        self.assertEqual(cube.data.dtype, np.int16)
+        self.assertEqual(cube.missing_hours, [datetime(2024, 5, 1, 14)])
+
+        for date_time, grid in self.grids.items():
+            hour = cube.hour_index(date_time)
+            np.testing.assert_array_equal(cube.data[hour, 3:, 2:].filled(), grid[:8, :10])
+            self.assertFalse(np.ma.getmaskarray(cube.data)[hour, 3:, 2:].any())
+            # Cells off the grid are masked.
+            self.assertTrue(np.ma.getmaskarray(cube.data)[hour, :3, :].all())
+            self.assertTrue(np.ma.getmaskarray(cube.data)[hour, :, :2].all())
+        np.testing.assert_allclose(cube.precipitation[0, 3:, 2:].filled(), self.grids[cube.times[0]][:8, :10] * 0.01)
+
+    def test_bbox_extent_covers_the_bbox_window(self):
+        cube = self.builder.build(datetime(2024, 5, 1, 12), datetime(2024, 5, 1, 13),
+                                  min_lat_lon=(29.5, -80.5), max_lat_lon=(31.5, -78.0))
+        xmrg = geoXmrg(LatLong(29.5, -80.5), LatLong(31.5, -78.0))
+        xmrg.openFile(os.path.join(self._temp_dir.name, 'xmrg0501202412z.gz'), in_memory=True)
+        self.assertTrue(xmrg.readFileHeader())
+        self.assertTrue(xmrg.readAllRows())
+        window = xmrg.window
+        start_col, start_row, end_col, end_row = cube.hrap_extent
+        rows = slice(YOR + window.start_row - start_row, YOR + window.end_row - start_row)
+        columns = slice(XOR + window.start_col - start_col, XOR + window.end_col - start_col)
+        np.testing.assert_array_equal(cube.data[0, rows, columns], xmrg.grid)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,13 @@
 from datetime import datetime
 from types import ModuleType
+import os
 import sys
+import tempfile
 import unittest
 
 sys.modules.setdefault("requests", ModuleType("requests"))
 
-from xmrgprocessing.xmrgfileiterator.xmrg_file_iterator import xmrg_file_iterator
+from xmrgprocessing.xmrgfileiterator.xmrg_file_iterator import xmrg_daily_file_iterator, xmrg_file_iterator
 
 
 class XmrgFileIteratorDateRangeTests(unittest.TestCase):
@@ -43,5 +45,31 @@ class XmrgFileIteratorDateRangeTests(unittest.TestCase):
         )
 
 
+class XmrgDailyFileIteratorTests(unittest.TestCase):
+    def test_uses_24_hour_files_and_falls_back_to_hourly_files(self):
+        with tempfile.TemporaryDirectory() as xmrg_directory:
+            file_names = ["24hrxmrg05012024.gz", "xmrg0501202413z.gz", "xmrg0502202400z.gz",
+                          "xmrg0502202412z.gz", "xmrg0502202413z.gz"]
+            for file_name in file_names:
+                open(os.path.join(xmrg_directory, file_name), "wb").close()
+            iterator = xmrg_daily_file_iterator(
+                start_date=datetime(2024, 5, 1, 6),
+                end_date=datetime(2024, 5, 4),
+                full_xmrg_path=xmrg_directory,
+            )
+
+            self.assertEqual(
+                list(iterator),
+                [
+                    os.path.join(xmrg_directory, "24hrxmrg05012024.gz"),
+                    # The 24 hours ending at 12Z on the day.
+                    (os.path.join(xmrg_directory, "24hrxmrg05022024"),
+                     [os.path.join(xmrg_directory, file_name) for file_name in file_names[1:4]]),
+                    (os.path.join(xmrg_directory, "24hrxmrg05032024"),
+                     [os.path.join(xmrg_directory, "xmrg0502202413z.gz")]),
+                ],
+            )
+
+
 if __name__ == "__main__":
     unittest.main()
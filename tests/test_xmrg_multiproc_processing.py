@@ -0,0 +1,232 @@
+import os
+import queue
+import tempfile
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+from shapely.geometry import shape
+
+from xmrgprocessing.boundary.boundariesparse import find_hrap_extents_from_boundaries
+from xmrgprocessing.boundary.boundary_statistics import STATISTICS
+from xmrgprocessing.geoXmrg import geoXmrg, LatLong
+from xmrgprocessing.xmrg_multiproc_processing import process_xmrg_file_geopandas
+from xmrgprocessing.xmrg_seek_index import SEEK_INDEX_EXTENSION, xmrg_seek_index
+
+from tests.xmrg_test_data import (BOUNDARIES, BOUNDARIES_NAMES, XOR, YOR, overlay_weighted_average,
+                                   square_boundary, write_xmrg_file)
+
+
+class ProcessXmrgFileGeopandasTests(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._temp_dir.cleanup)
+        rng = np.random.default_rng(7)
+        self.grids = {
+            'xmrg0501202412z.gz': rng.integers(-1, 300, (30, 40)).astype(np.int16),
+            'xmrg0501202413z.gz': rng.integers(0, 50, (30, 40)).astype(np.int16),
+        }
+        self.file_paths = [self.write_file(file_name, grid) for file_name, grid in self.grids.items()]
+
+    def write_file(self, file_name, grid):
+        return write_xmrg_file(os.path.join(self._temp_dir.name, file_name), grid)
+
+    def run_worker(self, **kwargs):
+        input_queue = queue.Queue()
+        results_queue = queue.Queue()
+        for file_path in self.file_paths:
+            input_queue.put(file_path)
+        input_queue.put('STOP')
+        debug_directory = tempfile.mkdtemp(dir=self._temp_dir.name)
+        worker_args = {
+            'input_queue': input_queue,
+            'results_queue': results_queue,
+            'finished_event': threading.Event(),
+            'save_all_precip_vals': False,
+            'delete_source_file': False,
+            'delete_compressed_source_file': False,
+            'min_lat_lon': (29.5, -80.5),
+            'max_lat_lon': (31.5, -78.0),
+            # Offshore is outside the grid.
+            'boundaries': [(name, shape(boundary)) for name, boundary in
+                           BOUNDARIES + [square_boundary('Offshore', -60.0, 20.0, 0.2)]],
+            'debug_files_directory': debug_directory,
+            'base_log_output_directory': debug_directory
+        }
+        worker_args.update(kwargs)
+        self.assertEqual(process_xmrg_file_geopandas(**worker_args), 1)
+        results = {}
+        self.results = []
+        while not results_queue.empty():
+            result = results_queue.get()
+            self.results.append(result)
+            results[result.datetime] = dict(result.get_boundary_data())
+        return results
+
+    def test_precomputed_weights_match_per_file_overlay(self):
+        overlay_results = self.run_worker(use_precomputed_weights=False, rain_threshold=1.5)
+        weights_results = self.run_worker(use_precomputed_weights=True, rain_threshold=1.5)
+        self.assertEqual(sorted(weights_results), ['2024-05-01T12:00:00', '2024-05-01T13:00:00'])
+        for file_time, boundaries in overlay_results.items():
+            self.assertEqual(sorted(boundaries), sorted(weights_results[file_time]))
+            for name in BOUNDARIES_NAMES:
+                overlay = boundaries[name]
+                weights = weights_results[file_time][name]
+                self.assertEqual(sorted(weights), sorted(STATISTICS))
+                # The weights use analytic HRAP cell areas, the overlay EPSG:3857 areas.
+                self.assertAlmostEqual(weights['weighted_average'], overlay['weighted_average'],
+                                       delta=1e-3 * overlay['weighted_average'])
+                self.assertEqual(weights['max'], overlay['max'])
+                self.assertAlmostEqual(weights['covered_area_fraction'], overlay['covered_area_fraction'], delta=2e-3)
+                self.assertAlmostEqual(weights['valid_cell_fraction'], overlay['valid_cell_fraction'], delta=2e-3)
+                self.assertAlmostEqual(weights['area_over_threshold'], overlay['area_over_threshold'],
+                                       delta=1e-2 * overlay['area_over_threshold'])
+            self.assertEqual(boundaries['Offshore'], {'weighted_average': None, 'max': None,
+                                                      'covered_area_fraction': None, 'area_over_threshold': 0.0,
+                                                      'valid_cell_fraction': 0.0})
+        self.assertGreater(weights_results['2024-05-01T12:00:00']['Creek']['area_over_threshold'], 0.0)
+
+    def test_single_overlay_matches_per_boundary_overlay(self):
+        results = self.run_worker(use_precomputed_weights=False)
+        xmrg = geoXmrg(LatLong(29.5, -80.5), LatLong(31.5, -78.0))
+        xmrg.openFile(self.file_paths[0], in_memory=True)
+        self.assertTrue(xmrg.readFileHeader())
+        self.assertTrue(xmrg.readAllRows())
+        # Missing data cells are masked out of the average.
+        precipitation = xmrg.geo_data_frame['Precipitation']
+        valid_grid = SimpleNamespace(geo_data_frame=xmrg.geo_data_frame.assign(Precipitation=1.0 * (precipitation >= 0)))
+        masked_grid = SimpleNamespace(geo_data_frame=xmrg.geo_data_frame.assign(Precipitation=precipitation.clip(lower=0)))
+        for boundary in BOUNDARIES:
+            valid_fraction = overlay_weighted_average(valid_grid, boundary, 'EPSG:3857')
+            self.assertAlmostEqual(results['2024-05-01T12:00:00'][boundary[0]]['weighted_average'],
+                                   overlay_weighted_average(masked_grid, boundary, 'EPSG:3857') / valid_fraction,
+                                   places=9)
+
+    def test_dry_files_skip_the_geometry(self):
+        missing_grid = np.full((30, 40), -1, dtype=np.int16)
+        # Rain elsewhere in the file, but only missing data in the cells read for the boundaries.
+        missing_grid[0, 0] = 25
+        self.file_paths = [self.write_file('xmrg0501202414z.gz', np.zeros((30, 40), dtype=np.int16)),
+                           self.write_file('xmrg0501202415z.gz', missing_grid)]
+        with mock.patch('xmrgprocessing.geoXmrg.geoXmrg.geo_data_frame',
+                        new_callable=mock.PropertyMock) as geo_data_frame:
+            results = self.run_worker(min_lat_lon=(30.4, -80.0), max_lat_lon=(31.0, -79.0),
+                                      hrap_extents=find_hrap_extents_from_boundaries(BOUNDARIES, 1))
+            geo_data_frame.assert_not_called()
+        self.assertEqual(sorted(results), ['2024-05-01T14:00:00', '2024-05-01T15:00:00'])
+        for file_time, boundaries in results.items():
+            self.assertEqual(sorted(boundaries), ['Creek', 'Inlet', 'Marsh', 'Offshore'])
+            for statistics in boundaries.values():
+                if file_time == '2024-05-01T14:00:00':
+                    self.assertEqual(statistics, {'weighted_average': 0.0, 'max': 0.0, 'covered_area_fraction': 0.0,
+                                                  'area_over_threshold': 0.0, 'valid_cell_fraction': None})
+                else:
+                    # Missing data isn't reported as no rain.
+                    self.assertEqual(statistics, {'weighted_average': None, 'max': None,
+                                                  'covered_area_fraction': None, 'area_over_threshold': 0.0,
+                                                  'valid_cell_fraction': 0.0})
+        # The results carry no grid cells, the savers locate the boundaries from their centroids.
+        for result in self.results:
+            self.assertIsNone(result.get_boundary_grid('Creek'))
+            self.assertTrue(result.get_boundary_centroid('Creek').equals(shape(BOUNDARIES[0][1]).centroid))
+
+        # Without the fast path the missing data cells are masked, the statistics are the same.
+        results = self.run_worker(zero_rain_fast_path=False, use_precomputed_weights=False)
+        self.assertIsNone(results['2024-05-01T15:00:00']['Creek']['weighted_average'])
+        self.assertEqual(results['2024-05-01T15:00:00']['Creek']['valid_cell_fraction'], 0.0)
+
+    def test_missing_cells_under_one_boundary_are_not_dry(self):
+        # No rain anywhere, Creek's cells are all missing data.
+        grid = np.zeros((30, 40), dtype=np.int16)
+        columns, rows = geoXmrg(None, None).latLongsToHRAP([30.5, 30.5, 30.7, 30.7], [-79.5, -79.3, -79.5, -79.3])
+        grid[int(np.floor(rows.min())) - YOR:int(np.ceil(rows.max())) - YOR,
+             int(np.floor(columns.min())) - XOR:int(np.ceil(columns.max())) - XOR] = -1
+        self.file_paths = [write_xmrg_file(os.path.join(self._temp_dir.name, 'xmrg0501202414z.gz'), grid,
+                                           max_value=0)]
+        hrap_extents = find_hrap_extents_from_boundaries(BOUNDARIES, 1)
+        results = self.run_worker(hrap_extents=hrap_extents)['2024-05-01T14:00:00']
+        self.assertIsNone(results['Creek']['weighted_average'])
+        self.assertEqual(results['Creek']['valid_cell_fraction'], 0.0)
+        self.assertEqual(results['Inlet']['weighted_average'], 0.0)
+        self.assertEqual(results, self.run_worker(hrap_extents=hrap_extents,
+                                                  zero_rain_fast_path=False)['2024-05-01T14:00:00'])
+
+    def test_batched_hours_match_each_file(self):
+        rng = np.random.default_rng(11)
+        self.file_paths += [self.write_file('xmrg0501202414z.gz', np.zeros((30, 40), dtype=np.int16)),
+                            self.write_file('xmrg0501202415z.gz', rng.integers(-1, 100, (30, 40)).astype(np.int16))]
+        expected = self.run_worker()
+        results = self.run_worker(batch_hours=2)
+        self.assertEqual(sorted(results), sorted(expected))
+        for file_time, boundaries in expected.items():
+            for name, statistics in boundaries.items():
+                for statistic, value in statistics.items():
+                    if value is None:
+                        self.assertIsNone(results[file_time][name][statistic])
+                    else:
+                        self.assertAlmostEqual(results[file_time][name][statistic], value, places=9)
+        self.assertIsNotNone(next(result for result in self.results
+                                  if result.datetime == '2024-05-01T15:00:00').sparse_grid)
+
+    def test_missing_seek_indexes_are_not_built(self):
+        expected = self.run_worker()
+        self.assertEqual(self.run_worker(use_seek_index=True), expected)
+        self.assertFalse([file_name for file_name in os.listdir(self._temp_dir.name)
+                          if file_name.endswith(SEEK_INDEX_EXTENSION)])
+
+        # An index built ahead of time is used.
+        for file_path in self.file_paths:
+            xmrg_seek_index.build(file_path, chunk_size=200)
+        self.assertEqual(self.run_worker(use_seek_index=True), expected)
+
+    def test_day_without_24_hour_file_sums_the_hourly_files(self):
+        self.file_paths = [(os.path.join(self._temp_dir.name, '24hrxmrg05012024'), list(self.file_paths))]
+        # Only 2 of the day's hours, by default the day isn't totaled.
+        partial = self.run_worker()
+        # Dated at the end of the 24 hour period, not on the day's 00Z hour.
+        self.assertEqual(sorted(partial), ['2024-05-01T12:00:00'])
+        self.assertEqual([result.period_hours for result in self.results], [24])
+        for name in BOUNDARIES_NAMES:
+            self.assertEqual(partial['2024-05-01T12:00:00'][name]['summed_hours'], 2)
+            self.assertIsNone(partial['2024-05-01T12:00:00'][name]['weighted_average'])
+            self.assertEqual(partial['2024-05-01T12:00:00'][name]['valid_cell_fraction'], 0.0)
+
+        summed = self.run_worker(min_summed_hours=2)
+        self.assertEqual(summed['2024-05-01T12:00:00']['Creek']['summed_hours'], 2)
+
+        # The 24 hour file for the same day, missing cells in one hour drop out of the sum.
+        day_grid = sum(np.maximum(grid, 0) for grid in self.grids.values()).astype(np.int16)
+        self.file_paths = [self.write_file('24hrxmrg05012024.gz', day_grid)]
+        daily = self.run_worker()
+        self.assertEqual(sorted(daily), ['2024-05-01T12:00:00'])
+        self.assertEqual([result.period_hours for result in self.results], [24])
+        self.assertEqual(sorted(self.run_worker(day_end_hour=6)), ['2024-05-01T06:00:00'])
+        for name in BOUNDARIES_NAMES:
+            self.assertNotIn('summed_hours', daily['2024-05-01T12:00:00'][name])
+            for statistic, value in daily['2024-05-01T12:00:00'][name].items():
+                if value is None:
+                    self.assertIsNone(summed['2024-05-01T12:00:00'][name][statistic])
+                else:
+                    self.assertAlmostEqual(summed['2024-05-01T12:00:00'][name][statistic], value, places=9)
+        self.assertGreater(summed['2024-05-01T12:00:00']['Creek']['weighted_average'], 0.0)
+
+    def test_results_carry_the_sparse_grid(self):
+        self.run_worker()
+        result = next(result for result in self.results if result.datetime == '2024-05-01T12:00:00')
+        grid = self.grids['xmrg0501202412z.gz']
+        self.assertEqual(result.sparse_grid.cell_count, np.count_nonzero(result.sparse_grid.dense()))
+        self.assertEqual(set(result.get_boundary_names()), {'Creek', 'Inlet', 'Marsh', 'Offshore'})
+        self.assertEqual(len(result.get_boundary_cells('Offshore')), 0)
+
+        creek = result.get_boundary_grid('Creek')
+        self.assertGreater(len(creek), 0)
+        columns, rows = result.sparse_grid.hrap_cells(result.get_boundary_cells('Creek'))
+        np.testing.assert_allclose([precipitation for geometry, precipitation in creek],
+                                   grid[rows - YOR, columns - XOR] * 0.01)
+        self.assertTrue(all(geometry.intersects(shape(BOUNDARIES[0][1])) for geometry, precipitation in creek))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+from xmrgprocessing.boundary.boundariesparse import find_hrap_extents_from_boundaries
+from xmrgprocessing.boundary.boundary_weights import boundary_weights
+from xmrgprocessing.geoXmrg import geoXmrg
+from xmrgprocessing.xmrg_region_store import xmrg_region_store
+from xmrgprocessing.xmrgfileiterator.xmrg_cube_builder import xmrg_cube_builder
+
+from tests.xmrg_test_data import BOUNDARIES, XOR, write_xmrg_file
+
+
+class XmrgRegionStoreTests(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._temp_dir.cleanup)
+        self.xmrg_directory = os.path.join(self._temp_dir.name, 'xmrg')
+        os.makedirs(self.xmrg_directory)
+        rng = np.random.default_rng(5)
+        # No file for 14z.
+        for hour in (12, 13, 15):
+            date_time = datetime(2024, 5, 1, hour)
+            write_xmrg_file(os.path.join(self.xmrg_directory, date_time.strftime('xmrg%m%d%Y%Hz.gz')),
+                            rng.integers(-1, 300, (30, 40)).astype(np.int16))
+        extents = np.array(find_hrap_extents_from_boundaries(BOUNDARIES, 1))
+        self.hrap_extent = (int(extents[:, 0].min()), int(extents[:, 1].min()),
+                            int(extents[:, 2].max()), int(extents[:, 3].max()))
+        self.builder = xmrg_cube_builder(full_xmrg_path=self.xmrg_directory, thread_count=2)
+        self.store_directory = os.path.join(self._temp_dir.name, 'store')
+        # Small chunks so the hours span several chunk files.
+        store = xmrg_region_store.create(self.store_directory, self.hrap_extent, chunk_hours=3)
+        store.import_files(self.builder, datetime(2024, 5, 1, 12), datetime(2024, 5, 1, 16))
+
+    def test_store_matches_the_files(self):
+        store = xmrg_region_store(self.store_directory)
+        self.assertEqual(store.window.xor, XOR)
+        expected = self.builder.build(datetime(2024, 5, 1, 12), datetime(2024, 5, 1, 16),
+                                      hrap_extent=self.hrap_extent)
+        cube = store.read(datetime(2024, 5, 1, 12), datetime(2024, 5, 1, 16))
+        self.assertEqual(cube.times, expected.times)
+        self.assertEqual(cube.missing_hours, [datetime(2024, 5, 1, 14)])
+        np.testing.assert_array_equal(np.ma.getmaskarray(cube.data), np.ma.getmaskarray(expected.data))
+        np.testing.assert_array_equal(cube.data.filled(0), expected.data.filled(0))
+
+    def test_hours_not_imported_are_masked(self):
+        store = xmrg_region_store(self.store_directory)
+        cube = store.read(datetime(2024, 5, 1, 10), datetime(2024, 5, 1, 13))
+        self.assertEqual(cube.missing_hours, [datetime(2024, 5, 1, 10), datetime(2024, 5, 1, 11)])
+        self.assertFalse(np.ma.getmaskarray(cube.data)[2].any())
+
+    def test_statistics_from_the_store_match_the_file(self):
+        store = xmrg_region_store(self.store_directory)
+        store_xmrg = store.read(datetime(2024, 5, 1, 13), datetime(2024, 5, 1, 14)).xmrg(0)
+        xmrg = geoXmrg(None, None, hrap_extents=[self.hrap_extent])
+        xmrg.openFile(os.path.join(self.xmrg_directory, 'xmrg0501202413z.gz'), in_memory=True)
+        self.assertTrue(xmrg.readFileHeader())
+        self.assertTrue(xmrg.readAllRows())
+
+        weights = boundary_weights(BOUNDARIES)
+        weights.build(store_xmrg)
+        self.assertTrue(weights.is_current(xmrg))
+        expected = weights.statistics(xmrg)
+        for statistic, values in weights.statistics(store_xmrg).items():
+            np.testing.assert_array_equal(values, expected[statistic])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,26 @@
+import os
+import tempfile
+import unittest
+
+from xmrgprocessing.xmrg_utilities import atomic_write
+
+
+class AtomicWriteTests(unittest.TestCase):
+    def test_file_is_only_replaced_when_the_write_finishes(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, 'store.json')
+            with atomic_write(file_path, 'w') as output_file:
+                output_file.write('first')
+                self.assertFalse(os.path.exists(file_path))
+
+            with self.assertRaises(RuntimeError):
+                with atomic_write(file_path, 'w') as output_file:
+                    output_file.write('second')
+                    raise RuntimeError("Write failed")
+            with open(file_path) as input_file:
+                self.assertEqual(input_file.read(), 'first')
+            self.assertEqual(os.listdir(temp_dir), ['store.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
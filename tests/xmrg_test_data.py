@@ -0,0 +1,74 @@
+import gzip
+import struct
+
+import geopandas as gpd
+import pandas as pd
+
+from xmrgprocessing.boundary.boundary_weights import boundary_geometry
+
+# HRAP origin of the test grids.
+XOR = 1000
+YOR = 300
+
+
+def build_xmrg_bytes(grid, xor, yor, byte_order='<', max_value=0):
+    '''
+    Builds the contents of a 1999+ format XMRG file for the given int16 grid, row 0 is the southern most row.
+    '''
+    max_y, max_x = grid.shape
+    contents = [struct.pack(f'{byte_order}I4iI', 16, xor, yor, max_x, max_y, 16)]
+    info_header = struct.pack(f'{byte_order}2s8s10s10s8s10s10sif',
+                              b'LX', b'user', b'2024-05-01', b'12:00:00', b'QPE', b'2024-05-01',
+                              b'12:00:00', max_value, 1.0)
+    contents.append(struct.pack(f'{byte_order}I', 66) + info_header + struct.pack(f'{byte_order}I', 66))
+    row_tag = struct.pack(f'{byte_order}I', max_x * 2)
+    for row in grid.astype(f'{byte_order}i2'):
+        contents.append(row_tag + row.tobytes() + row_tag)
+    return b''.join(contents)
+
+
+def write_xmrg_file(file_path, grid, max_value=None):
+    '''
+    Writes the grid as an XMRG file at XOR, YOR, gzip compressed if the file name ends with .gz.
+    :param max_value: The info header max value, if None the grid's max.
+    '''
+    if max_value is None:
+        max_value = int(grid.max())
+    contents = build_xmrg_bytes(grid, XOR, YOR, max_value=max_value)
+    if file_path.endswith('.gz'):
+        contents = gzip.compress(contents)
+    with open(file_path, 'wb') as xmrg_file:
+        xmrg_file.write(contents)
+    return file_path
+
+
+def square_boundary(name, longitude, latitude, size):
+    return (name, {'type': 'Polygon',
+                   'coordinates': [[(longitude, latitude), (longitude, latitude + size),
+                                    (longitude + size, latitude + size), (longitude + size, latitude),
+                                    (longitude, latitude)]]})
+
+
+# Boundaries inside the test grids.
+BOUNDARIES = [square_boundary('Creek', -79.5, 30.5, 0.2),
+              square_boundary('Inlet', -79.23, 30.71, 0.13),
+              ('Marsh', {'type': 'Polygon',
+                         'coordinates': [[(-79.9, 30.6), (-79.7, 30.95), (-79.55, 30.62), (-79.9, 30.6)]]})]
+BOUNDARIES_NAMES = [boundary[0] for boundary in BOUNDARIES]
+
+
+# Equal area projection on the HRAP sphere, for reference areas without the EPSG:3857 distortion.
+EQUAL_AREA_CRS = "+proj=laea +lat_0=30.7 +lon_0=-79.5 +R=6371200 +units=m"
+
+
+def overlay_weighted_average(xmrg, boundary, crs=EQUAL_AREA_CRS):
+    '''
+    The per file overlay the weights replace, with the areas in an equal area projection.
+    '''
+    df = pd.DataFrame([[boundary[0], boundary_geometry(boundary[1])]], columns=['Name', 'Boundaries'])
+    boundary_df = gpd.GeoDataFrame(df, geometry=df.Boundaries).drop(columns=['Boundaries'])
+    boundary_df.set_crs(epsg=4326, inplace=True)
+    boundary_df.to_crs(crs, inplace=True)
+    overlayed = gpd.overlay(boundary_df, xmrg.geo_data_frame.to_crs(crs), how="intersection",
+                            keep_geom_type=False)
+    return sum(overlayed['Precipitation'] * (overlayed.area / boundary_df.area.iloc[0]))
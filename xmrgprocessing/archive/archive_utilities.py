@@ -3,14 +3,44 @@ import os
 import glob
 import string
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import pytz
 import json
 
+import pandas as pd
 from dateutil.relativedelta import relativedelta
 
+from xmrgprocessing.geoXmrg import geoXmrg
 from xmrgprocessing.xmrg_utilities import build_filename, get_collection_date_from_filename
 from xmrgprocessing.xmrg_utilities import http_download_file
+from xmrgprocessing.xmrg_seek_index import get_seek_index, SEEK_INDEX_EXTENSION
+
+HEADER_METADATA_COLUMNS = ['file_path', 'file_name', 'xor', 'yor', 'maxx', 'maxy', 'byte_swapped',
+                           'valid_date', 'valid_time', 'max_value', 'error']
+
+
+def read_file_header_metadata(file_path: str):
+    '''
+    Reads only the header of the XMRG file, a gzip file is only partially decompressed. No data is decoded.
+    :param file_path: Full path to the XMRG file.
+    :return: dict with the HEADER_METADATA_COLUMNS. If the header could not be read, error has the reason.
+    '''
+    metadata = dict.fromkeys(HEADER_METADATA_COLUMNS)
+    metadata['file_path'] = file_path
+    metadata['file_name'] = os.path.basename(file_path)
+    xmrg = geoXmrg(None, None)
+    try:
+        xmrg.openFileHeader(file_path)
+        if xmrg.readFileHeader():
+            metadata.update(xmrg.headerMetadata())
+        else:
+            metadata['error'] = xmrg.lastErrorMsg
+        xmrg.xmrgFile.close()
+    except Exception as e:
+        metadata['error'] = str(e)
+    return metadata
+
 
 class xmrg_archive_utilities:
     def __init__(self, archive_directory):
@@ -46,6 +76,51 @@ class xmrg_archive_utilities:
             file_list = glob.glob(file_filter)
         return file_list
 
+    def scan_file_headers(self, worker_count: int = 8, directory: str = None):
+        '''
+        Reads the header of every XMRG file under the directory tree without decoding any data. Useful to plan
+        backfills, find dry hours(max_value <= 0) or check grid extents.
+        :param worker_count: Number of threads reading headers.
+        :param directory: Directory tree to scan, defaults to the archive directory.
+        :return: pandas DataFrame with one row per file and the HEADER_METADATA_COLUMNS.
+        '''
+        scan_directory = directory if directory is not None else self._parent_directory
+        file_list = []
+        for dir_path, dir_names, file_names in os.walk(scan_directory):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                if file_name.find('xmrg') != -1 and not file_name.endswith(SEEK_INDEX_EXTENSION):
+                    file_list.append(os.path.join(dir_path, file_name))
+        self._logger.info(f"Scanning headers for {len(file_list)} files in {scan_directory}.")
+        with ThreadPoolExecutor(max_workers=worker_count) as executor:
+            header_metadata = list(executor.map(read_file_header_metadata, file_list))
+        return pd.DataFrame(header_metadata, columns=HEADER_METADATA_COLUMNS)
+
+    def build_seek_indexes(self, start_date, end_date, index_directory: str = None, worker_count: int = 4):
+        '''
+        Builds the gzip seek index for each archived file in the date range that doesn't already have a current one.
+        :param start_date: First hour to index.
+        :param end_date: Hour after the last hour to index.
+        :param index_directory: Directory to store the indexes in, if None they are stored beside the archive files.
+        :param worker_count: Number of threads building indexes.
+        :return: The number of files with a seek index.
+        '''
+        file_list = []
+        date_time = start_date
+        while date_time < end_date:
+            path = self._data_path_template.substitute(year=date_time.year, month=date_time.strftime("%b"))
+            file_path = os.path.join(self._parent_directory, path, build_filename(date_time, "gz"))
+            if os.path.exists(file_path):
+                file_list.append(file_path)
+            date_time += timedelta(hours=1)
+        if index_directory is not None:
+            os.makedirs(index_directory, exist_ok=True)
+        self._logger.info(f"Building seek indexes for {len(file_list)} files.")
+        with ThreadPoolExecutor(max_workers=worker_count) as executor:
+            seek_indexes = list(executor.map(lambda file_path: get_seek_index(file_path, index_directory),
+                                             file_list))
+        return sum(seek_index is not None for seek_index in seek_indexes)
+
     def scan_for_missing_data(self, from_date, to_date):
         '''
 
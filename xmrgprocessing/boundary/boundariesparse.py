@@ -1,11 +1,14 @@
 import csv
 import os
-from shapely import from_wkt, to_geojson, from_geojson
+import numpy as np
+from shapely import from_wkt, to_geojson, from_geojson, get_coordinates
 from shapely.geometry import MultiPolygon
 import geojson
 import geopandas as gpd
 import logging
 
+from xmrgprocessing.geoXmrg import geoXmrg
+
 
 class QueryBoundary:
     def __init__(self):
@@ -226,3 +229,58 @@ def find_bbox_from_boundaries(boundaries: [], buffer_percent: float):
     '''
     bbox = [(miny, minx), (maxy, maxx)]
     return bbox
+
+
+def boundary_geometry(boundary):
+    '''
+    Returns the shapely geometry for a boundary given as geojson or as a shapely geometry.
+    '''
+    if hasattr(boundary, 'geom_type'):
+        return boundary
+    return from_geojson(geojson.dumps(boundary))
+
+
+def find_hrap_extent(hrap_converter: geoXmrg, geometry, pad_cells: int = 1):
+    '''
+    Computes the HRAP extent of a geometry from its vertices, padded by pad_cells on each side.
+    :param hrap_converter: geoXmrg used for the lat/long to HRAP conversion.
+    :param geometry: shapely geometry in EPSG:4326.
+    :param pad_cells: Number of cells to add on each side of the extent.
+    :return: (start_col, start_row, end_col, end_row) absolute HRAP extent, the ends are exclusive.
+    '''
+    coordinates = get_coordinates(geometry)
+    columns, rows = hrap_converter.latLongsToHRAP(coordinates[:, 1], coordinates[:, 0])
+    return (int(np.floor(columns.min())) - pad_cells, int(np.floor(rows.min())) - pad_cells,
+            int(np.floor(columns.max())) + 1 + pad_cells, int(np.floor(rows.max())) + 1 + pad_cells)
+
+
+def find_hrap_extents_from_boundaries(boundaries: [], pad_cells: int = 1):
+    '''
+    Computes a tight HRAP extent for each boundary from its vertices, padded by pad_cells on each side. Extents
+    that overlap or touch are merged into one, so boundaries spread along a coast end up with a few small
+    windows instead of one large bbox.
+    :param boundaries: List of (name, geojson) boundary tuples.
+    :param pad_cells: Number of cells to add on each side of an extent.
+    :return: List of (start_col, start_row, end_col, end_row) absolute HRAP extents, the ends are exclusive.
+    '''
+    hrap_converter = geoXmrg(None, None)
+    extents = [list(find_hrap_extent(hrap_converter, boundary_geometry(boundary[1]), pad_cells))
+               for boundary in boundaries]
+
+    # Keep merging until no two extents overlap or touch.
+    merged = True
+    while merged:
+        merged = False
+        for ndx, extent in enumerate(extents):
+            for other_ndx in range(ndx + 1, len(extents)):
+                other = extents[other_ndx]
+                if (extent[0] <= other[2] and other[0] <= extent[2] and
+                        extent[1] <= other[3] and other[1] <= extent[3]):
+                    extents[ndx] = [min(extent[0], other[0]), min(extent[1], other[1]),
+                                    max(extent[2], other[2]), max(extent[3], other[3])]
+                    del extents[other_ndx]
+                    merged = True
+                    break
+            if merged:
+                break
+    return [tuple(extent) for extent in extents]
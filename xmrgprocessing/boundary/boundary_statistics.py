@@ -0,0 +1,132 @@
+import numpy as np
+
+# Precipitation, in mm, above which a boundary's area is counted in area_over_threshold. 25.4mm is an inch of rain.
+DEFAULT_RAIN_THRESHOLD = 25.4
+
+WEIGHTED_AVERAGE = 'weighted_average'
+MAXIMUM = 'max'
+COVERED_AREA_FRACTION = 'covered_area_fraction'
+AREA_OVER_THRESHOLD = 'area_over_threshold'
+VALID_CELL_FRACTION = 'valid_cell_fraction'
+STATISTICS = (WEIGHTED_AVERAGE, MAXIMUM, COVERED_AREA_FRACTION, AREA_OVER_THRESHOLD, VALID_CELL_FRACTION)
+
+
+def aggregate_statistics(boundary_index, weight, values, boundary_count, boundary_areas,
+                         threshold=DEFAULT_RAIN_THRESHOLD):
+    '''
+    Computes all the boundary statistics in one vectorized pass over the boundary/cell pieces. Negative values are
+    the missing data flags, those pieces are masked out rather than averaged in.
+    :param boundary_index: numpy array of the boundary each piece belongs to.
+    :param weight: numpy array of the fraction of its boundary's area each piece covers.
+    :param values: numpy array of the scaled precipitation of each piece's cell.
+    :param boundary_count: Number of boundaries.
+    :param boundary_areas: numpy array of each boundary's area in square kilometers.
+    :param threshold: Precipitation above which a piece is counted in area_over_threshold.
+    :return: Dict of statistic name to a numpy array with the value for each boundary:
+      weighted_average: area weighted mean of the valid cells.
+      max: largest valid value.
+      covered_area_fraction: fraction of the valid area with precipitation > 0.
+      area_over_threshold: square kilometers with precipitation > threshold.
+      valid_cell_fraction: fraction of the boundary's area covered by valid cells.
+      Statistics that need valid cells are NaN for boundaries without any.
+    '''
+    valid = values >= 0.0
+    valid_weight = np.where(valid, weight, 0.0)
+    valid_values = np.where(valid, values, 0.0)
+
+    valid_area = np.bincount(boundary_index, weights=valid_weight, minlength=boundary_count)
+    weighted_sum = np.bincount(boundary_index, weights=valid_weight * valid_values, minlength=boundary_count)
+    raining_area = np.bincount(boundary_index, weights=valid_weight * (valid_values > 0.0), minlength=boundary_count)
+    over_threshold = np.bincount(boundary_index, weights=valid_weight * (valid_values > threshold),
+                                 minlength=boundary_count)
+    maximum = np.full(boundary_count, -np.inf)
+    np.maximum.at(maximum, boundary_index[valid], values[valid])
+
+    has_valid = valid_area > 0.0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {
+            WEIGHTED_AVERAGE: np.where(has_valid, weighted_sum / valid_area, np.nan),
+            MAXIMUM: np.where(has_valid, maximum, np.nan),
+            COVERED_AREA_FRACTION: np.where(has_valid, raining_area / valid_area, np.nan),
+            AREA_OVER_THRESHOLD: over_threshold * np.asarray(boundary_areas, dtype=np.float64),
+            VALID_CELL_FRACTION: valid_area
+        }
+
+
+def aggregate_batch_statistics(values, piece_cells, piece_boundaries, piece_weight, boundary_count, boundary_areas,
+                               threshold=DEFAULT_RAIN_THRESHOLD):
+    '''
+    Computes all the boundary statistics for a block of hours at once. The pieces are sorted by boundary, so each
+    boundary's sums and max are reductions over its run of pieces for every hour together. Memory is hours x pieces,
+    there is no cell x boundary matrix. Negative values are masked the same as in aggregate_statistics.
+    :param values: (hours, cells) numpy array of the scaled precipitation of each cell the boundaries cover.
+    :param piece_cells: numpy array of the cell, a column of values, of each boundary/cell piece.
+    :param piece_boundaries: numpy array of the boundary of each piece, sorted.
+    :param piece_weight: numpy array of the fraction of its boundary's area each piece covers.
+    :param boundary_count: Number of boundaries.
+    :param boundary_areas: numpy array of each boundary's area in square kilometers.
+    :param threshold: Precipitation above which a cell is counted in area_over_threshold.
+    :return: Dict of statistic name to an (hours, boundaries) numpy array, see aggregate_statistics.
+    '''
+    values = np.asarray(values, dtype=np.float64)[:, piece_cells]
+    valid = values >= 0.0
+    valid_values = np.where(valid, values, 0.0)
+    run_starts = np.flatnonzero(np.diff(piece_boundaries, prepend=-1))
+    run_boundaries = piece_boundaries[run_starts]
+
+    def boundary_sums(piece_values):
+        sums = np.zeros((len(values), boundary_count))
+        if len(piece_cells) and len(values):
+            sums[:, run_boundaries] = np.add.reduceat(piece_values * piece_weight, run_starts, axis=1)
+        return sums
+
+    valid_area = boundary_sums(valid)
+    weighted_sum = boundary_sums(valid_values)
+    raining_area = boundary_sums(valid_values > 0.0)
+    over_threshold = boundary_sums(valid_values > threshold)
+    maximum = np.full((len(values), boundary_count), -np.inf)
+    if len(piece_cells) and len(values):
+        maximum[:, run_boundaries] = np.maximum.reduceat(np.where(valid, values, -np.inf), run_starts, axis=1)
+
+    has_valid = valid_area > 0.0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {
+            WEIGHTED_AVERAGE: np.where(has_valid, weighted_sum / valid_area, np.nan),
+            MAXIMUM: np.where(has_valid, maximum, np.nan),
+            COVERED_AREA_FRACTION: np.where(has_valid, raining_area / valid_area, np.nan),
+            AREA_OVER_THRESHOLD: over_threshold * np.asarray(boundary_areas, dtype=np.float64),
+            VALID_CELL_FRACTION: valid_area
+        }
+
+
+def dry_statistics(boundary_count):
+    '''
+    Statistics for a file with no rain, used when the grid isn't aggregated. Whether the cells were valid isn't
+    known, so valid_cell_fraction is NaN.
+    '''
+    statistics = {statistic: np.zeros(boundary_count) for statistic in STATISTICS}
+    statistics[VALID_CELL_FRACTION] = np.full(boundary_count, np.nan)
+    return statistics
+
+
+def missing_statistics(boundary_count):
+    '''
+    Statistics for a file with no valid data in the cells read, the same as aggregate_statistics gives for
+    boundaries with no valid cells.
+    '''
+    statistics = {statistic: np.full(boundary_count, np.nan) for statistic in STATISTICS}
+    statistics[AREA_OVER_THRESHOLD] = np.zeros(boundary_count)
+    statistics[VALID_CELL_FRACTION] = np.zeros(boundary_count)
+    return statistics
+
+
+def add_statistics_results(results, names, statistics):
+    '''
+    Stores each boundary's statistics with xmrg_results.add_boundary_result, NaN values are stored as None.
+    :param results: xmrg_results for the file.
+    :param names: Boundary names, in the order of the statistics arrays.
+    :param statistics: Dict from aggregate_statistics.
+    '''
+    for statistic, values in statistics.items():
+        for name, value in zip(names, values):
+            results.add_boundary_result(name, statistic, None if np.isnan(value) else float(value))
@@ -0,0 +1,461 @@
+import os
+import hashlib
+import math
+import logging
+import struct
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+from xmrgprocessing.boundary.boundariesparse import boundary_geometry
+from xmrgprocessing.boundary.boundary_statistics import (DEFAULT_RAIN_THRESHOLD, aggregate_batch_statistics,
+                                                         aggregate_statistics)
+from xmrgprocessing.boundary.hrap_clipping import cell_coverage, samples_for_error, supersampled_cell_coverage
+from xmrgprocessing.geoXmrg import geoXmrg, hrapSparseGrid
+from xmrgprocessing.xmrg_utilities import atomic_write
+
+# Bump when the way weights are computed changes so older cache files are no longer used.
+WEIGHT_CACHE_VERSION = 3
+WEIGHT_CACHE_EXTENSION = '.npz'
+
+# Edge cell pieces smaller than this fraction of a cell are rounding slivers from cells that only touch the boundary.
+MINIMUM_COVERAGE = 1e-9
+
+# Cell classes from classify_cells.
+EXTERIOR_CELL = 0
+INTERIOR_CELL = 1
+EDGE_CELL = 2
+
+
+def edge_cells(hrap_geometry):
+    '''
+    Finds the cells the boundary's rings pass through by walking each ring segment a column at a time, so the work
+    scales with the boundary's perimeter.
+    :param hrap_geometry: shapely geometry in HRAP coordinates.
+    :return: A (columns, rows) tuple of numpy arrays of absolute HRAP cells, cells may be repeated.
+    '''
+    columns = []
+    rows = []
+    for ring in shapely.get_rings(shapely.get_parts(hrap_geometry)):
+        coordinates = shapely.get_coordinates(ring)
+        for (x0, y0), (x1, y1) in zip(coordinates[:-1], coordinates[1:]):
+            if x1 < x0:
+                x0, y0, x1, y1 = x1, y1, x0, y0
+            segment_columns = np.arange(math.floor(x0), math.floor(x1) + 1)
+            if x1 > x0:
+                # The segment's y where it enters and leaves each column.
+                slope = (y1 - y0) / (x1 - x0)
+                y_enter = y0 + (np.clip(segment_columns, x0, x1) - x0) * slope
+                y_leave = y0 + (np.clip(segment_columns + 1, x0, x1) - x0) * slope
+            else:
+                y_enter = np.full(len(segment_columns), y0)
+                y_leave = np.full(len(segment_columns), y1)
+            low_rows = np.floor(np.minimum(y_enter, y_leave)).astype(np.int64)
+            row_counts = np.floor(np.maximum(y_enter, y_leave)).astype(np.int64) - low_rows + 1
+            columns.append(np.repeat(segment_columns, row_counts))
+            rows.append(np.repeat(low_rows, row_counts) + np.arange(row_counts.sum()) -
+                        np.repeat(np.cumsum(row_counts) - row_counts, row_counts))
+    if not columns:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(columns), np.concatenate(rows)
+
+
+def classify_cells(hrap_geometry):
+    '''
+    Classifies each cell in the boundary's extent as exterior, interior or edge. Edge cells are the cells a ring
+    passes through. The other cells in a row form runs that are either all inside or all outside the boundary,
+    so only one point per run is tested against the boundary.
+    :param hrap_geometry: shapely geometry in HRAP coordinates.
+    :return: A (start_col, start_row, cell_state) tuple, cell_state is an int8 array of the cell classes for the
+      extent starting at the absolute HRAP start_col, start_row.
+    '''
+    columns, rows = edge_cells(hrap_geometry)
+    if len(columns) == 0:
+        return 0, 0, np.zeros((0, 0), dtype=np.int8)
+    start_col = int(columns.min())
+    start_row = int(rows.min())
+    cell_state = np.full((int(rows.max()) - start_row + 1, int(columns.max()) - start_col + 1), EXTERIOR_CELL,
+                         dtype=np.int8)
+    cell_state[rows - start_row, columns - start_col] = EDGE_CELL
+
+    # Number the runs of non edge cells in each row and test the first cell of each run.
+    not_edge = cell_state != EDGE_CELL
+    run_start = not_edge.copy()
+    run_start[:, 1:] &= ~not_edge[:, :-1]
+    run_ids = np.cumsum(run_start.ravel()).reshape(cell_state.shape) - 1
+    start_rows, start_columns = np.nonzero(run_start)
+    shapely.prepare(hrap_geometry)
+    inside = shapely.contains_xy(hrap_geometry, start_columns + start_col + 0.5, start_rows + start_row + 0.5)
+    cell_state[not_edge & inside[run_ids]] = INTERIOR_CELL
+    return start_col, start_row, cell_state
+
+
+def grid_key(xmrg):
+    '''
+    Returns the key identifying the cells an xmrg file was read into. Weights built for one file apply to every
+    file with the same key.
+    :param xmrg: geoXmrg that has read its grid, or its hrapSparseGrid.
+    '''
+    return (xmrg.window, tuple(xmrg.windows))
+
+
+def grid_descriptor(xmrg):
+    '''
+    Returns the (XOR, YOR, MAXX, MAXY) of the file's grid.
+    '''
+    return (xmrg.XOR, xmrg.YOR, xmrg.MAXX, xmrg.MAXY)
+
+
+def weight_cache_key(geometry, descriptor, samples=0):
+    '''
+    Returns the cache key for a boundary's weights on a grid, a hash of the boundary's geometry and the grid
+    descriptor. The boundary name is not part of the key, renaming a boundary doesn't change its weights.
+    :param geometry: shapely geometry of the boundary.
+    :param descriptor: (XOR, YOR, MAXX, MAXY) of the grid.
+    :param samples: Sub-cells per side for supersampled weights, 0 for exact weights.
+    '''
+    key_hash = hashlib.sha1(struct.pack('<6i', WEIGHT_CACHE_VERSION, samples, *descriptor))
+    key_hash.update(shapely.to_wkb(geometry))
+    return key_hash.hexdigest()
+
+
+class boundary_cell_weights:
+    '''
+    The weights of one boundary on one grid. Cells are absolute HRAP columns and rows, so the weights don't
+    depend on which windows a file was read into.
+    '''
+    def __init__(self, columns, rows, weight, area):
+        self.columns = columns
+        self.rows = rows
+        self.weight = weight
+        # The boundary's area in square kilometers.
+        self.area = area
+
+    @classmethod
+    def compute(cls, geometry, xmrg, samples=0):
+        '''
+        Computes the weights in HRAP space, where the cells are unit squares. Interior cells are weighted by their
+        analytic area, only the edge cells are clipped against the boundary, with the row by row kernel in
+        hrap_clipping rather than a shapely polygon per cell. The boundary area is the sum of the cell pieces,
+        including the cells off the grid, so the weights of a boundary inside the grid sum to 1.
+        :param geometry: shapely geometry of the boundary in EPSG:4326.
+        :param xmrg: geoXmrg that has read its header.
+        :param samples: If greater than 0, the edge cell coverage is estimated on a samples x samples sub-cell grid
+          instead of being clipped exactly.
+        '''
+        hrap_converter = geoXmrg(None, None)
+        hrap_geometry = hrap_converter.hrapGeometry(geometry)
+        start_col, start_row, cell_state = classify_cells(hrap_geometry)
+        rows, columns = np.nonzero(cell_state != EXTERIOR_CELL)
+        edge = cell_state[rows, columns] == EDGE_CELL
+        columns = columns + start_col
+        rows = rows + start_row
+
+        coverage = np.ones(len(columns), dtype=np.float64)
+        if samples:
+            coverage[edge] = supersampled_cell_coverage(hrap_geometry, columns[edge], rows[edge], samples)
+        else:
+            coverage[edge] = cell_coverage(hrap_geometry, columns[edge], rows[edge])
+        coverage[coverage <= MINIMUM_COVERAGE] = 0.0
+        areas = coverage * hrap_converter.hrapCellAreas(columns, rows)
+        boundary_area = areas.sum()
+
+        on_grid = ((columns >= xmrg.XOR) & (columns < xmrg.XOR + xmrg.MAXX) &
+                   (rows >= xmrg.YOR) & (rows < xmrg.YOR + xmrg.MAXY) & (coverage > MINIMUM_COVERAGE))
+        return cls(columns[on_grid].astype(np.int32), rows[on_grid].astype(np.int32),
+                   areas[on_grid] / boundary_area, float(boundary_area))
+
+    @classmethod
+    def load(cls, file_path):
+        with np.load(file_path) as cache_file:
+            return cls(cache_file['columns'], cache_file['rows'], cache_file['weight'], float(cache_file['area']))
+
+    def save(self, file_path):
+        '''
+        Saves the weights with atomic_write, so other processes never load a partial file.
+        '''
+        with atomic_write(file_path) as cache_file:
+            np.savez(cache_file, columns=self.columns, rows=self.rows, weight=self.weight, area=self.area)
+
+
+class boundary_weights:
+    '''
+    A sparse boundary x grid cell matrix where each value is the fraction of the boundary's area the cell covers.
+    The fractions only depend on the boundary and grid geometry, which are the same for every hour in a run, so the
+    overlay is done once and each file's weighted averages are a sparse matrix-vector product against its grid.
+    The matrix is stored in COO form, the boundary_index, cell_index and weight arrays, sorted by boundary.
+    cell_index is the flat index into the geoXmrg grid.
+
+    Each boundary's weights are computed on their own and, if a cache directory is given, saved there keyed by
+    the boundary geometry and grid descriptor. Later runs and the other worker processes load them instead of
+    redoing the overlay, and when a boundary changes only its weights are recomputed.
+
+    For backfills, batch_statistics aggregates a block of hours at once, reducing the hour x piece values over each
+    boundary's run of weights for all the hours together.
+
+    With a coverage_error the edge cells are supersampled rather than clipped exactly, trading accuracy for speed
+    on large boundary sets. deviation_report measures what that costs against gpd.overlay.
+    '''
+    def __init__(self, boundaries, cache_directory=None, coverage_error=None):
+        '''
+        :param boundaries: List of (name, geojson) boundary tuples.
+        :param cache_directory: Directory the per boundary weights are cached in, None to not cache them on disk.
+        :param coverage_error: Largest error allowed in the covered fraction of an edge cell, None for exact weights.
+        '''
+        self._logger = logging.getLogger()
+        self._names = [boundary[0] for boundary in boundaries]
+        self._geometries = [boundary_geometry(boundary[1]) for boundary in boundaries]
+        self._cache_directory = cache_directory
+        self._samples = 0 if coverage_error is None else samples_for_error(coverage_error)
+        # Per boundary weights by cache key, so rebuilding for a new window doesn't redo any overlays.
+        self._cell_weights = {}
+        self._grid_key = None
+        self._boundary_index = np.empty(0, dtype=np.int64)
+        self._cell_index = np.empty(0, dtype=np.int64)
+        self._weight = np.empty(0, dtype=np.float64)
+        self._boundary_area = np.zeros(len(self._names), dtype=np.float64)
+        # The boundary/cell intersection in EPSG:4326 for each weight, only built for the debug output.
+        self._cell_geometry = None
+        # The distinct cells the boundaries cover and each weight's position in them, only built for batch_statistics.
+        self._batch_cells = None
+        self._piece_cells = None
+
+    @property
+    def names(self):
+        return self._names
+
+    @property
+    def boundary_index(self):
+        return self._boundary_index
+
+    @property
+    def cell_index(self):
+        return self._cell_index
+
+    @property
+    def weight(self):
+        return self._weight
+
+    def is_current(self, xmrg):
+        '''
+        :param xmrg: geoXmrg that has read its grid, or its hrapSparseGrid.
+        :return: True if the weights were built for the same cells the file was read into.
+        '''
+        return self._grid_key == grid_key(xmrg)
+
+    def cache_path(self, cache_key):
+        return os.path.join(self._cache_directory, f"{cache_key}{WEIGHT_CACHE_EXTENSION}")
+
+    def _get_cell_weights(self, geometry, xmrg):
+        '''
+        Returns the boundary's weights for the file's grid, from memory, the cache directory or computed.
+        '''
+        cache_key = weight_cache_key(geometry, grid_descriptor(xmrg), self._samples)
+        cell_weights = self._cell_weights.get(cache_key)
+        if cell_weights is None and self._cache_directory is not None:
+            cache_path = self.cache_path(cache_key)
+            if os.path.exists(cache_path):
+                try:
+                    cell_weights = boundary_cell_weights.load(cache_path)
+                except Exception as e:
+                    self._logger.error(f"Unable to load cached weights: {cache_path}. {e}")
+        if cell_weights is None:
+            cell_weights = boundary_cell_weights.compute(geometry, xmrg, self._samples)
+            if self._cache_directory is not None:
+                try:
+                    os.makedirs(self._cache_directory, exist_ok=True)
+                    cell_weights.save(self.cache_path(cache_key))
+                except Exception as e:
+                    self._logger.exception(f"Unable to cache weights in: {self._cache_directory}. {e}")
+        self._cell_weights[cache_key] = cell_weights
+        return cell_weights
+
+    def build(self, xmrg):
+        '''
+        Builds the weights for the cells the file was read into. Cells outside the windows that were read are
+        dropped, the same as the per file overlay.
+        :param xmrg: geoXmrg that has read its grid.
+        '''
+        window = xmrg.window
+        cell_mask = xmrg.cell_mask.ravel()
+        boundary_index = []
+        cell_index = []
+        weight = []
+        for ndx, geometry in enumerate(self._geometries):
+            cell_weights = self._get_cell_weights(geometry, xmrg)
+            columns = cell_weights.columns - (window.xor + window.start_col)
+            rows = cell_weights.rows - (window.yor + window.start_row)
+            in_window = (columns >= 0) & (columns < window.columns) & (rows >= 0) & (rows < window.rows)
+            cells = rows[in_window].astype(np.int64) * window.columns + columns[in_window]
+            read = cell_mask[cells]
+            cell_index.append(cells[read])
+            weight.append(cell_weights.weight[in_window][read])
+            boundary_index.append(np.full(len(cell_index[-1]), ndx, dtype=np.int64))
+            self._boundary_area[ndx] = cell_weights.area
+
+        self._boundary_index = np.concatenate(boundary_index) if boundary_index else np.empty(0, dtype=np.int64)
+        self._cell_index = np.concatenate(cell_index) if cell_index else np.empty(0, dtype=np.int64)
+        self._weight = np.concatenate(weight) if weight else np.empty(0, dtype=np.float64)
+        self._cell_geometry = None
+        self._batch_cells = None
+        self._piece_cells = None
+        self._grid_key = grid_key(xmrg)
+        self._logger.info(f"Built {len(self._weight)} weights for {len(self._names)} boundaries.")
+
+    def cell_values(self, xmrg):
+        '''
+        :param xmrg: geoXmrg that has read its grid, or its hrapSparseGrid.
+        :return: The scaled precipitation value of the cell for each weight.
+        '''
+        if isinstance(xmrg, hrapSparseGrid):
+            return xmrg.values_at(self._cell_index) * xmrg.data_multiplier
+        return xmrg.grid.ravel()[self._cell_index] * xmrg.data_multiplier
+
+    def boundary_cells(self, boundary):
+        '''
+        :param boundary: Index of the boundary in names.
+        :return: numpy array of the flat grid indices of the cells the boundary covers.
+        '''
+        return self._cell_index[self._boundary_index == boundary]
+
+    def weighted_averages(self, xmrg):
+        '''
+        :param xmrg: geoXmrg that has read its grid, or its hrapSparseGrid. The weights must be current for it.
+        :return: numpy array with the weighted sum of the cell values for each boundary, in the order of names.
+          Missing data cells are not masked, see statistics for the masked weighted_average.
+        '''
+        return np.bincount(self._boundary_index, weights=self._weight * self.cell_values(xmrg),
+                           minlength=len(self._names))
+
+    def statistics(self, xmrg, threshold=DEFAULT_RAIN_THRESHOLD):
+        '''
+        Computes all the boundary statistics in one pass, with the missing data cells masked out. See
+        boundary_statistics.aggregate_statistics.
+        :param xmrg: geoXmrg that has read its grid, or its hrapSparseGrid. The weights must be current for it.
+        :param threshold: Precipitation above which a boundary's area is counted in area_over_threshold.
+        :return: Dict of statistic name to a numpy array with the value for each boundary, in the order of names.
+        '''
+        return aggregate_statistics(self._boundary_index, self._weight, self.cell_values(xmrg), len(self._names),
+                                    self._boundary_area, threshold)
+
+    def batch_cells(self):
+        '''
+        :return: A (cells, piece_cells) tuple. cells is a numpy array of the distinct flat grid indices the
+          boundaries cover, piece_cells the position in cells of each weight's cell.
+        '''
+        if self._batch_cells is None:
+            self._batch_cells, self._piece_cells = np.unique(self._cell_index, return_inverse=True)
+        return self._batch_cells, self._piece_cells
+
+    def cell_value_matrix(self, xmrgs):
+        '''
+        :param xmrgs: List of geoXmrg that have read their grids, or their hrapSparseGrid, one per hour. The weights
+          must be current for all of them.
+        :return: (hours, cells) numpy array of the scaled precipitation of the cells in batch_cells.
+        '''
+        cells, piece_cells = self.batch_cells()
+        values = np.empty((len(xmrgs), len(cells)), dtype=np.float64)
+        for hour, xmrg in enumerate(xmrgs):
+            if isinstance(xmrg, hrapSparseGrid):
+                values[hour] = xmrg.values_at(cells) * xmrg.data_multiplier
+            else:
+                values[hour] = xmrg.grid.ravel()[cells] * xmrg.data_multiplier
+        return values
+
+    def batch_statistics(self, xmrgs, threshold=DEFAULT_RAIN_THRESHOLD):
+        '''
+        Computes all the boundary statistics for a block of hours at once, see
+        boundary_statistics.aggregate_batch_statistics. Gives the same values as statistics for each hour.
+        :param xmrgs: List of geoXmrg that have read their grids, or their hrapSparseGrid, one per hour. The weights
+          must be current for all of them.
+        :param threshold: Precipitation above which a boundary's area is counted in area_over_threshold.
+        :return: Dict of statistic name to an (hours, boundaries) numpy array, the boundaries in the order of names.
+        '''
+        cells, piece_cells = self.batch_cells()
+        return aggregate_batch_statistics(self.cell_value_matrix(xmrgs), piece_cells, self._boundary_index,
+                                          self._weight, len(self._names), self._boundary_area, threshold)
+
+    def cell_geometries(self, xmrg):
+        '''
+        :param xmrg: geoXmrg that has read its grid, the weights must be current for it.
+        :return: numpy array with the boundary/cell intersection in EPSG:4326 for each weight.
+        '''
+        if self._cell_geometry is None:
+            frame_row = np.full(xmrg.window.rows * xmrg.window.columns, -1, dtype=np.int64)
+            cell_indices = xmrg.cellIndices()
+            frame_row[cell_indices] = np.arange(len(cell_indices))
+            cells = xmrg.geo_data_frame.geometry.values[frame_row[self._cell_index]]
+            boundaries = np.array(self._geometries, dtype=object)[self._boundary_index]
+            self._cell_geometry = shapely.intersection(boundaries, np.asarray(cells))
+        return self._cell_geometry
+
+    def grid_cells(self, xmrg):
+        '''
+        Generator of (name, geometry, precipitation) for each boundary/cell intersection.
+        :param xmrg: geoXmrg that has read its grid, the weights must be current for it.
+        '''
+        for boundary, geometry, value in zip(self._boundary_index, self.cell_geometries(xmrg),
+                                             self.cell_values(xmrg)):
+            yield self._names[boundary], geometry, value
+
+    def boundary_frame(self, xmrg, boundary):
+        '''
+        Returns the boundary/cell intersections of one boundary as a GeoDataFrame in EPSG:4326, with the same
+        columns the per file overlay produces. Used for the debug output.
+        :param xmrg: geoXmrg that has read its grid, the weights must be current for it.
+        :param boundary: Index of the boundary in names.
+        '''
+        rows = self._boundary_index == boundary
+        values = self.cell_values(xmrg)[rows]
+        return gpd.GeoDataFrame({'Name': self._names[boundary],
+                                 'Precipitation': values,
+                                 'percent': self._weight[rows],
+                                 'weighted average': values * self._weight[rows]},
+                                geometry=self.cell_geometries(xmrg)[rows],
+                                crs="EPSG:4326")
+
+    def deviation_report(self, xmrg, sample_size=10, random_seed=None):
+        '''
+        Compares the weights against an exact gpd.overlay of the boundary and the cell polygons for a random sample
+        of the boundaries. Each overlay uses a Lambert azimuthal equal area projection on the HRAP sphere centered
+        on the boundary, so the comparison isn't skewed by EPSG:3857 areas.
+        :param xmrg: geoXmrg that has read its grid, the weights must be current for it.
+        :param sample_size: Number of boundaries to compare.
+        :param random_seed: Seed for picking the sample.
+        :return: pandas DataFrame with a row per sampled boundary: Name, weighted_average, overlay_weighted_average,
+          weighted_average_deviation and max_weight_deviation, the largest difference in a cell's weight.
+        '''
+        rng = np.random.default_rng(random_seed)
+        sample = np.sort(rng.choice(len(self._names), min(sample_size, len(self._names)), replace=False))
+        cells = gpd.GeoDataFrame({'Cell': xmrg.cellIndices()},
+                                 geometry=xmrg.geo_data_frame.geometry.values,
+                                 crs=xmrg.geo_data_frame.crs)
+        grid_values = xmrg.grid.ravel() * xmrg.data_multiplier
+        weighted_averages = self.weighted_averages(xmrg)
+        report = []
+        for boundary in sample:
+            geometry = self._geometries[boundary]
+            centroid = geometry.centroid
+            crs = (f"+proj=laea +lat_0={centroid.y} +lon_0={centroid.x} +R={xmrg.earthRadius * 1000.0} "
+                   f"+units=m")
+            boundary_frame = gpd.GeoDataFrame(geometry=[geometry], crs="EPSG:4326").to_crs(crs)
+            candidate_cells = cells.iloc[xmrg.queryCells(geometry)]
+            overlayed = gpd.overlay(boundary_frame, candidate_cells.to_crs(crs), how="intersection",
+                                    keep_geom_type=False)
+            overlay_weights = pd.Series(overlayed.area.to_numpy() / boundary_frame.area.iloc[0],
+                                        index=overlayed['Cell'].to_numpy()).groupby(level=0).sum()
+
+            rows = self._boundary_index == boundary
+            weights = pd.Series(self._weight[rows], index=self._cell_index[rows])
+            weights, overlay_weights = weights.align(overlay_weights, fill_value=0.0)
+            overlay_average = float((overlay_weights * grid_values[overlay_weights.index.to_numpy()]).sum())
+            report.append({'Name': self._names[boundary],
+                           'weighted_average': weighted_averages[boundary],
+                           'overlay_weighted_average': overlay_average,
+                           'weighted_average_deviation': weighted_averages[boundary] - overlay_average,
+                           'max_weight_deviation': float((weights - overlay_weights).abs().max())
+                           if len(weights) else 0.0})
+        return pd.DataFrame(report, columns=['Name', 'weighted_average', 'overlay_weighted_average',
+                                             'weighted_average_deviation', 'max_weight_deviation'])
@@ -0,0 +1,159 @@
+import math
+
+import numpy as np
+import shapely
+
+
+def polygon_rings(hrap_geometry):
+    '''
+    Returns the rings of a polygon or multipolygon with the sign each ring's area is counted with, so exterior
+    rings add area and holes remove it whatever way the rings are wound.
+    :param hrap_geometry: shapely geometry in HRAP coordinates.
+    :return: List of (coordinates, sign) tuples, coordinates is an (N, 2) array without the closing point.
+    '''
+    rings = []
+    for polygon in shapely.get_parts(hrap_geometry):
+        for ndx, ring in enumerate(shapely.get_rings(polygon)):
+            coordinates = shapely.get_coordinates(ring)[:-1]
+            if len(coordinates) < 3:
+                continue
+            ccw = shapely.is_ccw(ring)
+            # The first ring is the exterior, the rest are holes.
+            rings.append((coordinates, 1.0 if ccw == (ndx == 0) else -1.0))
+    return rings
+
+
+def clip_ring_to_half_plane(coordinates, axis, limit, keep_below):
+    '''
+    Sutherland-Hodgman clip of a ring against one axis aligned half plane, vectorized over the ring's edges.
+    The ring may be concave, the clipped ring can then have zero width bridges along the clip line but its
+    area is exact.
+    :param coordinates: (N, 2) array of the ring without the closing point.
+    :param axis: 0 to clip on x, 1 to clip on y.
+    :param limit: Coordinate of the clip line.
+    :param keep_below: True to keep the side where the coordinate is <= limit, False for >= limit.
+    :return: (M, 2) array of the clipped ring.
+    '''
+    if len(coordinates) == 0:
+        return coordinates
+    start = coordinates
+    end = np.roll(coordinates, -1, axis=0)
+    start_inside = start[:, axis] <= limit if keep_below else start[:, axis] >= limit
+    end_inside = np.roll(start_inside, -1)
+    crosses = start_inside != end_inside
+
+    delta = end[:, axis] - start[:, axis]
+    t = np.divide(limit - start[:, axis], delta, out=np.zeros(len(delta)), where=crosses)
+    intersections = start + t[:, np.newaxis] * (end - start)
+    intersections[:, axis] = limit
+
+    # Each edge outputs its start point if it is inside, then the crossing point if the edge crosses the line.
+    points = np.stack([start, intersections], axis=1).reshape(-1, 2)
+    keep = np.stack([start_inside, crosses], axis=1).ravel()
+    return points[keep]
+
+
+def ring_area_left_of(coordinates, x):
+    '''
+    Signed area of the part of a ring left of each vertical line x, positive for counter clockwise rings.
+    Uses area = -integral(y dx) around the ring; the clip line is vertical so it adds nothing, and only each
+    edge's span left of the line is integrated.
+    :param coordinates: (N, 2) array of the ring without the closing point.
+    :param x: numpy array of the vertical lines.
+    :return: numpy array with the area for each x.
+    '''
+    x0 = coordinates[:, 0]
+    y0 = coordinates[:, 1]
+    x1 = np.roll(x0, -1)
+    y1 = np.roll(y0, -1)
+    low = np.minimum(x0, x1)[:, np.newaxis]
+    high = np.maximum(x0, x1)[:, np.newaxis]
+    width = (high - low)[:, 0]
+    slope = np.divide(y1 - y0, x1 - x0, out=np.zeros(len(x0)), where=width > 0)[:, np.newaxis]
+    y_low = np.where(x0 <= x1, y0, y1)[:, np.newaxis]
+
+    upper = np.clip(np.asarray(x, dtype=np.float64)[np.newaxis, :], low, high)
+    span = upper - low
+    integral = span * (y_low + 0.5 * slope * span)
+    # Edges running right are integrated forwards and subtract, edges running left add.
+    direction = np.where(x0 < x1, -1.0, 1.0)[:, np.newaxis]
+    return (direction * integral).sum(axis=0)
+
+
+def row_coverage(rings, row, start_col, end_col):
+    '''
+    Exact area of the polygon in each unit square cell of one HRAP row. The rings are clipped to the row's
+    band, then the area left of each column line is differenced.
+    :param rings: Rings from polygon_rings.
+    :param row: Absolute HRAP row.
+    :param start_col: First absolute HRAP column.
+    :param end_col: Column after the last column.
+    :return: numpy array with the covered fraction of each cell from start_col to end_col.
+    '''
+    column_lines = np.arange(start_col, end_col + 1, dtype=np.float64)
+    coverage = np.zeros(end_col - start_col, dtype=np.float64)
+    for coordinates, sign in rings:
+        band = clip_ring_to_half_plane(coordinates, 1, row, False)
+        band = clip_ring_to_half_plane(band, 1, row + 1, True)
+        if len(band) < 3:
+            continue
+        coverage += sign * np.diff(ring_area_left_of(band, column_lines))
+    return coverage
+
+
+def cell_coverage(hrap_geometry, columns, rows):
+    '''
+    Exact area of the polygon in each of the HRAP cells, computed a row at a time. No shapely geometry is built
+    for the cells.
+    :param hrap_geometry: shapely polygon or multipolygon in HRAP coordinates.
+    :param columns: numpy array of absolute HRAP columns.
+    :param rows: numpy array of absolute HRAP rows, same shape as columns.
+    :return: numpy array with the covered fraction of each cell.
+    '''
+    rings = polygon_rings(hrap_geometry)
+    coverage = np.zeros(len(columns), dtype=np.float64)
+    if len(columns) == 0:
+        return coverage
+    ring_rows = [(coordinates[:, 1].min(), coordinates[:, 1].max()) for coordinates, sign in rings]
+    for row in np.unique(rows):
+        in_row = rows == row
+        row_columns = columns[in_row]
+        start_col = int(row_columns.min())
+        # Only the rings that reach into the row's band.
+        row_rings = [ring for ring, (low, high) in zip(rings, ring_rows) if low < row + 1 and high > row]
+        values = row_coverage(row_rings, int(row), start_col, int(row_columns.max()) + 1)
+        coverage[in_row] = values[row_columns - start_col]
+    return coverage
+
+
+def samples_for_error(coverage_error):
+    '''
+    Returns the number of sub-cells per side needed to keep the supersampled coverage of a cell within
+    coverage_error. A straight edge crossing an N x N sub-cell grid can misclassify at most one sub-cell
+    per sub-column, an error of at most 1/N.
+    :param coverage_error: Largest error allowed in the covered fraction of a cell, greater than 0.
+    '''
+    return max(1, int(math.ceil(1.0 / coverage_error)))
+
+
+def supersampled_cell_coverage(hrap_geometry, columns, rows, samples, chunk_size=4096):
+    '''
+    Estimates the area of the polygon in each of the HRAP cells by testing the centers of an N x N sub-cell grid
+    in each cell. The cost depends on the number of sub-cells rather than on the polygon's vertex count.
+    :param hrap_geometry: shapely polygon or multipolygon in HRAP coordinates.
+    :param columns: numpy array of absolute HRAP columns.
+    :param rows: numpy array of absolute HRAP rows, same shape as columns.
+    :param samples: Number of sub-cells per side, see samples_for_error.
+    :param chunk_size: Number of cells tested at a time, to bound the memory for the sample points.
+    :return: numpy array with the estimated covered fraction of each cell.
+    '''
+    shapely.prepare(hrap_geometry)
+    offsets = (np.arange(samples, dtype=np.float64) + 0.5) / samples
+    coverage = np.zeros(len(columns), dtype=np.float64)
+    for start in range(0, len(columns), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        x = columns[chunk, np.newaxis, np.newaxis] + offsets[np.newaxis, np.newaxis, :]
+        y = rows[chunk, np.newaxis, np.newaxis] + offsets[np.newaxis, :, np.newaxis]
+        inside = shapely.contains_xy(hrap_geometry, *np.broadcast_arrays(x, y))
+        coverage[chunk] = inside.mean(axis=(1, 2))
+    return coverage
@@ -1,18 +1,31 @@
 import sys
 import os
 import time
-import pandas as pd
 import geopandas as gpd
 import array
 import struct
 import re
 
-from shapely.geometry import Polygon
+import numpy as np
+import shapely
 import logging
 import logging.handlers
 import gzip
+import io
 import shutil
 import math
+from dataclasses import dataclass
+
+# The cell polygons only depend on the grid geometry(XOR, YOR, MAXX, MAXY) and the bbox window, which are the
+# same for every hour in a run. They are built once per process and reused for every file with the same header.
+CELL_GEOMETRY_CACHE_SIZE = 8
+_cell_geometry_cache = {}
+# Spatial indexes over the cell polygons, cached the same way by the windows the file was read into.
+_cell_tree_cache = {}
+
+# The grid header record(tag, XOR, YOR, MAXX, MAXY, tag) plus the 1999+ info header record with its tags.
+# This covers every header format, so it is all we need to read from a file to parse its header.
+HEADER_BYTE_COUNT = 24 + 4 + 66 + 4
 
 
 class hrapCoord(object):
@@ -27,8 +40,104 @@ class LatLong(object):
         self.longitude = long
 
 
+@dataclass(frozen=True)
+class hrapWindow:
+    '''
+    A rectangular window of cells in an XMRG grid. The grid geometry is part of the window, so two windows
+    are only equal when they cover the same cells of the same grid. Rows and columns are relative to the
+    file origin(XOR, YOR), the end row and column are exclusive.
+    '''
+    xor: int
+    yor: int
+    maxx: int
+    maxy: int
+    start_col: int
+    start_row: int
+    end_col: int
+    end_row: int
+
+    @property
+    def rows(self):
+        return self.end_row - self.start_row
+
+    @property
+    def columns(self):
+        return self.end_col - self.start_col
+
+    @property
+    def shape(self):
+        return (self.rows, self.columns)
+
+    @property
+    def transform(self):
+        '''
+        Affine transform(a, b, c, d, e, f) from window (column, row) to HRAP (x, y):
+        x = a * column + b * row + c, y = d * column + e * row + f. HRAP cells are unit squares.
+        '''
+        return (1.0, 0.0, float(self.xor + self.start_col), 0.0, 1.0, float(self.yor + self.start_row))
+
+    @classmethod
+    def bounds(cls, windows):
+        '''
+        Returns the smallest window containing all the windows, which must be for the same grid.
+        '''
+        first = windows[0]
+        return cls(first.xor, first.yor, first.maxx, first.maxy,
+                   min(window.start_col for window in windows), min(window.start_row for window in windows),
+                   max(window.end_col for window in windows), max(window.end_row for window in windows))
+
+
+@dataclass(frozen=True, eq=False)
+class hrapSparseGrid:
+    '''
+    The non zero cells of a grid in COO form, the flat cell indices into the window's grid and their raw values.
+    Missing data flags are negative so they are kept. Most cells are 0 even on rainy hours, so this is much
+    smaller to keep and to pickle between processes than the grid or its cell polygons.
+    '''
+    window: hrapWindow
+    windows: tuple
+    cell_index: np.ndarray
+    values: np.ndarray
+    data_multiplier: float
+
+    @property
+    def cell_count(self):
+        return len(self.cell_index)
+
+    def values_at(self, cell_index):
+        '''
+        :param cell_index: numpy array of flat cell indices into the window's grid.
+        :return: numpy array of the raw values of the cells, 0 for the cells that aren't stored.
+        '''
+        cell_index = np.asarray(cell_index)
+        positions = np.minimum(np.searchsorted(self.cell_index, cell_index), max(len(self.cell_index) - 1, 0))
+        values = np.zeros(cell_index.shape, dtype=self.values.dtype)
+        if len(self.cell_index):
+            found = self.cell_index[positions] == cell_index
+            values[found] = self.values[positions[found]]
+        return values
+
+    def dense(self):
+        '''
+        :return: The window's grid as a numpy array.
+        '''
+        grid = np.zeros(self.window.rows * self.window.columns, dtype=self.values.dtype)
+        grid[self.cell_index] = self.values
+        return grid.reshape(self.window.shape)
+
+    def hrap_cells(self, cell_index=None):
+        '''
+        :param cell_index: numpy array of flat cell indices, if None the stored cells.
+        :return: A (columns, rows) tuple of numpy arrays of the absolute HRAP cells.
+        '''
+        if cell_index is None:
+            cell_index = self.cell_index
+        rows, columns = np.divmod(np.asarray(cell_index), self.window.columns)
+        return (columns + self.window.xor + self.window.start_col, rows + self.window.yor + self.window.start_row)
+
+
 class geoXmrg:
-    def __init__(self, minimum_lat_lon, maximum_lat_lon, data_multiplier=0.01):
+    def __init__(self, minimum_lat_lon, maximum_lat_lon, data_multiplier=0.01, hrap_extents=None):
         self.logger = logging.getLogger()
 
         self.fileName = ''
@@ -44,14 +153,77 @@ class geoXmrg:
         self._minimum_lat_lon = minimum_lat_lon
         self._maximum_lat_lon = maximum_lat_lon
         self._data_multiplier = data_multiplier
+        # Optional list of (start_col, start_row, end_col, end_row) absolute HRAP extents. When given, only the cells
+        # in these extents are read instead of the cells in the bounding box.
+        self._hrap_extents = hrap_extents
 
         self._epsg = 4326
         self._geo_data_frame = None
+        self._grid = None
+        self._window = None
+        self._windows = []
+        self._cell_mask = None
+        self._data_offset = 0
+        # When the file is decompressed in memory, this holds the uncompressed file contents.
+        self._file_buffer = None
+        # When set, the data records of an uncompressed file are read through a memory map.
+        self._use_mmap = False
+        # When set, an xmrg_seek_index used to decompress only the parts of a gzip file we read.
+        self._seek_index = None
 
     @property
     def geo_data_frame(self):
+        '''
+        The cells of the window as a GeoDataFrame with the scaled Precipitation column. It is only built the first
+        time it is used, callers that just need the numbers should use grid, data_multiplier and nodata_mask.
+        '''
+        if self._geo_data_frame is None and self._grid is not None:
+            self._geo_data_frame = self._build_geo_data_frame()
         return self._geo_data_frame
 
+    @property
+    def grid(self):
+        '''
+        The raw int16 values of the window read by readGrid or readAllRows, row 0 is the southern most row.
+        '''
+        return self._grid
+
+    @property
+    def window(self):
+        return self._window
+
+    @property
+    def windows(self):
+        '''
+        The windows that were read. The grid and window cover all of them, cells outside them are 0 in the grid and
+        False in cell_mask.
+        '''
+        return self._windows
+
+    @property
+    def cell_mask(self):
+        '''
+        Boolean array the shape of the grid, True for the cells that were read.
+        '''
+        if self._grid is None:
+            return None
+        if self._cell_mask is None:
+            return np.ones(self._grid.shape, dtype=bool)
+        return self._cell_mask
+
+    @property
+    def data_multiplier(self):
+        return self._data_multiplier
+
+    @property
+    def nodata_mask(self):
+        '''
+        Boolean array, True where the grid value is a negative missing/no data flag.
+        '''
+        if self._grid is None:
+            return None
+        return self._grid < 0
+
     """
       Function: Reset
       Purpose: Prepares the xmrgFile object for reuse. Resets various variables and closes the currently open file object.
@@ -62,36 +234,87 @@ class geoXmrg:
     def Reset(self):
         self.fileName = ''
         self.lastErrorMsg = ''
+        self._file_buffer = None
+        self._seek_index = None
         self.xmrgFile.close()
 
-    def uncompress(self, file_name: str):
+    def uncompress(self, file_name: str, in_memory=False):
         directory, xmrg_filename = os.path.split(file_name)
         xmrg_filename, xmrg_extension = os.path.splitext(xmrg_filename)
-        # Is the file compressed? If so, we want to uncompress it to a file for use.
-        # The reason for not working with the GzipFile object directly is it is not compatible
-        # with the array.fromfile() functionality.
+        # Is the file compressed? If so, we want to uncompress it to a file for use, or if in_memory is set,
+        # into a buffer we parse directly. When in memory, fileName is still set to the uncompressed name
+        # but no file is written.
         if xmrg_extension == '.gz':
             self.compressedFilepath = file_name
             try:
                 self.fileName = os.path.join(directory, xmrg_filename)
-                with gzip.GzipFile(file_name, 'rb') as zipFile, open(self.fileName, mode='wb') as self.xmrgFile:
-                    shutil.copyfileobj(zipFile, self.xmrgFile)
+                if in_memory:
+                    with open(file_name, mode='rb') as zipFile:
+                        self._file_buffer = gzip.decompress(zipFile.read())
+                else:
+                    with gzip.GzipFile(file_name, 'rb') as zipFile, open(self.fileName, mode='wb') as self.xmrgFile:
+                        shutil.copyfileobj(zipFile, self.xmrgFile)
             except (IOError, Exception) as e:
                 raise e
         return
-    def openFile(self, filePath):
+    def openFile(self, filePath, in_memory=False, use_mmap=False, seek_index=None):
         '''
         Purpose: Attempts to open the file given in the filePath string. If the file is compressed using gzip, this will uncompress
           the file as well.
 
+        :param filePath: is a string with the full path to the file to open.
+        :param in_memory: If True, a gzip file is decompressed into memory instead of to a file beside the source.
+        :param use_mmap: If True and the file is read from disk, the grid is a zero copy view over a memory map of
+          the file so only the pages that are used get read.
+        :param seek_index: Optional xmrg_seek_index for a gzip file. Nothing is decompressed up front, reads
+          only inflate the parts of the file they need.
+        :return:
+        '''
+        self.fileName = filePath
+        self.compressedFilepath = ''
+        self._file_buffer = None
+        self._seek_index = None
+        try:
+            if seek_index is not None and os.path.splitext(filePath)[1] == '.gz':
+                self.compressedFilepath = filePath
+                self.fileName = os.path.splitext(filePath)[0]
+                self._seek_index = seek_index
+                self.xmrgFile = io.BytesIO(seek_index.read(0, HEADER_BYTE_COUNT))
+                self._use_mmap = False
+                return
+            self.uncompress(self.fileName, in_memory)
+            if self._file_buffer is not None:
+                self.xmrgFile = io.BytesIO(self._file_buffer)
+            else:
+                self.xmrgFile = open(self.fileName, mode='rb')
+            self._use_mmap = use_mmap and self._file_buffer is None
+        except Exception as e:
+            self.logger.exception(e)
+            raise e
+
+    def openFileHeader(self, filePath):
+        '''
+        Purpose: Opens just the header of the file given in the filePath string so readFileHeader can be called.
+          Only the first HEADER_BYTE_COUNT bytes are read, a gzip file is only decompressed far enough to get them.
+
         :param filePath: is a string with the full path to the file to open.
         :return:
         '''
         self.fileName = filePath
         self.compressedFilepath = ''
+        self._use_mmap = False
+        directory, xmrg_filename = os.path.split(filePath)
+        xmrg_filename, xmrg_extension = os.path.splitext(xmrg_filename)
         try:
-            self.uncompress(self.fileName)
-            self.xmrgFile = open(self.fileName, mode='rb')
+            if xmrg_extension == '.gz':
+                self.compressedFilepath = filePath
+                self.fileName = os.path.join(directory, xmrg_filename)
+                with gzip.GzipFile(filePath, 'rb') as zipFile:
+                    self._file_buffer = zipFile.read(HEADER_BYTE_COUNT)
+            else:
+                with open(filePath, mode='rb') as header_file:
+                    self._file_buffer = header_file.read(HEADER_BYTE_COUNT)
+            self.xmrgFile = io.BytesIO(self._file_buffer)
         except Exception as e:
             self.logger.exception(e)
             raise e
@@ -101,13 +324,17 @@ class geoXmrg:
    Purpose: Called to delete the XMRG file that was just worked with. Can delete the uncompressed file and/or 
     the source compressed file. 
    Parameters:
-     deleteFile if True, will delete the unzipped binary file.
+     deleteFile if True, will delete the unzipped binary file. There is no file to delete if the file
+      was decompressed in memory or read through a seek index.
      deleteCompressedFile if True, will delete the compressed file the working file was extracted from.
     """
 
     def cleanUp(self, deleteFile, deleteCompressedFile):
         self.xmrgFile.close()
-        if (deleteFile):
+        in_memory = self._file_buffer is not None or self._seek_index is not None
+        self._file_buffer = None
+        self._seek_index = None
+        if (deleteFile and not in_memory):
             #self.logger.info(f"Deleting uncompressed file: {self.fileName}")
             os.remove(self.fileName)
         if (deleteCompressedFile and len(self.compressedFilepath)):
@@ -177,7 +404,7 @@ class geoXmrg:
                 # valid time: char[10]
                 # max value: int
                 # version number: float
-                unpackFmt += '=2s8s10s10s8s10s10sif'
+                unpackFmt += self._byte_order() + '2s8s10s10s8s10s10sif'
                 # buf = array.array('B')
                 # buf.fromfile(self.xmrgFile,66)
                 # if( self.swapBytes ):
@@ -235,6 +462,8 @@ class geoXmrg:
 
             if (srcFileOpen):
                 self.headerRead = True
+                # The data records start here, windowed reads compute their offsets from this point.
+                self._data_offset = self.xmrgFile.tell()
                 return (True)
 
         except Exception as E:
@@ -295,16 +524,146 @@ class geoXmrg:
 
         return (dataArray)
 
-    """
-      Function: readAllRows
-      Purpose: Reads all the rows in the file and stores them in a dataArray object. Data is stored in self.grid.
-      Parameters: None
-      Returns: True if succesful otherwise False.
-    
-      """
+    def _byte_order(self):
+        '''
+        Returns the struct/numpy byte order character for the file, determined when the header is read.
+        '''
+        byte_order = '<' if sys.byteorder == 'little' else '>'
+        if self.swapBytes:
+            byte_order = '>' if byte_order == '<' else '<'
+        return byte_order
 
-    def readAllRows(self):
+    def headerMetadata(self):
+        '''
+        Returns the values parsed by readFileHeader as a dict. The info header values are None for files written
+        before 1999, max_value is the raw header value so it is in the same units as the grid.
+        '''
+        metadata = {
+            'file_name': os.path.basename(self.fileName),
+            'xor': self.XOR,
+            'yor': self.YOR,
+            'maxx': self.MAXX,
+            'maxy': self.MAXY,
+            'byte_swapped': bool(self.swapBytes),
+            'valid_date': None,
+            'valid_time': None,
+            'max_value': None
+        }
+        if len(self.fileNfoHdrData) == 9:
+            metadata['valid_date'] = self.fileNfoHdrData[5].decode('ascii', errors='ignore').strip('\x00 ')
+            metadata['valid_time'] = self.fileNfoHdrData[6].decode('ascii', errors='ignore').strip('\x00 ')
+            metadata['max_value'] = self.fileNfoHdrData[7]
+        return metadata
+
+    def sparseGrid(self):
+        '''
+        Returns the non zero cells that were read as an hrapSparseGrid, call after readAllRows or readGrid.
+        '''
+        if self._grid is None:
+            return None
+        values = self._grid.ravel()
+        cell_index = np.flatnonzero(values)
+        return hrapSparseGrid(self._window, tuple(self._windows), cell_index, values[cell_index],
+                              self._data_multiplier)
+
+    def headerIsDry(self):
+        '''
+        Uses the 1999+ info header max value to tell if no cell in the file has rain, without reading the data.
+        Cells may still be missing data, so this doesn't mean every boundary's total is 0, see windowIsDry.
+        :return: True if the header max value is 0. A negative max value means every cell is missing data, see
+        headerIsMissing. Files without an info header always return False.
+        '''
+        max_value = self.headerMetadata()['max_value']
+        return max_value is not None and max_value == 0
+
+    def headerIsMissing(self):
+        '''
+        :return: True if the 1999+ info header max value is negative, every cell in the file is missing data.
+        Files without an info header always return False.
+        '''
+        max_value = self.headerMetadata()['max_value']
+        return max_value is not None and max_value < 0
+
+    def windowIsDry(self):
+        '''
+        :return: True if every cell that was read is exactly 0, no rain and no missing data, call after readAllRows
+        or readGrid.
+        '''
+        if self._grid is None:
+            return False
+        cells = self._grid[self.cell_mask]
+        return cells.size > 0 and not (cells != 0).any()
+
+    def windowIsMissing(self):
+        '''
+        :return: True if every cell that was read is missing data, call after readAllRows or readGrid.
+        '''
+        return self._grid is None or not (self._grid[self.cell_mask] >= 0).any()
+
+    def _record_dtype(self):
+        '''
+        Builds the numpy dtype describing one FORTRAN data record: the leading tag, MAXX shorts and the trailing tag.
+        The byte order of the file is part of the dtype, so the values never need an explicit byteswap.
+        '''
+        byte_order = self._byte_order()
+        return np.dtype([('head', f'{byte_order}u4'),
+                         ('data', f'{byte_order}i2', (self.MAXX,)),
+                         ('tail', f'{byte_order}u4')])
 
+    def _verifyRecordTags(self, records, first_row=0):
+        '''
+        Checks the leading and trailing tags of every record at once.
+        :param records: numpy array of records built with _record_dtype().
+        :param first_row: Row number of the first record, only used for the error message.
+        :return: True if all the tags match the MAXX * 2 byte count, otherwise False.
+        '''
+        byte_count = self.MAXX * 2
+        bad_rows = np.flatnonzero((records['head'] != byte_count) | (records['tail'] != byte_count))
+        if bad_rows.size:
+            self.lastErrorMsg = 'Tag byte count for row: %d does not match header: %d.' % (
+                first_row + bad_rows[0], byte_count)
+            return False
+        return True
+
+    def _readRecords(self, record_count):
+        '''
+        Reads record_count data records from the current file position. When the file was decompressed in memory
+        or is memory mapped, the records are a view over the buffer or map and nothing is copied.
+        :param record_count: Number of records to read.
+        :return: numpy array of records if successful, otherwise None with lastErrorMsg set.
+        '''
+        record_dtype = self._record_dtype()
+        byte_count = record_dtype.itemsize * record_count
+        if self._use_mmap:
+            offset = self.xmrgFile.tell()
+            available = max(os.fstat(self.xmrgFile.fileno()).st_size - offset, 0)
+            if available < byte_count:
+                self.lastErrorMsg = 'File is truncated, read %d of %d data bytes.' % (available, byte_count)
+                return None
+            self.xmrgFile.seek(offset + byte_count)
+            if record_count == 0:
+                return np.empty(0, dtype=record_dtype)
+            return np.memmap(self.fileName, dtype=record_dtype, mode='r', offset=offset, shape=(record_count,))
+        if self._seek_index is not None:
+            offset = self.xmrgFile.tell()
+            buf = self._seek_index.read(offset, byte_count)
+            self.xmrgFile.seek(offset + len(buf))
+        elif self._file_buffer is not None:
+            offset = self.xmrgFile.tell()
+            buf = memoryview(self._file_buffer)[offset:offset + byte_count]
+            self.xmrgFile.seek(offset + len(buf))
+        else:
+            buf = self.xmrgFile.read(byte_count)
+        if len(buf) != byte_count:
+            self.lastErrorMsg = 'File is truncated, read %d of %d data bytes.' % (len(buf), byte_count)
+            return None
+        return np.frombuffer(buf, dtype=record_dtype)
+
+    def getWindow(self):
+        '''
+        Computes the window of cells covered by the bounding box given to the constructor. Call readFileHeader first.
+        :return: An hrapWindow clipped to the grid. If there is no bounding box, the window is the full grid.
+        '''
         start_col = 0
         start_row = 0
         end_col = self.MAXX
@@ -312,54 +671,205 @@ class geoXmrg:
         if self._minimum_lat_lon is not None and self._maximum_lat_lon is not None:
             llHrap = self.latLongToHRAP(self._minimum_lat_lon, True, True)
             urHrap = self.latLongToHRAP(self._maximum_lat_lon, True, True)
-            start_row = llHrap.row
-            start_col = llHrap.column
-            end_row = urHrap.row
-            end_col = urHrap.column
-
-        grid = []
-        # Create a integer numeric array(from numpy). Dimensions are MAXY and MAXX.
-        for row in range(self.MAXY):
-            dataArray = self.readRow()
-            if (dataArray == None):
-                return (False)
-            if row >= start_row and row < end_row:
-                for col in range(start_col, end_col):
-                    val = dataArray[col] * self._data_multiplier
-                    hrap = hrapCoord(self.XOR + col, self.YOR + row)
-                    latlon = self.hrapCoordToLatLong(hrap)
-                    latlon.longitude *= -1
-                    # Build polygon points. Each grid point represents a 4km square, so we want to create a polygon
-                    # that has each point in the grid for a given point.
-                    hrapNewPt = hrapCoord(self.XOR + col, self.YOR + row + 1)
-                    latlonUL = self.hrapCoordToLatLong(hrapNewPt)
-                    latlonUL.longitude *= -1
-
-                    hrapNewPt = hrapCoord(self.XOR + col + 1, self.YOR + row)
-                    latlonBR = self.hrapCoordToLatLong(hrapNewPt)
-                    latlonBR.longitude *= -1
-
-                    hrapNewPt = hrapCoord(self.XOR + col + 1, self.YOR + row + 1)
-                    latlonUR = self.hrapCoordToLatLong(hrapNewPt)
-                    latlonUR.longitude *= -1
-
-                    grid_polygon = Polygon([(latlon.longitude, latlon.latitude),
-                                            (latlonUL.longitude, latlonUL.latitude),
-                                            (latlonUR.longitude, latlonUR.latitude),
-                                            (latlonBR.longitude, latlonBR.latitude),
-                                            (latlon.longitude, latlon.latitude)])
-
-                    grid.append([grid_polygon, val])
-        data_frame = pd.DataFrame(grid, columns=['Grids', 'Precipitation'])
-        geo_data_frame = gpd.GeoDataFrame(data_frame,
-                                          geometry=data_frame.Grids)
-        self._geo_data_frame = geo_data_frame.drop(columns=['Grids'])
-        self._geo_data_frame.set_crs(epsg=self._epsg, inplace=True)
+            start_row = min(max(llHrap.row, 0), self.MAXY)
+            start_col = min(max(llHrap.column, 0), self.MAXX)
+            end_row = max(urHrap.row, start_row)
+            end_col = max(urHrap.column, start_col)
+        return hrapWindow(self.XOR, self.YOR, self.MAXX, self.MAXY, start_col, start_row, end_col, end_row)
+
+    def readGrid(self, window=None):
+        '''
+        Reads the data records for the rows in the window in one pass and returns them as a 2-D numpy array.
+        The record offsets come from the fixed record layout(tag + MAXX * 2 + tag), so rows outside the window
+        are never read and only the tags of the window rows are checked. The array is a view over the record
+        payloads with the file's byte order in its dtype, row 0 is the southern most row of the window. Call
+        readFileHeader first.
+        :param window: hrapWindow to read, if None the full grid is read.
+        :return: The grid array if successful, otherwise None with lastErrorMsg set.
+        '''
+        if window is None:
+            window = hrapWindow(self.XOR, self.YOR, self.MAXX, self.MAXY, 0, 0, self.MAXX, self.MAXY)
+        record_size = self._record_dtype().itemsize
+        self.xmrgFile.seek(self._data_offset + window.start_row * record_size)
+        records = self._readRecords(window.rows)
+        if records is None:
+            return None
+        if not self._verifyRecordTags(records, window.start_row):
+            return None
+        self._grid = records['data'][:, window.start_col:window.end_col]
+        self._window = window
+        self._windows = [window]
+        self._cell_mask = None
+        self._geo_data_frame = None
+        return self._grid
+
+    def getWindows(self):
+        '''
+        Computes the windows for the HRAP extents given to the constructor. Call readFileHeader first.
+        :return: List of the hrapWindows clipped to the grid, extents outside the grid are dropped. If there are
+          no extents, the list has the bounding box window from getWindow.
+        '''
+        if not self._hrap_extents:
+            return [self.getWindow()]
+        windows = []
+        for start_col, start_row, end_col, end_row in self._hrap_extents:
+            start_col = min(max(start_col - self.XOR, 0), self.MAXX)
+            start_row = min(max(start_row - self.YOR, 0), self.MAXY)
+            end_col = min(max(end_col - self.XOR, start_col), self.MAXX)
+            end_row = min(max(end_row - self.YOR, start_row), self.MAXY)
+            window = hrapWindow(self.XOR, self.YOR, self.MAXX, self.MAXY, start_col, start_row, end_col, end_row)
+            if window.rows and window.columns:
+                windows.append(window)
+        return windows
+
+    def readWindows(self, windows):
+        '''
+        Reads only the cells in the windows, rows between the windows are skipped. The windows should not overlap.
+        The grid is the bounding window of all the windows, see cell_mask for the cells that were read.
+        :param windows: List of hrapWindows to read.
+        :return: The grid array if successful, otherwise None with lastErrorMsg set.
+        '''
+        if len(windows) == 1:
+            return self.readGrid(windows[0])
+        if len(windows) == 0:
+            windows = [hrapWindow(self.XOR, self.YOR, self.MAXX, self.MAXY, 0, 0, 0, 0)]
+        bounding_window = hrapWindow.bounds(windows)
+        grid = np.zeros(bounding_window.shape, dtype=np.int16)
+        cell_mask = np.zeros(bounding_window.shape, dtype=bool)
+        for window in sorted(windows, key=lambda window: window.start_row):
+            window_grid = self.readGrid(window)
+            if window_grid is None:
+                return None
+            rows = slice(window.start_row - bounding_window.start_row, window.end_row - bounding_window.start_row)
+            columns = slice(window.start_col - bounding_window.start_col, window.end_col - bounding_window.start_col)
+            grid[rows, columns] = window_grid
+            cell_mask[rows, columns] = True
+        self._grid = grid
+        self._window = bounding_window
+        self._windows = windows
+        self._cell_mask = cell_mask
+        self._geo_data_frame = None
+        return self._grid
+
+    """
+      Function: readAllRows
+      Purpose: Reads the rows in the file for the cells inside the bounding box. The raw data is available in
+        self.grid, the geo_data_frame is built from it the first time it is used.
+      Parameters: None
+      Returns: True if succesful otherwise False.
+    
+      """
+
+    def readAllRows(self):
+        data_grid = self.readWindows(self.getWindows())
+        if data_grid is None:
+            return (False)
         return (True)
 
+    def setGrid(self, window, grid, fileName='', windows=None, cell_mask=None):
+        '''
+        Uses a grid that was already decoded, from an xmrg_cube, a region store or summed hourly files, in place of
+        reading a file. The grid geometry comes from the window, afterwards the object is used the same as after
+        readAllRows.
+        :param window: hrapWindow the grid covers.
+        :param grid: numpy array of the raw values, the window's shape.
+        :param fileName: Name of the file the grid came from.
+        :param windows: The windows that were read when the grid came from readWindows, None for just window.
+        :param cell_mask: The cell_mask that goes with windows.
+        '''
+        self.fileName = fileName
+        self.XOR = window.xor
+        self.YOR = window.yor
+        self.MAXX = window.maxx
+        self.MAXY = window.maxy
+        self.swapBytes = 0
+        self.fileNfoHdrData = ''
+        self.headerRead = True
+        self._grid = grid
+        self._window = window
+        self._windows = [window] if windows is None else list(windows)
+        self._cell_mask = cell_mask
+        self._geo_data_frame = None
+
+    def _build_geo_data_frame(self):
+        # Build the frame a window at a time so only the cells that were read get a polygon.
+        values = []
+        for window in self._windows:
+            rows = slice(window.start_row - self._window.start_row, window.end_row - self._window.start_row)
+            columns = slice(window.start_col - self._window.start_col, window.end_col - self._window.start_col)
+            values.append(self._grid[rows, columns].ravel())
+        values = np.concatenate(values) * self._data_multiplier
+        geometry = np.concatenate([self.cellGeometries(window) for window in self._windows])
+        return gpd.GeoDataFrame({'Precipitation': values},
+                                geometry=geometry,
+                                crs=f"EPSG:{self._epsg}")
+
+    def cellIndices(self):
+        '''
+        Returns the flat index into grid of each cell that was read, in the same order as the geo_data_frame rows.
+        '''
+        indices = []
+        for window in self._windows:
+            rows = np.arange(window.start_row, window.end_row) - self._window.start_row
+            columns = np.arange(window.start_col, window.end_col) - self._window.start_col
+            indices.append((rows[:, np.newaxis] * self._window.columns + columns).ravel())
+        return np.concatenate(indices) if indices else np.empty(0, dtype=np.int64)
+
+    def cellGeometries(self, window):
+        '''
+        Returns the polygons for the cells in the window, in row major order starting with the south west cell.
+        The polygons are cached by window, so only the first file with a given grid geometry builds them.
+        :param window: hrapWindow of the cells.
+        :return: numpy array of shapely Polygons.
+        '''
+        polygons = _cell_geometry_cache.get(window)
+        if polygons is None:
+            # Each grid point represents a 4km square, so we want to create a polygon that has each corner
+            # of the cell: lower left, upper left, upper right, lower right and back to lower left.
+            longitudes, latitudes = self.gridCornerLattice(window.start_col, window.start_row,
+                                                           window.end_col, window.end_row)
+            ring = [(slice(None, -1), slice(None, -1)), (slice(1, None), slice(None, -1)),
+                    (slice(1, None), slice(1, None)), (slice(None, -1), slice(1, None)),
+                    (slice(None, -1), slice(None, -1))]
+            x = np.stack([longitudes[corner] for corner in ring], axis=-1)
+            y = np.stack([latitudes[corner] for corner in ring], axis=-1)
+            polygons = shapely.polygons(np.stack([x, y], axis=-1).reshape(-1, 5, 2))
+            if len(_cell_geometry_cache) >= CELL_GEOMETRY_CACHE_SIZE:
+                _cell_geometry_cache.pop(next(iter(_cell_geometry_cache)))
+            _cell_geometry_cache[window] = polygons
+        return polygons
+
+    def cellTree(self):
+        '''
+        Returns an STRtree over the geo_data_frame cell polygons. The tree is cached by the windows that were read,
+        so it is built once per grid geometry rather than once per file.
+        :return: shapely STRtree, the tree indices are geo_data_frame row positions.
+        '''
+        key = (self._window, tuple(self._windows))
+        tree = _cell_tree_cache.get(key)
+        if tree is None:
+            tree = shapely.STRtree(self.geo_data_frame.geometry.values)
+            if len(_cell_tree_cache) >= CELL_GEOMETRY_CACHE_SIZE:
+                _cell_tree_cache.pop(next(iter(_cell_tree_cache)))
+            _cell_tree_cache[key] = tree
+        return tree
+
+    def queryCells(self, geometry):
+        '''
+        Finds the cells that intersect a geometry, so an overlay only has to look at those cells.
+        :param geometry: shapely geometry in EPSG:4326.
+        :return: Sorted numpy array of the geo_data_frame row positions of the cells. Empty without searching the
+          tree if the geometry's envelope misses the grid.
+        '''
+        tree = self.cellTree()
+        if len(tree) == 0 or not shapely.intersects(shapely.box(*shapely.total_bounds(tree.geometries)),
+                                                    shapely.envelope(geometry)):
+            return np.empty(0, dtype=np.int64)
+        return np.sort(tree.query(geometry, predicate='intersects'))
+
     def save_to_file(self, filename):
         try:
-            self._geo_data_frame.to_file(filename, driver="GeoJSON")
+            self.geo_data_frame.to_file(filename, driver="GeoJSON")
         except Exception as e:
             raise e
 
@@ -450,6 +960,108 @@ class geoXmrg:
 
         return (hrap)
 
+    def hrapCoordsToLatLongs(self, columns, rows):
+        '''
+        Array version of hrapCoordToLatLong, converts all the HRAP points in one pass.
+        :param columns: numpy array(or array like) of HRAP columns.
+        :param rows: numpy array(or array like) of HRAP rows, same shape as columns.
+        :return: A (latitudes, longitudes) tuple of numpy arrays. As with hrapCoordToLatLong, the longitudes are
+          degrees west and positive.
+        '''
+        x = np.asarray(columns, dtype=np.float64) - 401.0
+        y = np.asarray(rows, dtype=np.float64) - 1601.0
+        rr = x * x + y * y
+        gi = self.meshdegs * self.meshdegs
+        latitudes = np.degrees(np.arcsin((gi - rr) / (gi + rr)))
+
+        ang = np.degrees(np.arctan2(y, x))
+        ang = np.where(ang < 0.0, ang + 360.0, ang)
+        longitudes = 270.0 + self.startLong - ang
+        longitudes = np.where(longitudes < 0.0, longitudes + 360.0, longitudes)
+        longitudes = np.where(longitudes > 360.0, longitudes - 360.0, longitudes)
+
+        return latitudes, longitudes
+
+    def latLongsToHRAP(self, latitudes, longitudes, roundToNearest=False, adjustToOrigin=False):
+        '''
+        Array version of latLongToHRAP, converts all the points in one pass.
+        :param latitudes: numpy array(or array like) of latitudes.
+        :param longitudes: numpy array(or array like) of longitudes, same shape as latitudes.
+        :param roundToNearest: If True, the HRAP points are rounded to the nearest integer value.
+        :param adjustToOrigin: If True, the HRAP points are adjusted to the origin of the file.
+        :return: A (columns, rows) tuple of numpy arrays. Points are only bounds checked against the grid
+          once the file header has been read.
+        '''
+        flat = np.radians(np.asarray(latitudes, dtype=np.float64))
+        flon = np.radians(np.abs(np.asarray(longitudes, dtype=np.float64)) + 180.0 - self.startLong)
+        r = self.meshdegs * np.cos(flat) / (1.0 + np.sin(flat))
+        columns = r * np.sin(flon) + 401.0
+        rows = r * np.cos(flon) + 1601.0
+
+        if self.headerRead:
+            columns = np.minimum(columns, self.XOR + self.MAXX)
+            rows = np.minimum(rows, self.YOR + self.MAXY)
+        if roundToNearest:
+            columns = np.trunc(columns - 0.5).astype(np.int64)
+            rows = np.trunc(rows - 0.5).astype(np.int64)
+        if adjustToOrigin:
+            columns = columns - self.XOR
+            rows = rows - self.YOR
+
+        return columns, rows
+
+    def gridCornerLattice(self, start_col, start_row, end_col, end_row):
+        '''
+        Computes the corner points for every cell in the window in one pass. Neighboring cells share corners, so
+        the (rows + 1) x (columns + 1) lattice is all the geometry code needs.
+        :param start_col: First column of the window, relative to the file origin.
+        :param start_row: First row of the window, relative to the file origin.
+        :param end_col: Column after the last column of the window.
+        :param end_row: Row after the last row of the window.
+        :return: A (longitudes, latitudes) tuple of numpy arrays shaped (end_row - start_row + 1,
+          end_col - start_col + 1). Longitudes are negative west. Cell (row, col) has its lower left corner at
+          [row, col] and upper right corner at [row + 1, col + 1].
+        '''
+        columns, rows = np.meshgrid(np.arange(start_col, end_col + 1) + self.XOR,
+                                    np.arange(start_row, end_row + 1) + self.YOR)
+        latitudes, longitudes = self.hrapCoordsToLatLongs(columns, rows)
+        return -longitudes, latitudes
+
+    def hrapCellPolygons(self, columns, rows):
+        '''
+        Builds the polygons for any set of cells, the corners are ordered the same as cellGeometries.
+        :param columns: numpy array(or array like) of absolute HRAP columns.
+        :param rows: numpy array(or array like) of absolute HRAP rows, same shape as columns.
+        :return: numpy array of shapely Polygons in EPSG:4326.
+        '''
+        columns = np.asarray(columns, dtype=np.float64)[:, np.newaxis] + np.array([0.0, 0.0, 1.0, 1.0, 0.0])
+        rows = np.asarray(rows, dtype=np.float64)[:, np.newaxis] + np.array([0.0, 1.0, 1.0, 0.0, 0.0])
+        latitudes, longitudes = self.hrapCoordsToLatLongs(columns, rows)
+        return shapely.polygons(np.stack([-longitudes, latitudes], axis=-1))
+
+    def hrapCellAreas(self, columns, rows):
+        '''
+        Computes the area of HRAP cells analytically. The polar stereographic projection is conformal, so a cell is
+        a square whose side is the mesh length scaled by the map factor at the cell's latitude:
+        xmesh * (1 + sin(lat)) / (1 + sin(60)).
+        :param columns: numpy array(or array like) of absolute HRAP columns.
+        :param rows: numpy array(or array like) of absolute HRAP rows, same shape as columns.
+        :return: numpy array with the area of each cell in square kilometers.
+        '''
+        latitudes, longitudes = self.hrapCoordsToLatLongs(np.asarray(columns) + 0.5, np.asarray(rows) + 0.5)
+        side = self.xmesh * (1.0 + np.sin(np.radians(latitudes))) / (1.0 + math.sin(math.radians(self.startLat)))
+        return side * side
+
+    def hrapGeometry(self, geometry):
+        '''
+        Transforms a shapely geometry from lat/long(EPSG:4326) into absolute HRAP coordinates, where the cells are
+        unit squares. Only the vertices are transformed, edges stay straight lines.
+        '''
+        def to_hrap(coordinates):
+            columns, rows = self.latLongsToHRAP(coordinates[:, 1], coordinates[:, 0])
+            return np.column_stack([columns, rows])
+        return shapely.transform(geometry, to_hrap)
+
     """
     Function: getCollectionDateFromFilename
     Purpose: Given the filename, this will return a datetime string in the format of YYYY-MM-DDTHH:MM:SS.
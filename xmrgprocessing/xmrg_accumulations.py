@@ -0,0 +1,215 @@
+import logging
+from datetime import datetime
+
+import numpy as np
+
+from xmrgprocessing.boundary.boundary_statistics import WEIGHTED_AVERAGE
+from xmrgprocessing.xmrg_utilities import atomic_write
+
+logger = logging.getLogger()
+
+# The rolling windows, in hours, used when none are given: 24, 48 and 72 hours and 7 days.
+DEFAULT_ACCUMULATION_WINDOWS = (24, 48, 72, 168)
+# Hours held back waiting for an earlier hour before it is treated as missing, for a single in order source. See
+# pending_hours_for_workers for the worker pipeline.
+DEFAULT_MAX_PENDING_HOURS = 24
+# xmrg_results.datetime format, from get_collection_date_from_filename.
+RESULTS_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+# Hours are numbered from this time.
+HOUR_EPOCH = datetime(1970, 1, 1)
+
+
+def hour_number(date_time):
+    '''
+    :param date_time: datetime, or an xmrg_results datetime string.
+    :return: Number of hours since HOUR_EPOCH.
+    '''
+    if isinstance(date_time, str):
+        date_time = datetime.strptime(date_time, RESULTS_DATETIME_FORMAT)
+    return int((date_time - HOUR_EPOCH).total_seconds() // 3600)
+
+
+def pending_hours_for_workers(worker_count, batch_hours=0, slack_hours=DEFAULT_MAX_PENDING_HOURS):
+    '''
+    The max_pending_hours for results coming from the worker processes. Each worker takes every Nth file from the
+    shared queue and, with batch_hours, sends its results batch_hours at a time, so an hour can arrive after the
+    hours of a full round of every worker's batches. Twice that round, plus the slack, is held before an hour is
+    treated as missing.
+    :param worker_count: Number of worker processes.
+    :param batch_hours: Hours each worker aggregates at a time, 0 if they aren't batched.
+    :param slack_hours: Extra hours held for workers that fall behind.
+    '''
+    return 2 * worker_count * max(batch_hours, 1) + slack_hours
+
+
+def accumulation_result_type(window_hours):
+    '''
+    :return: The xmrg_results result type of the rolling total for a window, for example rolling_24h.
+    '''
+    return f"rolling_{window_hours}h"
+
+
+def missing_hours_result_type(window_hours):
+    '''
+    :return: The xmrg_results result type of the number of hours missing from a window's total.
+    '''
+    return f"rolling_{window_hours}h_missing_hours"
+
+
+class rolling_accumulator:
+    '''
+    Rolling precipitation totals per boundary, updated as each hour's xmrg_results arrives. Each boundary's hourly
+    values are kept in a ring buffer as long as the longest window, a slot is indexed by hour number modulo its
+    length and records which hour it holds. An hour whose slot holds another hour, or whose value is None, is a gap,
+    it adds nothing to the totals and is counted in the missing hours.
+
+    Results can arrive out of order from the worker processes. They are held until the next hour arrives, so the
+    totals are built in time order; an hour that never arrives is treated as missing once max_pending_hours later
+    hours are waiting, or when flush is called.
+
+    The ring buffers can be saved and loaded, so a backfill run carries the windows on from where the previous run
+    stopped without reading the earlier hours again.
+    '''
+    def __init__(self, windows=DEFAULT_ACCUMULATION_WINDOWS, statistic=WEIGHTED_AVERAGE,
+                 max_pending_hours=DEFAULT_MAX_PENDING_HOURS):
+        '''
+        :param windows: The rolling window lengths in hours.
+        :param statistic: The hourly boundary result that is accumulated.
+        :param max_pending_hours: Number of later hours held before a missing hour is skipped.
+        '''
+        self._windows = sorted(set(windows))
+        self._capacity = self._windows[-1]
+        self._statistic = statistic
+        self._max_pending_hours = max_pending_hours
+        self._names = []
+        self._name_columns = {}
+        self._values = np.full((self._capacity, 0), np.nan)
+        # The hour number in each slot, -1 for empty slots.
+        self._slot_hours = np.full(self._capacity, -1, dtype=np.int64)
+        # The latest hour added to the ring buffers.
+        self._last_hour = None
+        self._pending = {}
+
+    @property
+    def windows(self):
+        return self._windows
+
+    @property
+    def names(self):
+        return self._names
+
+    def set_start(self, start_date):
+        '''
+        Sets the first hour expected, so results that arrive before it are held. Has no effect once an hour has
+        been added, or state loaded.
+        :param start_date: datetime of the first hour.
+        '''
+        if self._last_hour is None:
+            self._last_hour = hour_number(start_date) - 1
+
+    def _column(self, name):
+        column = self._name_columns.get(name)
+        if column is None:
+            column = len(self._names)
+            self._names.append(name)
+            self._name_columns[name] = column
+            self._values = np.concatenate([self._values, np.full((self._capacity, 1), np.nan)], axis=1)
+        return column
+
+    def accumulate(self, hour, values):
+        '''
+        Adds an hour's values to the ring buffers and computes the rolling totals ending at the hour.
+        :param hour: Hour number, see hour_number.
+        :param values: Dict of boundary name to the hour's value, None for a missing value.
+        :return: Dict of boundary name to a dict of window hours to a (total, missing hours) tuple.
+        '''
+        slot = hour % self._capacity
+        columns = [self._column(name) for name in values]
+        #A late hour older than the ring buffers isn't stored, its slot holds a newer hour.
+        if self._slot_hours[slot] <= hour:
+            if self._slot_hours[slot] != hour:
+                self._values[slot] = np.nan
+                self._slot_hours[slot] = hour
+            self._values[slot, columns] = [np.nan if value is None else value for value in values.values()]
+        if self._last_hour is None or hour > self._last_hour:
+            self._last_hour = hour
+
+        #The hours ending at this one, newest first, and whether each slot still holds that hour.
+        hours_back = hour - np.arange(self._capacity)
+        slots = hours_back % self._capacity
+        window_values = self._values[slots]
+        valid = (self._slot_hours[slots] == hours_back)[:, np.newaxis] & ~np.isnan(window_values)
+        totals = np.cumsum(np.where(valid, window_values, 0.0), axis=0)
+        counts = np.cumsum(valid, axis=0)
+        return {name: {window: (float(totals[window - 1, column]), int(window - counts[window - 1, column]))
+                       for window in self._windows}
+                for name, column in self._name_columns.items()}
+
+    def _release(self, hour, results):
+        values = {name: data.get(self._statistic) for name, data in results.get_boundary_data()}
+        for name, totals in self.accumulate(hour, values).items():
+            if name in values:
+                for window, (total, missing_hours) in totals.items():
+                    results.add_boundary_result(name, accumulation_result_type(window), total)
+                    results.add_boundary_result(name, missing_hours_result_type(window), missing_hours)
+        return results
+
+    def add(self, results):
+        '''
+        Adds an hour's results. The rolling totals are added to the results of each hour that is ready, as
+        rolling_<window>h and rolling_<window>h_missing_hours results for each boundary.
+        :param results: xmrg_results for the hour.
+        :return: List of the xmrg_results that are ready to save, in time order.
+        '''
+        hour = hour_number(results.datetime)
+        if self._last_hour is not None and hour <= self._last_hour:
+            #Too late to be part of the totals already emitted for the later hours.
+            logger.warning(f"Results for {results.datetime} arrived after later hours were accumulated.")
+            return [self._release(hour, results)]
+        self._pending[hour] = results
+        ready = []
+        while self._pending:
+            next_hour = min(self._pending)
+            if (self._last_hour is None or next_hour == self._last_hour + 1 or
+                    len(self._pending) > self._max_pending_hours):
+                ready.append(self._release(next_hour, self._pending.pop(next_hour)))
+            else:
+                break
+        return ready
+
+    def flush(self):
+        '''
+        Accumulates all the held results, treating the hours that never arrived as missing.
+        :return: List of the xmrg_results, in time order.
+        '''
+        return [self._release(hour, self._pending.pop(hour)) for hour in sorted(self._pending)]
+
+    def save(self, file_path):
+        '''
+        Saves the ring buffers with atomic_write, so a crash never leaves a partial file. Results still held are
+        not saved, call flush first.
+        '''
+        with atomic_write(file_path) as state_file:
+            np.savez(state_file, names=np.array(self._names, dtype=str), values=self._values,
+                     slot_hours=self._slot_hours,
+                     last_hour=-1 if self._last_hour is None else self._last_hour)
+
+    def load(self, file_path):
+        '''
+        Loads ring buffers saved by save. The windows may differ from the saved ones, the saved hours that fit in
+        the longest window are kept.
+        '''
+        with np.load(file_path) as state_file:
+            names = [str(name) for name in state_file['names']]
+            values = state_file['values']
+            slot_hours = state_file['slot_hours']
+            last_hour = int(state_file['last_hour'])
+        columns = [self._column(name) for name in names]
+        for saved_slot in np.argsort(slot_hours):
+            hour = int(slot_hours[saved_slot])
+            if hour >= 0 and hour > last_hour - self._capacity:
+                slot = hour % self._capacity
+                self._values[slot] = np.nan
+                self._slot_hours[slot] = hour
+                self._values[slot, columns] = values[saved_slot]
+        self._last_hour = None if last_hour < 0 else last_hour
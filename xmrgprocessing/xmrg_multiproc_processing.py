@@ -8,14 +8,26 @@ import time
 from pathlib import Path
 from queue import Empty
 
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 import shutil
 
+from xmrgprocessing.boundary.boundary_statistics import (DEFAULT_RAIN_THRESHOLD, add_statistics_results,
+                                                         aggregate_statistics, dry_statistics,
+                                                         missing_statistics)
+from xmrgprocessing.boundary.boundary_weights import boundary_weights
 from xmrgprocessing.xmrg_results import xmrg_results
+from xmrgprocessing.xmrg_seek_index import get_seek_index
 from xmrgprocessing.geoXmrg import geoXmrg, LatLong
-from xmrgprocessing.xmrg_utilities import get_collection_date_from_filename
+from xmrgprocessing.xmrg_utilities import get_collection_date_from_filename, get_daily_period_end_from_filename
+from xmrgprocessing.xmrgfileiterator.xmrg_file_iterator import DEFAULT_DAY_END_HOUR
 
+# A day without a 24 hour file is only totaled from its hourly files when at least this many of them were read,
+# otherwise its statistics are reported as missing.
+DEFAULT_MIN_SUMMED_HOURS = 24
+# Result type recording how many hourly files were summed for a day.
+SUMMED_HOURS = 'summed_hours'
 
 
 def file_queue_builder(**kwargs):
@@ -35,24 +47,34 @@ def file_queue_builder(**kwargs):
         worker_count = kwargs['worker_count']
         logger.info(f"{unique_id} file_queue_builder starting.")
 
+        def local_file(xmrg_file):
+            # Copy the file to our local working directory
+            file_to_process = xmrg_file
+            if local_copy_directory is not None:
+                try:
+                    xmrg_src_dir, xmrg_src_filename = os.path.split(xmrg_file)
+                    source_full_filepath = os.path.join(local_copy_directory, xmrg_src_filename)
+                    logger.info(f"{unique_id} copying to local file: {source_full_filepath}")
+                    shutil.copy2(xmrg_file, source_full_filepath)
+                    file_to_process = source_full_filepath
+                except Exception as e:
+                    logger.exception(f"{unique_id} {e}")
+                    file_to_process = None
+            return file_to_process
+
         file_count = 0
         for xmrg_file in file_list_iterator:
             logger.info(f"{unique_id} queueing file: {xmrg_file}")
-            file_to_process = xmrg_file
-            if os.path.isfile(xmrg_file):
-                # Copy the file to our local working directory
-                if local_copy_directory is not None:
-                    try:
-                        xmrg_src_dir, xmrg_src_filename = os.path.split(xmrg_file)
-                        source_full_filepath = os.path.join(local_copy_directory, xmrg_src_filename)
-                        logger.info(f"{unique_id} copying to local file: {source_full_filepath}")
-                        shutil.copy2(xmrg_file, source_full_filepath)
-                        file_to_process = source_full_filepath
-                    except Exception as e:
-                        logger.exception(f"{unique_id} {e}")
-                        file_to_process = None
-            else:
-                file_to_process = None
+            file_to_process = None
+            if isinstance(xmrg_file, tuple):
+                #A day without a 24 hour file, the worker sums its hourly files.
+                daily_filename, hourly_files = xmrg_file
+                hourly_files = [local_file(hourly_file) for hourly_file in hourly_files if os.path.isfile(hourly_file)]
+                hourly_files = [hourly_file for hourly_file in hourly_files if hourly_file is not None]
+                if len(hourly_files):
+                    file_to_process = (daily_filename, hourly_files)
+            elif os.path.isfile(xmrg_file):
+                file_to_process = local_file(xmrg_file)
 
             if file_to_process is not None:
                 input_queue.put(file_to_process)
@@ -66,6 +88,70 @@ def file_queue_builder(**kwargs):
     logger.info(f"{unique_id} Finished iterating {file_count} files.")
     return
 
+def queue_batch_results(weights, batched_results, rain_threshold, results_queue):
+    '''
+    Aggregates a block of hours with the boundary weights in one pass and queues each hour's xmrg_results.
+    :param weights: boundary_weights, current for all the hours.
+    :param batched_results: List of (xmrg_results, hrapSparseGrid) for the hours, emptied once they're queued.
+    :param rain_threshold: Precipitation above which a boundary's area is counted in area_over_threshold.
+    :param results_queue: Queue the results are added to.
+    '''
+    if len(batched_results):
+        statistics = weights.batch_statistics([sparse_grid for results, sparse_grid in batched_results],
+                                              rain_threshold)
+        for hour, (results, sparse_grid) in enumerate(batched_results):
+            add_statistics_results(results, weights.names,
+                                   {statistic: values[hour] for statistic, values in statistics.items()})
+            results_queue.put(results)
+        batched_results.clear()
+
+
+def sum_hourly_files(daily_filename, hourly_filenames, min_lat_long, max_lat_long, hrap_extents,
+                     decompress_in_memory=True, memory_map_uncompressed=True,
+                     delete_source_file=False, delete_compressed_source_file=False):
+    '''
+    Reads the hourly files of a day that has no 24 hour file and sums them into one grid, so the day is processed
+    like its 24 hour file. A cell's sum is over the hours it has valid data, cells missing in every hour keep the
+    missing data flag. The grid is int32, a day's total can overflow int16.
+    :param daily_filename: Name of the day's 24 hour file, used for the collection date.
+    :param hourly_filenames: The hourly files to sum.
+    :return: A (geoXmrg, hour count) tuple, the geoXmrg has the summed grid as if it had been read with readAllRows
+    and the hour count is the number of files summed.
+    '''
+    logger = logging.getLogger()
+    daily_sum = None
+    has_data = None
+    hour_count = 0
+    for hourly_filename in hourly_filenames:
+        hourly_xmrg = geoXmrg(min_lat_long, max_lat_long, 0.01, hrap_extents=hrap_extents)
+        try:
+            hourly_xmrg.openFile(hourly_filename, decompress_in_memory, memory_map_uncompressed)
+            if hourly_xmrg.readFileHeader() and hourly_xmrg.readAllRows():
+                if daily_sum is None:
+                    daily_xmrg = hourly_xmrg
+                    daily_sum = np.zeros(hourly_xmrg.grid.shape, dtype=np.int32)
+                    has_data = np.zeros(hourly_xmrg.grid.shape, dtype=bool)
+                if hourly_xmrg.windows == daily_xmrg.windows:
+                    daily_sum += np.maximum(hourly_xmrg.grid, 0)
+                    has_data |= hourly_xmrg.grid >= 0
+                    hour_count += 1
+                else:
+                    logger.error(f"File: {hourly_filename} grid doesn't match the other hours, not summed.")
+            else:
+                logger.error(f"Failed to read file: {hourly_filename}. {hourly_xmrg.lastErrorMsg}")
+            hourly_xmrg.cleanUp(delete_source_file, delete_compressed_source_file)
+        except Exception as e:
+            logger.exception(f"Failed to read file: {hourly_filename}. {e}")
+    if daily_sum is None:
+        raise ValueError(f"None of the hourly files for {daily_filename} could be read.")
+    if hour_count < 24:
+        logger.info(f"{daily_filename} summed from {hour_count} hourly files.")
+    summed_xmrg = geoXmrg(min_lat_long, max_lat_long, 0.01, hrap_extents=hrap_extents)
+    summed_xmrg.setGrid(daily_xmrg.window, np.where(has_data, daily_sum, -1).astype(np.int32), daily_filename,
+                        daily_xmrg.windows, daily_xmrg.cell_mask)
+    return summed_xmrg, hour_count
+
+
 def process_xmrg_file_geopandas(**kwargs):
     '''
     This is a Process worker which pulls XMRG filenames from the input_queue and with the boundaries
@@ -100,15 +186,41 @@ def process_xmrg_file_geopandas(**kwargs):
         save_all_precip_vals = kwargs['save_all_precip_vals']
         delete_source_file = kwargs['delete_source_file']
         delete_compressed_source_file = kwargs['delete_compressed_source_file']
+        decompress_in_memory = kwargs.get('decompress_in_memory', True)
+        memory_map_uncompressed = kwargs.get('memory_map_uncompressed', True)
+        use_seek_index = kwargs.get('use_seek_index', False)
+        seek_index_directory = kwargs.get('seek_index_directory', None)
         # A course bounding box that restricts us to our area of interest.
         minLatLong = None
         maxLatLong = None
         if 'min_lat_lon' in kwargs and 'max_lat_lon' in kwargs:
             minLatLong = LatLong(kwargs['min_lat_lon'][0], kwargs['min_lat_lon'][1])
             maxLatLong = LatLong(kwargs['max_lat_lon'][0], kwargs['max_lat_lon'][1])
+        # Tight HRAP extents around the boundaries, when set only these cells are read.
+        hrap_extents = kwargs.get('hrap_extents', None)
 
         # Boundaries we are creating the weighted averages for.
         boundaries = kwargs['boundaries']
+        boundary_names = [boundary[0] for boundary in boundaries]
+        # Files whose cells read are all 0 get 0 for every boundary without touching any geometry.
+        zero_rain_fast_path = kwargs.get('zero_rain_fast_path', True)
+        # Precipitation above which a boundary's area is counted in the area_over_threshold statistic.
+        rain_threshold = kwargs.get('rain_threshold', DEFAULT_RAIN_THRESHOLD)
+        # Compute the boundary/grid cell weights once and reuse them for each file, rather than an overlay
+        # for each boundary on every file.
+        weights = None
+        if kwargs.get('use_precomputed_weights', True):
+            weights = boundary_weights(boundaries, kwargs.get('weight_cache_directory', None),
+                                       kwargs.get('coverage_error', None))
+        # Number of boundaries to compare against an exact overlay the first time the weights are built.
+        coverage_deviation_sample = kwargs.get('coverage_deviation_sample', 0)
+        # With precomputed weights, aggregate this many hours at a time rather than each file on its own.
+        batch_hours = kwargs.get('batch_hours', 0) if weights is not None else 0
+        batched_results = []
+        # A day summed from fewer hourly files than this is reported as missing rather than under reporting the rain.
+        min_summed_hours = kwargs.get('min_summed_hours', DEFAULT_MIN_SUMMED_HOURS)
+        # Hour(UTC) the 24 hour period of a daily total ends at, its results are dated then.
+        day_end_hour = kwargs.get('day_end_hour', DEFAULT_DAY_END_HOUR)
 
         logger = logging.getLogger(process_name)
         logger.setLevel(logging.DEBUG)
@@ -134,7 +246,8 @@ def process_xmrg_file_geopandas(**kwargs):
 
         # Build boundary dataframes
         logger.info(f"{process_name} begin processing boundaries.")
-        boundary_frames = []
+        # The EPSG:4326 boundary geometries, used to find the grid cells each boundary touches.
+        boundary_geometries = []
         for boundary in boundaries:
             logger.info(f"{process_name} adding boundary {boundary[0]}")
             df = pd.DataFrame([[boundary[0], boundary[1]]], columns=['Name', 'Boundaries'])
@@ -151,18 +264,46 @@ def process_xmrg_file_geopandas(**kwargs):
             except Exception as e:
                 logger.exception(e)
 
-            #Convert to a projected CRS.
-            boundary_df.to_crs(epsg=3857, inplace=True)
-            boundary_frames.append(boundary_df)
+            boundary_geometries.append(boundary_df.geometry.iloc[0])
+
+        #All the boundaries in one frame, in a projected CRS, so each file is overlaid once. Each boundary's area is
+        #kept for the percentages.
+        all_boundaries = gpd.GeoDataFrame({'Name': boundary_names},
+                                          geometry=boundary_geometries,
+                                          crs="EPSG:4326").to_crs(epsg=3857)
+        all_boundaries['boundary_area'] = all_boundaries.area
+        all_boundaries['Boundary'] = np.arange(len(all_boundaries))
+        #Sent with every file's results, the savers locate the boundaries from them even when a file has no rain and
+        #the results carry no grid cells.
+        boundary_centroids = [geometry.centroid for geometry in boundary_geometries]
+        #The boundary areas in square kilometers for the area statistics, from an equal area projection.
+        boundary_areas_km2 = gpd.GeoSeries(boundary_geometries,
+                                           crs="EPSG:4326").to_crs(epsg=6933).area.to_numpy() / 1e6
 
         tot_file_time_start = time.time()
         logger.info(f"{process_name} begin processing queue.")
         for xmrg_filename in iter(input_queue.get, 'STOP'):
             logger.info(f"{process_name} processing file: {xmrg_filename}")
+            #For daily totals, a day without a 24 hour file comes as a (24 hour file name, hourly files) tuple.
+            hourly_filenames = None
+            summed_hours = None
+            if isinstance(xmrg_filename, tuple):
+                xmrg_filename, hourly_filenames = xmrg_filename
 
-            gpXmrg = geoXmrg(minLatLong, maxLatLong, 0.01)
+            gpXmrg = geoXmrg(minLatLong, maxLatLong, 0.01, hrap_extents=hrap_extents)
             try:
-                gpXmrg.openFile(xmrg_filename)
+                if hourly_filenames is not None:
+                    gpXmrg, summed_hours = sum_hourly_files(xmrg_filename, hourly_filenames, minLatLong, maxLatLong,
+                                                            hrap_extents, decompress_in_memory,
+                                                            memory_map_uncompressed, delete_source_file,
+                                                            delete_compressed_source_file)
+                else:
+                    seek_index = None
+                    if use_seek_index and xmrg_filename.endswith('.gz'):
+                        #Indexes are built ahead of time with build_seek_indexes, building one here costs more than
+                        #decompressing the file, and is lost with a working copy that gets deleted.
+                        seek_index = get_seek_index(xmrg_filename, seek_index_directory, build_missing=False)
+                    gpXmrg.openFile(xmrg_filename, decompress_in_memory, memory_map_uncompressed, seek_index)
             except Exception as e:
                 logger.exception(f"{process_name} Failed to open file: {xmrg_filename}. {e}")
             else:
@@ -172,36 +313,132 @@ def process_xmrg_file_geopandas(**kwargs):
                 (directory, filetime) = os.path.split(gpXmrg.fileName)
                 xmrg_filename = filetime
                 (filetime, ext) = os.path.splitext(filetime)
-                filetime = get_collection_date_from_filename(filetime)
+                #A 24 hour file is dated at the end of its period, so it doesn't share the day's 00Z hourly time.
+                period_end = get_daily_period_end_from_filename(filetime, day_end_hour)
+                filetime = get_collection_date_from_filename(filetime) if period_end is None else period_end
 
                 try:
-                    if gpXmrg.readFileHeader():
-                        read_rows_start = time.time()
-                        gpXmrg.readAllRows()
-                        if logger:
-                            logger.info(f"{process_name}({time.time() - read_rows_start} secs)"
-                                        f" to read all rows in file: {xmrg_filename}")
+                    #The summed hourly files have already been read.
+                    if hourly_filenames is not None or gpXmrg.readFileHeader():
+                        #The header max value covers the whole file, if it is negative every cell is missing data and
+                        #there's no need to read the grid. A max of 0 can still have missing cells under a boundary,
+                        #so the window is read and checked.
+                        dry_file = False
+                        missing_file = zero_rain_fast_path and gpXmrg.headerIsMissing()
+                        if not missing_file:
+                            if hourly_filenames is None:
+                                read_rows_start = time.time()
+                                gpXmrg.readAllRows()
+                                if logger:
+                                    logger.info(f"{process_name}({time.time() - read_rows_start} secs)"
+                                                f" to read all rows in file: {xmrg_filename}")
+                            dry_file = zero_rain_fast_path and gpXmrg.windowIsDry()
+                            missing_file = zero_rain_fast_path and gpXmrg.windowIsMissing()
 
                         gp_results = xmrg_results()
                         gp_results.datetime = filetime
-
-                        for index, boundary_row in enumerate(boundary_frames):
+                        if period_end is not None:
+                            gp_results.period_hours = 24
+                        for name, centroid in zip(boundary_names, boundary_centroids):
+                            gp_results.add_boundary_centroid(name, centroid)
+                        queue_result = True
+                        partial_day = summed_hours is not None and summed_hours < min_summed_hours
+                        if summed_hours is not None:
+                            for name in boundary_names:
+                                gp_results.add_boundary_result(name, SUMMED_HOURS, summed_hours)
+
+                        if partial_day:
+                            add_statistics_results(gp_results, boundary_names, missing_statistics(len(boundary_names)))
+                            logger.error(f"{process_name} File: {xmrg_filename} only {summed_hours} hourly files "
+                                         f"were summed, the day's statistics are missing.")
+                        elif dry_file:
+                            add_statistics_results(gp_results, boundary_names, dry_statistics(len(boundary_names)))
+                            logger.info(f"{process_name} File: {xmrg_filename} has no rain, "
+                                        f"skipped {len(boundary_names)} boundaries.")
+                        elif missing_file:
+                            add_statistics_results(gp_results, boundary_names, missing_statistics(len(boundary_names)))
+                            logger.info(f"{process_name} File: {xmrg_filename} has no valid data, "
+                                        f"skipped {len(boundary_names)} boundaries.")
+                        elif weights is not None:
+                            file_start_time = time.time()
+                            if not weights.is_current(gpXmrg):
+                                #The hours waiting in the batch were read into the old cells.
+                                queue_batch_results(weights, batched_results, rain_threshold, results_queue)
+                                weights.build(gpXmrg)
+                                logger.info(f"{process_name} built boundary weights in "
+                                            f"{time.time() - file_start_time} seconds.")
+                                if coverage_deviation_sample:
+                                    deviation_report = weights.deviation_report(gpXmrg, coverage_deviation_sample)
+                                    logger.info(f"{process_name} weight deviation from overlay:\n"
+                                                f"{deviation_report.to_string()}")
+                                    coverage_deviation_sample = 0
+                            #Only the non zero cells are kept, aggregated and sent back to the main process.
+                            sparse_grid = gpXmrg.sparseGrid()
+                            if batch_hours:
+                                #The statistics are added when the batch is full.
+                                batched_results.append((gp_results, sparse_grid))
+                                queue_result = False
+                            else:
+                                add_statistics_results(gp_results, weights.names,
+                                                       weights.statistics(sparse_grid, rain_threshold))
+                                logger.info(f"{process_name} File: {xmrg_filename} "
+                                            f"Processed {len(weights.names)} boundaries"
+                                            f" in {time.time() - file_start_time} seconds.")
+
+                            if save_boundary_grid_cells:
+                                gp_results.sparse_grid = sparse_grid
+                                for index, name in enumerate(weights.names):
+                                    gp_results.add_boundary_cells(name, weights.boundary_cells(index))
+                            if write_percentages_grids_one_pass:
+                                for index, name in enumerate(weights.names):
+                                    try:
+                                        percentage_file = os.path.join(debug_dir,
+                                            f"{name.replace(' ', '_')}_percentage.json")
+                                        if not os.path.exists(percentage_file):
+                                            weights.boundary_frame(gpXmrg, index).to_file(percentage_file,
+                                                                                          driver="GeoJSON")
+                                    except Exception as e:
+                                        logger.exception(e)
+                                write_percentages_grids_one_pass = False
+                            if save_boundary_grids_one_pass and len(weights.names):
+                                try:
+                                    full_data_grid = os.path.join(debug_dir,
+                                                                  "%s_%s_fullgrid_.json" % (
+                                                                  filetime.replace(':', '_'),
+                                                                  weights.names[0].replace(' ', '_')))
+                                    gpXmrg.geo_data_frame.to_file(full_data_grid, driver="GeoJSON")
+                                    save_boundary_grids_one_pass = False
+                                except Exception as e:
+                                    logger.exception(e)
+                        else:
                             file_start_time = time.time()
-                            xmrg_projected = gpXmrg.geo_data_frame.to_crs(epsg=3857, inplace=False)
-                            overlayed = gpd.overlay(boundary_row, xmrg_projected, how="intersection",
-                                                    keep_geom_type=False)
-
-                            # Here we create our percentage column by applying the function in the map(). This applies to
-                            # each area.
-                            overlayed['percent'] = overlayed.area.map(
-                                lambda area: float(area) / float(boundary_row.area.iloc[0]))
+                            #Only overlay the cells the boundaries touch, found with the grid's STRtree. The cells
+                            #are reprojected once and overlaid with all the boundaries in one pass.
+                            candidate_cells = np.unique(np.concatenate(
+                                [gpXmrg.queryCells(geometry) for geometry in boundary_geometries] +
+                                [np.empty(0, dtype=np.int64)]))
+                            if len(candidate_cells):
+                                xmrg_projected = gpXmrg.geo_data_frame.iloc[candidate_cells].to_crs(epsg=3857,
+                                                                                                    inplace=False)
+                                overlayed = gpd.overlay(all_boundaries, xmrg_projected, how="intersection",
+                                                        keep_geom_type=False)
+                            else:
+                                overlayed = all_boundaries.iloc[0:0].assign(Precipitation=0.0)
+
+                            # Here we create our percentage column from each piece's share of its boundary's area.
+                            overlayed['percent'] = overlayed.area / overlayed['boundary_area']
                             overlayed['weighted average'] = (overlayed['Precipitation']) * (overlayed['percent'])
 
-                            wghtd_avg_val = sum(overlayed['weighted average'])
-                            gp_results.add_boundary_result(boundary_row['Name'][0], 'weighted_average',
-                                                           wghtd_avg_val)
+                            #All the statistics come from the one overlay, the pieces are aggregated like weights.
+                            statistics = aggregate_statistics(overlayed['Boundary'].to_numpy(dtype=np.int64),
+                                                              overlayed['percent'].to_numpy(dtype=np.float64),
+                                                              overlayed['Precipitation'].to_numpy(dtype=np.float64),
+                                                              len(boundary_names), boundary_areas_km2,
+                                                              rain_threshold)
+                            add_statistics_results(gp_results, boundary_names, statistics)
+                            overlayed = overlayed.drop(columns=['boundary_area', 'Boundary'])
                             logger.info(f"{process_name} File: {xmrg_filename} "
-                                        f"Processed boundary: {boundary_row.Name[0]} WgtdAvg: {wghtd_avg_val}"
+                                        f"Processed {len(all_boundaries)} boundaries"
                                         f" in {time.time() - file_start_time} seconds.")
                             xmrg_file_count += 1
 
@@ -209,34 +446,44 @@ def process_xmrg_file_geopandas(**kwargs):
                                 #We want EPSG 4326 for our output debug files.
                                 overlayed_4326 = overlayed.to_crs(epsg=4326, inplace=False)
                                 if save_boundary_grid_cells:
-                                    for ndx, row in overlayed_4326.iterrows():
-                                        gp_results.add_grid(row.Name, (row.geometry, row.Precipitation))
+                                    for name, geometry, precipitation in zip(overlayed_4326['Name'],
+                                                                             overlayed_4326.geometry,
+                                                                             overlayed_4326['Precipitation']):
+                                        gp_results.add_grid(name, (geometry, precipitation))
 
                                 if write_percentages_grids_one_pass:
-                                    try:
-                                        percentage_file = os.path.join(debug_dir,
-                                            f"{overlayed['Name'][0].replace(' ', '_')}_percentage.json")
-                                        if not os.path.exists(percentage_file):
-                                            overlayed_4326.to_file(percentage_file, driver="GeoJSON")
-                                        #Once we've written out each boundary, we can stop.
-                                        if index == len(boundary_frames) - 1:
-                                            write_percentages_grids_one_pass = False
-                                    except Exception as e:
-                                        logger.exception(e)
-                            if save_boundary_grids_one_pass:
+                                    for name, boundary_overlay in overlayed_4326.groupby('Name'):
+                                        try:
+                                            percentage_file = os.path.join(debug_dir,
+                                                f"{name.replace(' ', '_')}_percentage.json")
+                                            if not os.path.exists(percentage_file):
+                                                boundary_overlay.to_file(percentage_file, driver="GeoJSON")
+                                        except Exception as e:
+                                            logger.exception(e)
+                                    #Once we've written out each boundary, we can stop.
+                                    write_percentages_grids_one_pass = False
+                            if save_boundary_grids_one_pass and len(all_boundaries):
                                 try:
                                     full_data_grid = os.path.join(debug_dir,
                                                                   "%s_%s_fullgrid_.json" % (
                                                                   filetime.replace(':', '_'),
-                                                                  boundary_row.Name[0].replace(' ', '_')))
-                                    gpXmrg._geo_data_frame.to_file(full_data_grid, driver="GeoJSON")
+                                                                  all_boundaries['Name'][0].replace(' ', '_')))
+                                    gpXmrg.geo_data_frame.to_file(full_data_grid, driver="GeoJSON")
                                     save_boundary_grids_one_pass = False
                                 except Exception as e:
                                     logger.exception(e)
 
-                        results_queue.put(gp_results)
+                        if queue_result:
+                            results_queue.put(gp_results)
+                        elif len(batched_results) >= batch_hours:
+                            batch_start_time = time.time()
+                            batch_count = len(batched_results)
+                            queue_batch_results(weights, batched_results, rain_threshold, results_queue)
+                            logger.info(f"{process_name} Processed {len(weights.names)} boundaries for "
+                                        f"{batch_count} hours in {time.time() - batch_start_time} seconds.")
                         try:
-                            gpXmrg.cleanUp(delete_source_file, delete_compressed_source_file)
+                            if hourly_filenames is None:
+                                gpXmrg.cleanUp(delete_source_file, delete_compressed_source_file)
                         except Exception as e:
                             logger.exception(e)
                     else:
@@ -244,6 +491,10 @@ def process_xmrg_file_geopandas(**kwargs):
                 except Exception as e:
                     logger.exception(f"{process_name} Failed to process file: {xmrg_filename}. {e}")
 
+        #The last, partial, batch.
+        if weights is not None:
+            queue_batch_results(weights, batched_results, rain_threshold, results_queue)
+
         logger.info(f"{process_name} process finished. Processed in: "
                      f"{time.time() - processing_start_time} seconds")
         ret_val = 1
@@ -259,11 +510,25 @@ class xmrg_processing_geopandas:
         self._logger = None
         self._min_latitude_longitude = None
         self._max_latitude_longitude = None
+        self._hrap_extents = None
+        self._use_precomputed_weights = True
+        self._weight_cache_directory = None
+        self._coverage_error = None
+        self._coverage_deviation_sample = 0
+        self._zero_rain_fast_path = True
+        self._rain_threshold = DEFAULT_RAIN_THRESHOLD
+        self._batch_hours = 0
+        self._min_summed_hours = DEFAULT_MIN_SUMMED_HOURS
+        self._day_end_hour = DEFAULT_DAY_END_HOUR
         self._save_all_precip_values = False
         self._boundaries = []
         self._source_file_working_directory = None
         self._delete_source_file = False
         self._delete_compressed_source_file = False
+        self._decompress_in_memory = True
+        self._memory_map_uncompressed = True
+        self._use_seek_index = False
+        self._seek_index_directory = None
         self._kml_output_directory = None
         self._callback_function = None
         self._logging_config = None
@@ -281,12 +546,34 @@ class xmrg_processing_geopandas:
         #The overall bounding box to trim the XMRG data to.
         self._min_latitude_longitude = kwargs.get("min_latitude_longitude", None)
         self._max_latitude_longitude = kwargs.get("max_latitude_longitude", None)
+        #Optional (start_col, start_row, end_col, end_row) HRAP extents, when set only these cells are read
+        #instead of the whole bounding box.
+        self._hrap_extents = kwargs.get("hrap_extents", None)
 
         #Save all the preciptation values, not just > 0 ones.
         self._save_all_precip_values = kwargs.get("save_all_precip_values", False)
 
         #The list of boundaries to process rain data for.
         self._boundaries = kwargs.get("boundaries", None)
+        #Compute the boundary weights once per grid geometry instead of overlaying every boundary on each file.
+        self._use_precomputed_weights = kwargs.get("use_precomputed_weights", True)
+        #If set, the boundary weights are saved here and reused by the other workers and later runs.
+        self._weight_cache_directory = kwargs.get("weight_cache_directory", None)
+        #If set, edge cells are supersampled to within this coverage error rather than clipped exactly.
+        self._coverage_error = kwargs.get("coverage_error", None)
+        #Number of boundaries to check against an exact overlay, the deviations are logged.
+        self._coverage_deviation_sample = kwargs.get("coverage_deviation_sample", 0)
+        #Skip the geometry for files whose cells read are all 0, every boundary gets 0, or all missing data.
+        self._zero_rain_fast_path = kwargs.get("zero_rain_fast_path", True)
+        #Precipitation(mm) above which a boundary's area is counted in the area_over_threshold statistic.
+        self._rain_threshold = kwargs.get("rain_threshold", DEFAULT_RAIN_THRESHOLD)
+        #For backfills, aggregate this many hours at a time against the precomputed weights. 0 aggregates each
+        #file as it is read.
+        self._batch_hours = kwargs.get("batch_hours", 0)
+        #For daily totals, the fewest hourly files a day without a 24 hour file is summed from.
+        self._min_summed_hours = kwargs.get("min_summed_hours", DEFAULT_MIN_SUMMED_HOURS)
+        #Hour(UTC) the 24 hour period of the daily totals ends at.
+        self._day_end_hour = kwargs.get("day_end_hour", DEFAULT_DAY_END_HOUR)
 
         #These next parameters deal with where we process the data files. We might be grabbing files
         #from an archive, so we want to copy them to a working directory.
@@ -300,6 +587,17 @@ class xmrg_processing_geopandas:
         self._delete_source_file = kwargs.get("delete_source_file", False)
         #Delete the compressed file after processing
         self._delete_compressed_source_file = kwargs.get("delete_compressed_source_file", False)
+        #Decompress gzip files in memory rather than writing the uncompressed file to the working directory.
+        self._decompress_in_memory = kwargs.get("decompress_in_memory", True)
+        #Read uncompressed XMRG files through a memory map.
+        self._memory_map_uncompressed = kwargs.get("memory_map_uncompressed", True)
+        #Use gzip seek indexes so only the rows in the bbox are decompressed. The indexes are built ahead of time with
+        #xmrg_archive_utilities.build_seek_indexes in seek_index_directory, or beside the XMRG file if that's not set.
+        #Files without an index are decompressed as usual.
+        self._use_seek_index = kwargs.get("use_seek_index", False)
+        self._seek_index_directory = kwargs.get("seek_index_directory", None)
+        if self._seek_index_directory is not None:
+            Path(self._seek_index_directory).mkdir(parents=True, exist_ok=True)
 
         #The directory to output the KML file we use for debugging.
         self._kml_output_directory = kwargs.get("kml_output_directory", None)
@@ -346,10 +644,24 @@ class xmrg_processing_geopandas:
                     'finished_event': finished_processing,
                     'min_lat_lon': self._min_latitude_longitude,
                     'max_lat_lon': self._max_latitude_longitude,
+                    'hrap_extents': self._hrap_extents,
                     'save_all_precip_vals': self._save_all_precip_values,
                     'boundaries': self._boundaries,
+                    'use_precomputed_weights': self._use_precomputed_weights,
+                    'weight_cache_directory': self._weight_cache_directory,
+                    'coverage_error': self._coverage_error,
+                    'coverage_deviation_sample': self._coverage_deviation_sample,
+                    'zero_rain_fast_path': self._zero_rain_fast_path,
+                    'rain_threshold': self._rain_threshold,
+                    'batch_hours': self._batch_hours,
+                    'min_summed_hours': self._min_summed_hours,
+                    'day_end_hour': self._day_end_hour,
                     'delete_source_file': self._delete_source_file,
                     'delete_compressed_source_file': self._delete_compressed_source_file,
+                    'decompress_in_memory': self._decompress_in_memory,
+                    'memory_map_uncompressed': self._memory_map_uncompressed,
+                    'use_seek_index': self._use_seek_index,
+                    'seek_index_directory': self._seek_index_directory,
                     'debug_files_directory': self._kml_output_directory,
                     'base_log_output_directory': self._base_log_output_directory
                 }
@@ -1,9 +1,12 @@
 import os
 import logging.config
 import time
-from xmrgprocessing.boundary.boundariesparse import find_bbox_from_boundaries
-from xmrgprocessing.xmrg_multiproc_processing import xmrg_processing_geopandas
-from xmrgprocessing.xmrgfileiterator.xmrg_file_iterator import xmrg_file_iterator
+from xmrgprocessing.boundary.boundary_statistics import DEFAULT_RAIN_THRESHOLD
+from xmrgprocessing.boundary.boundariesparse import find_bbox_from_boundaries, find_hrap_extents_from_boundaries
+from xmrgprocessing.xmrg_accumulations import pending_hours_for_workers, rolling_accumulator
+from xmrgprocessing.xmrg_multiproc_processing import DEFAULT_MIN_SUMMED_HOURS, xmrg_processing_geopandas
+from xmrgprocessing.xmrgfileiterator.xmrg_file_iterator import (DEFAULT_DAY_END_HOUR, xmrg_daily_file_iterator,
+                                                                xmrg_file_iterator)
 from xmrgprocessing.xmrg_results import xmrg_results
 
 #logger = logging.getLogger('xmrg_process')
@@ -15,24 +18,71 @@ class xmrg_process:
         #To make sure our BBOX will encompass the polygon, we bump the X a degree at each corner.
         ll = (ll_orig[0], ll_orig[1] - 1)
         ur = (ur_orig[0], ur_orig[1] + 1)
+        #Rather than reading the whole bbox, read a tight window around each boundary.
+        hrap_extents = None
+        if kwargs.get('use_boundary_windows', True):
+            hrap_extents = find_hrap_extents_from_boundaries(kwargs['boundaries'], 1)
         self._xmrg_proc.setup(worker_process_count=kwargs['worker_process_count'],
                     min_latitude_longitude=ll,
                     max_latitude_longitude=ur,
+                    hrap_extents=hrap_extents,
                     save_all_precip_values=kwargs["save_all_precip_values"],
                     boundaries=kwargs['boundaries'],
+                    use_precomputed_weights=kwargs.get('use_precomputed_weights', True),
+                    weight_cache_directory=kwargs.get('weight_cache_directory', None),
+                    coverage_error=kwargs.get('coverage_error', None),
+                    coverage_deviation_sample=kwargs.get('coverage_deviation_sample', 0),
+                    zero_rain_fast_path=kwargs.get('zero_rain_fast_path', True),
+                    rain_threshold=kwargs.get('rain_threshold', DEFAULT_RAIN_THRESHOLD),
+                    batch_hours=kwargs.get('batch_hours', 0),
+                    min_summed_hours=kwargs.get('min_summed_hours', DEFAULT_MIN_SUMMED_HOURS),
+                    day_end_hour=kwargs.get('day_end_hour', DEFAULT_DAY_END_HOUR),
                     source_file_working_directory=kwargs['source_file_working_directory'],
                     delete_source_file=kwargs['delete_source_file'],
                     delete_compressed_source_file=kwargs['delete_compressed_source_file'],
+                    decompress_in_memory=kwargs.get('decompress_in_memory', True),
+                    memory_map_uncompressed=kwargs.get('memory_map_uncompressed', True),
+                    use_seek_index=kwargs.get('use_seek_index', False),
+                    seek_index_directory=kwargs.get('seek_index_directory', None),
                     kml_output_directory=kwargs['kml_output_directory'],
                     callback_function=self.process_results_callback,
                     base_log_output_directory=kwargs['base_log_output_directory'],
                     unique_id=kwargs['unique_id'])
 
-        self._file_list_iterator = kwargs.get('file_list_iterator', xmrg_file_iterator())
+        #For daily totals, each day's 24 hour file is processed, or its hourly files summed when there isn't one.
+        self._daily_totals = kwargs.get('daily_totals', False)
+        if self._daily_totals:
+            default_file_list_iterator = xmrg_daily_file_iterator(
+                day_end_hour=kwargs.get('day_end_hour', DEFAULT_DAY_END_HOUR))
+        else:
+            default_file_list_iterator = xmrg_file_iterator()
+        #The default iterator is set up from the dates given to process().
+        self._setup_file_list_iterator = 'file_list_iterator' not in kwargs
+        self._file_list_iterator = kwargs.get('file_list_iterator', default_file_list_iterator)
         self._copy_file = kwargs.get('copy_source_file', False)
         self._data_saver = kwargs['data_saver']
         self._unique_id = kwargs['unique_id']
         self._logger = logging.getLogger()
+        #Rolling totals per boundary for these windows(hours) are added to each hour's results before it's saved.
+        self._accumulator = None
+        self._accumulation_state_file = kwargs.get('accumulation_state_file', None)
+        if kwargs.get('rolling_accumulation_windows', None) and self._daily_totals:
+            #The windows are in hours, they don't apply to daily results.
+            self._logger.error("Rolling accumulations are hourly, they are not computed for daily totals.")
+        elif kwargs.get('rolling_accumulation_windows', None):
+            #The workers send their results out of order, in bursts of batch_hours, so enough hours are held to
+            #put them back in order before an hour is treated as missing.
+            max_pending_hours = kwargs.get('accumulation_max_pending_hours',
+                                           pending_hours_for_workers(kwargs['worker_process_count'],
+                                                                     kwargs.get('batch_hours', 0)))
+            self._accumulator = rolling_accumulator(kwargs['rolling_accumulation_windows'],
+                                                    max_pending_hours=max_pending_hours)
+            #The ring buffers from the previous run, so the windows don't start out empty.
+            if self._accumulation_state_file is not None and os.path.exists(self._accumulation_state_file):
+                try:
+                    self._accumulator.load(self._accumulation_state_file)
+                except Exception as e:
+                    self._logger.exception(f"Unable to load accumulation state: {self._accumulation_state_file}. {e}")
 
     @property
     def new_records_added(self):
@@ -42,22 +92,44 @@ class xmrg_process:
         return self._data_saver.records_updated
 
     def process_results_callback(self, xmrg_results: xmrg_results):
-        self._data_saver.save(xmrg_results)
+        if self._accumulator is not None:
+            for results in self._accumulator.add(xmrg_results):
+                self._data_saver.save(results)
+        else:
+            self._data_saver.save(xmrg_results)
         return
 
+    def finish_accumulations(self):
+        '''
+        Saves the results still held by the accumulator and the accumulation state for the next run.
+        '''
+        for results in self._accumulator.flush():
+            self._data_saver.save(results)
+        if self._accumulation_state_file is not None:
+            try:
+                self._accumulator.save(self._accumulation_state_file)
+            except Exception as e:
+                self._logger.exception(f"Unable to save accumulation state: {self._accumulation_state_file}. {e}")
+
     def process(self, **kwargs):
         start_time = time.time()
         start_date = kwargs['start_date']
         end_date = kwargs['end_date']
         base_xmrg_directory = kwargs['base_xmrg_directory']
-        if self._file_list_iterator is None:
+        if self._setup_file_list_iterator:
             self._file_list_iterator.setup_iterator(start_date=start_date,
                                                     end_date=end_date,
                                                     base_xmrg_path=base_xmrg_directory)
         self._logger.info(f"{self._unique_id} process started. Start date: {start_date} End date: {end_date}")
 
+        if self._accumulator is not None:
+            self._accumulator.set_start(start_date)
+
         self._xmrg_proc.import_files(self._file_list_iterator)
 
+        if self._accumulator is not None:
+            self.finish_accumulations()
+
         self._data_saver.finalize()
 
         self._logger.info(f"{self._unique_id} process finished in {time.time()-start_time} seconds.")
@@ -121,7 +121,7 @@ def process_xmrg_file_geopandas(**kwargs):
 
                             for index, boundary_row in enumerate(boundary_frames):
                                 file_start_time = time.time()
-                                overlayed = gpd.overlay(boundary_row, gpXmrg._geo_data_frame, how="intersection",
+                                overlayed = gpd.overlay(boundary_row, gpXmrg.geo_data_frame, how="intersection",
                                                         keep_geom_type=False)
 
                                 if save_boundary_grid_cells:
@@ -158,7 +158,7 @@ def process_xmrg_file_geopandas(**kwargs):
                                                                       "%s_%s_fullgrid_.json" % (
                                                                       filetime.replace(':', '_'),
                                                                       boundary_row.Name[0].replace(' ', '_')))
-                                        gpXmrg._geo_data_frame.to_file(full_data_grid, driver="GeoJSON")
+                                        gpXmrg.geo_data_frame.to_file(full_data_grid, driver="GeoJSON")
                                         save_boundary_grids_one_pass = False
                                     except Exception as e:
                                         logger.exception(e)
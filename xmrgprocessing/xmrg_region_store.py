@@ -0,0 +1,209 @@
+import os
+import json
+import logging
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from xmrgprocessing.geoXmrg import hrapWindow
+from xmrgprocessing.xmrgfileiterator.xmrg_cube_builder import xmrg_cube
+from xmrgprocessing.xmrg_utilities import atomic_write
+
+logger = logging.getLogger()
+
+REGION_STORE_VERSION = 1
+REGION_STORE_DESCRIPTION = 'store.json'
+# Hours in each chunk file, a 30 day chunk of a 100 x 100 cell region is about 14MB.
+DEFAULT_CHUNK_HOURS = 24 * 30
+# Chunks start at multiples of chunk_hours from this time, so a chunk always holds the same hours.
+CHUNK_EPOCH = datetime(1970, 1, 1)
+
+
+class xmrg_region_store:
+    '''
+    A local copy of the hourly XMRG grids for one region, so later runs don't have to gunzip and decode the CONUS
+    files again. The region is an absolute HRAP extent, the hours are split into chunks of chunk_hours.
+
+    Directory layout: store.json describes the region and chunks. Each chunk is two .npy files, named for the
+    chunk's first hour: chunk_YYYYmmddHH.npy, the (chunk_hours, rows, cols) int16 raw values, and
+    chunk_YYYYmmddHH_hours.npy, a bool per hour that is True when the hour's file was read. The value files are
+    memory mapped when read, so reading a date range only touches its pages.
+    '''
+    def __init__(self, store_directory):
+        self._store_directory = store_directory
+        with open(os.path.join(store_directory, REGION_STORE_DESCRIPTION), 'r') as description_file:
+            description = json.load(description_file)
+        if description.get('version') != REGION_STORE_VERSION:
+            raise ValueError(f"{store_directory} is not a version {REGION_STORE_VERSION} region store.")
+        self._hrap_extent = tuple(description['hrap_extent'])
+        self._chunk_hours = description['chunk_hours']
+        self._data_multiplier = description['data_multiplier']
+        self._window = None
+        if description['window'] is not None:
+            self._window = hrapWindow(*description['window'])
+
+    @classmethod
+    def create(cls, store_directory, hrap_extent, chunk_hours=DEFAULT_CHUNK_HOURS, data_multiplier=0.01):
+        '''
+        Creates an empty store.
+        :param store_directory: Directory for the store, created if it doesn't exist.
+        :param hrap_extent: (start_col, start_row, end_col, end_row) absolute HRAP extent of the region.
+        :param chunk_hours: Number of hours in each chunk file.
+        :param data_multiplier: Multiplier that scales the raw values to precipitation.
+        :return: The xmrg_region_store.
+        '''
+        os.makedirs(store_directory, exist_ok=True)
+        cls._write_description(store_directory, {'version': REGION_STORE_VERSION,
+                                                 'hrap_extent': [int(value) for value in hrap_extent],
+                                                 'chunk_hours': chunk_hours,
+                                                 'data_multiplier': data_multiplier,
+                                                 'window': None})
+        return cls(store_directory)
+
+    @staticmethod
+    def _write_description(store_directory, description):
+        '''
+        Writes store.json with atomic_write, so readers never load a partial file.
+        '''
+        with atomic_write(os.path.join(store_directory, REGION_STORE_DESCRIPTION), 'w') as description_file:
+            json.dump(description, description_file)
+
+    @property
+    def hrap_extent(self):
+        return self._hrap_extent
+
+    @property
+    def chunk_hours(self):
+        return self._chunk_hours
+
+    @property
+    def window(self):
+        return self._window
+
+    @property
+    def shape(self):
+        '''
+        The (rows, cols) of each hour.
+        '''
+        start_col, start_row, end_col, end_row = self._hrap_extent
+        return (end_row - start_row, end_col - start_col)
+
+    def chunk_start(self, date_time):
+        '''
+        :return: datetime of the first hour of the chunk the hour is in.
+        '''
+        hour = int((date_time - CHUNK_EPOCH).total_seconds() // 3600)
+        return CHUNK_EPOCH + timedelta(hours=hour - hour % self._chunk_hours)
+
+    def chunk_paths(self, chunk_start):
+        '''
+        :return: The (values, hours) file paths of the chunk starting at chunk_start.
+        '''
+        chunk_name = f"chunk_{chunk_start.strftime('%Y%m%d%H')}"
+        return (os.path.join(self._store_directory, f"{chunk_name}.npy"),
+                os.path.join(self._store_directory, f"{chunk_name}_hours.npy"))
+
+    def _chunk_ranges(self, start_date, end_date):
+        '''
+        Generator of (chunk_start, first, last) for each chunk from start_date up to end_date, first and last are
+        the hours of the range within the chunk.
+        '''
+        chunk_start = self.chunk_start(start_date)
+        while chunk_start < end_date:
+            chunk_end = chunk_start + timedelta(hours=self._chunk_hours)
+            first = int((max(start_date, chunk_start) - chunk_start).total_seconds() // 3600)
+            last = int((min(end_date, chunk_end) - chunk_start).total_seconds() // 3600)
+            yield chunk_start, first, last
+            chunk_start = chunk_end
+
+    def add_cube(self, cube):
+        '''
+        Writes the hours of a cube into the store, replacing any hours already stored. The cube must be for the
+        store's extent.
+        :param cube: xmrg_cube
+        '''
+        if tuple(cube.hrap_extent) != self._hrap_extent:
+            raise ValueError(f"Cube extent {cube.hrap_extent} is not the store extent {self._hrap_extent}.")
+        if not len(cube.times):
+            return
+        if self._window is None and cube.window is not None:
+            #The first hours read give the files' grid, used to hand the hours to geoXmrg.
+            self._window = cube.window
+            window = self._window
+            self._write_description(self._store_directory,
+                                    {'version': REGION_STORE_VERSION,
+                                     'hrap_extent': list(self._hrap_extent),
+                                     'chunk_hours': self._chunk_hours,
+                                     'data_multiplier': self._data_multiplier,
+                                     'window': [int(value) for value in (window.xor, window.yor, window.maxx,
+                                                                         window.maxy, window.start_col,
+                                                                         window.start_row, window.end_col,
+                                                                         window.end_row)]})
+
+        read_hours = ~np.ma.getmaskarray(cube.data).all(axis=(1, 2))
+        values = cube.data.filled(0)
+        start_date = cube.times[0]
+        end_date = cube.times[-1] + timedelta(hours=1)
+        cube_hour = 0
+        for chunk_start, first, last in self._chunk_ranges(start_date, end_date):
+            values_path, hours_path = self.chunk_paths(chunk_start)
+            if os.path.exists(values_path):
+                chunk_values = np.load(values_path, mmap_mode='r+')
+                chunk_hours = np.load(hours_path)
+            else:
+                chunk_values = np.lib.format.open_memmap(values_path, mode='w+', dtype=np.int16,
+                                                         shape=(self._chunk_hours,) + self.shape)
+                chunk_hours = np.zeros(self._chunk_hours, dtype=bool)
+            chunk_values[first:last] = values[cube_hour:cube_hour + last - first]
+            chunk_values.flush()
+            chunk_hours[first:last] = read_hours[cube_hour:cube_hour + last - first]
+            np.save(hours_path, chunk_hours)
+            cube_hour += last - first
+
+    def import_files(self, cube_builder, start_date, end_date):
+        '''
+        Reads the XMRG files from start_date up to, not including, end_date into the store a chunk at a time, so
+        only one chunk of hours is in memory.
+        :param cube_builder: xmrg_cube_builder for the files.
+        '''
+        for chunk_start, first, last in self._chunk_ranges(start_date, end_date):
+            chunk_start_date = chunk_start + timedelta(hours=first)
+            chunk_end_date = chunk_start + timedelta(hours=last)
+            logger.info(f"Importing {chunk_start_date} to {chunk_end_date} into region store: "
+                        f"{self._store_directory}")
+            self.add_cube(cube_builder.build(chunk_start_date, chunk_end_date, hrap_extent=self._hrap_extent))
+
+    def read(self, start_date, end_date):
+        '''
+        Reads the hours from start_date up to, not including, end_date. Hours that were never imported, or whose file
+        was missing, are masked the same as in xmrg_cube_builder, as are the cells off the files' grid.
+        When the range is in one chunk the cube's data is a view over the chunk's memory map.
+        :return: xmrg_cube
+        '''
+        values = []
+        read_hours = []
+        for chunk_start, first, last in self._chunk_ranges(start_date, end_date):
+            values_path, hours_path = self.chunk_paths(chunk_start)
+            if os.path.exists(values_path):
+                values.append(np.load(values_path, mmap_mode='r')[first:last])
+                read_hours.append(np.load(hours_path)[first:last])
+            else:
+                values.append(np.zeros((last - first,) + self.shape, dtype=np.int16))
+                read_hours.append(np.zeros(last - first, dtype=bool))
+        if len(values) == 1:
+            values = values[0]
+        else:
+            values = np.concatenate(values + [np.empty((0,) + self.shape, dtype=np.int16)])
+        read_hours = np.concatenate(read_hours + [np.empty(0, dtype=bool)])
+
+        on_grid = np.zeros(self.shape, dtype=bool)
+        if self._window is not None:
+            start_col, start_row, end_col, end_row = self._hrap_extent
+            window = self._window
+            on_grid[window.yor + window.start_row - start_row:window.yor + window.end_row - start_row,
+                    window.xor + window.start_col - start_col:window.xor + window.end_col - start_col] = True
+        mask = ~(read_hours[:, np.newaxis, np.newaxis] & on_grid[np.newaxis, :, :])
+
+        times = [start_date + timedelta(hours=hour) for hour in range(len(read_hours))]
+        return xmrg_cube(times, self._hrap_extent, np.ma.MaskedArray(values, mask=mask), self._data_multiplier,
+                         self._window)
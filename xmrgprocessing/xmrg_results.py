@@ -1,8 +1,27 @@
+from xmrgprocessing.geoXmrg import geoXmrg
+
+
 class xmrg_results:
     def __init__(self):
         self._datetime = None
         self._boundary_results = {}
         self._boundary_grids = {}
+        # The file's non zero cells as an hrapSparseGrid and the grid cells each boundary covers. Together they
+        # stand in for the per cell (geometry, precipitation) grids, which are much larger to pickle.
+        self._sparse_grid = None
+        self._boundary_cells = {}
+        # Hours of precipitation the results cover, 24 for daily totals. datetime is the end of the period.
+        self.period_hours = 1
+        # Each boundary's centroid, so a boundary can be located in results that carry no grid cells.
+        self._boundary_centroids = {}
+
+    @property
+    def sparse_grid(self):
+        return self._sparse_grid
+
+    @sparse_grid.setter
+    def sparse_grid(self, sparse_grid):
+        self._sparse_grid = sparse_grid
 
     def add_boundary_result(self, name, result_type, result_value):
         if name not in self._boundary_results:
@@ -22,10 +41,38 @@ class xmrg_results:
         grid_data = self._boundary_grids[boundary_name]
         grid_data.append(grid_tuple)
 
+    def add_boundary_cells(self, boundary_name, cell_index):
+        '''
+        Records the cells a boundary covers as flat indices into the sparse_grid window.
+        '''
+        self._boundary_cells[boundary_name] = cell_index
+
+    def get_boundary_cells(self, boundary_name):
+        return self._boundary_cells.get(boundary_name, None)
+
+    def add_boundary_centroid(self, boundary_name, centroid):
+        '''
+        Records the boundary's centroid, a shapely Point in EPSG:4326.
+        '''
+        self._boundary_centroids[boundary_name] = centroid
+
+    def get_boundary_centroid(self, boundary_name):
+        return self._boundary_centroids.get(boundary_name, None)
+
     def get_boundary_grid(self, boundary_name):
+        '''
+        Returns the list of (geometry, precipitation) tuples for the boundary's cells. For boundaries recorded with
+        add_boundary_cells, the list is built from the sparse grid, the geometries are the whole cells.
+        '''
         grid_data = None
         if boundary_name in self._boundary_grids:
             grid_data = self._boundary_grids[boundary_name]
+        elif boundary_name in self._boundary_cells and self._sparse_grid is not None:
+            cell_index = self._boundary_cells[boundary_name]
+            columns, rows = self._sparse_grid.hrap_cells(cell_index)
+            polygons = geoXmrg(None, None).hrapCellPolygons(columns, rows)
+            precipitation = self._sparse_grid.values_at(cell_index) * self._sparse_grid.data_multiplier
+            grid_data = list(zip(polygons, precipitation))
         return grid_data
 
     def get_boundary_data(self):
@@ -33,4 +80,4 @@ class xmrg_results:
             yield (boundary_name, boundary_data)
 
     def get_boundary_names(self):
-        return self._boundary_grids.keys()
+        return self._boundary_grids.keys() | self._boundary_cells.keys()
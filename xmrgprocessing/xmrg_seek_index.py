@@ -0,0 +1,145 @@
+import os
+import gzip
+import json
+import logging
+import struct
+import zlib
+
+from xmrgprocessing.xmrg_utilities import atomic_write
+
+logger = logging.getLogger()
+
+SEEK_INDEX_EXTENSION = '.idx'
+SEEK_INDEX_MAGIC = b'XMRGIDX1'
+# Size of the uncompressed data each restart point covers. For a CONUS grid this is about 29 rows.
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class xmrg_seek_index:
+    '''
+    A sidecar index for a gzip XMRG file that lets us decompress only a byte range of the file.
+    Python's zlib can't resume inflating a gzip stream at an arbitrary bit offset, so rather than storing
+    inflate state the index stores the uncompressed file as independent zlib chunks of chunk_size bytes.
+    Each chunk is a restart point, a read only inflates the chunks that overlap it.
+
+    File layout: magic, a 4 byte length and a JSON description, then the compressed chunks.
+    '''
+    def __init__(self, index_filepath):
+        self._index_filepath = index_filepath
+        with open(index_filepath, 'rb') as index_file:
+            magic = index_file.read(len(SEEK_INDEX_MAGIC))
+            if magic != SEEK_INDEX_MAGIC:
+                raise ValueError(f"{index_filepath} is not an XMRG seek index.")
+            description_length = struct.unpack('<I', index_file.read(4))[0]
+            description = json.loads(index_file.read(description_length))
+            self._chunks_start = index_file.tell()
+        self._source_size = description['source_size']
+        self._source_mtime_ns = description['source_mtime_ns']
+        self._uncompressed_size = description['uncompressed_size']
+        self._chunk_size = description['chunk_size']
+        self._chunk_offsets = description['chunk_offsets']
+
+    @property
+    def uncompressed_size(self):
+        return self._uncompressed_size
+
+    @staticmethod
+    def index_path(source_filepath, index_directory=None):
+        '''
+        :param source_filepath: Full path to the gzip XMRG file.
+        :param index_directory: Directory the index is stored in, if None the index is stored beside the source.
+        :return: The full path of the index file for the source file.
+        '''
+        directory, file_name = os.path.split(source_filepath)
+        if index_directory is not None:
+            directory = index_directory
+        return os.path.join(directory, f"{file_name}{SEEK_INDEX_EXTENSION}")
+
+    @classmethod
+    def build(cls, source_filepath, index_directory=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        '''
+        Builds the index for the source file. The file is written to a temporary name first so other processes
+        never see a partial index.
+        :return: The xmrg_seek_index.
+        '''
+        index_filepath = cls.index_path(source_filepath, index_directory)
+        source_stat = os.stat(source_filepath)
+        with open(source_filepath, 'rb') as source_file:
+            uncompressed = gzip.decompress(source_file.read())
+
+        chunks = [zlib.compress(uncompressed[offset:offset + chunk_size])
+                  for offset in range(0, len(uncompressed), chunk_size)]
+        chunk_offsets = [0]
+        for chunk in chunks:
+            chunk_offsets.append(chunk_offsets[-1] + len(chunk))
+        description = json.dumps({
+            'source_size': source_stat.st_size,
+            'source_mtime_ns': source_stat.st_mtime_ns,
+            'uncompressed_size': len(uncompressed),
+            'chunk_size': chunk_size,
+            'chunk_offsets': chunk_offsets
+        }).encode('utf-8')
+
+        with atomic_write(index_filepath) as index_file:
+            index_file.write(SEEK_INDEX_MAGIC)
+            index_file.write(struct.pack('<I', len(description)))
+            index_file.write(description)
+            for chunk in chunks:
+                index_file.write(chunk)
+        return cls(index_filepath)
+
+    @classmethod
+    def open(cls, source_filepath, index_directory=None):
+        '''
+        Opens the index for the source file.
+        :return: The xmrg_seek_index, or None if there is no index or the source file changed since it was built.
+        '''
+        index_filepath = cls.index_path(source_filepath, index_directory)
+        if not os.path.exists(index_filepath):
+            return None
+        try:
+            seek_index = cls(index_filepath)
+        except (ValueError, KeyError, struct.error) as e:
+            logger.error(f"Unable to read seek index: {index_filepath}. {e}")
+            return None
+        source_stat = os.stat(source_filepath)
+        if seek_index._source_size != source_stat.st_size or seek_index._source_mtime_ns != source_stat.st_mtime_ns:
+            return None
+        return seek_index
+
+    def read(self, offset, byte_count):
+        '''
+        Returns the uncompressed bytes from offset to offset + byte_count, fewer if the file ends first.
+        Only the chunks overlapping the range are read and inflated.
+        '''
+        end = min(offset + byte_count, self._uncompressed_size)
+        if offset >= end:
+            return b''
+        first_chunk = offset // self._chunk_size
+        last_chunk = (end - 1) // self._chunk_size
+        with open(self._index_filepath, 'rb') as index_file:
+            index_file.seek(self._chunks_start + self._chunk_offsets[first_chunk])
+            compressed = index_file.read(self._chunk_offsets[last_chunk + 1] - self._chunk_offsets[first_chunk])
+        uncompressed = []
+        for chunk in range(first_chunk, last_chunk + 1):
+            start = self._chunk_offsets[chunk] - self._chunk_offsets[first_chunk]
+            stop = self._chunk_offsets[chunk + 1] - self._chunk_offsets[first_chunk]
+            uncompressed.append(zlib.decompress(compressed[start:stop]))
+        chunk_start = first_chunk * self._chunk_size
+        return b''.join(uncompressed)[offset - chunk_start:end - chunk_start]
+
+
+def get_seek_index(source_filepath, index_directory=None, build_missing=True):
+    '''
+    Opens the seek index for the gzip XMRG file, building it if it's missing or out of date.
+    :param build_missing: If False a missing or out of date index isn't built, building one costs more than
+    decompressing the file once.
+    :return: The xmrg_seek_index, or None if there is no index or it could not be built.
+    '''
+    seek_index = xmrg_seek_index.open(source_filepath, index_directory)
+    if seek_index is None and build_missing:
+        try:
+            seek_index = xmrg_seek_index.build(source_filepath, index_directory)
+        except Exception as e:
+            logger.exception(f"Failed to build seek index for: {source_filepath}. {e}")
+    return seek_index
@@ -6,6 +6,7 @@ import logging.config
 
 import pytz
 from pandas import to_datetime as dt_parse
+from contextlib import contextmanager
 from dataclasses import dataclass
 from html.parser import HTMLParser
 from urllib.parse import urljoin
@@ -45,6 +46,20 @@ def get_collection_date_from_filename(fileName):
     return filetime
 
 
+def get_daily_period_end_from_filename(fileName, day_end_hour):
+    '''
+    The 24 hour files are named for the day their period ends on, the period ends at day_end_hour(UTC).
+    :param fileName: XMRG file name or path.
+    :param day_end_hour: Hour the 24 hour period ends at.
+    :return: The end of the period in the get_collection_date_from_filename format, or None if the file isn't a
+    24 hour file.
+    '''
+    if os.path.split(fileName)[1].find('24hrxmrg') == -1:
+        return None
+    day = datetime.strptime(get_collection_date_from_filename(fileName), "%Y-%m-%dT%H:%M:%S")
+    return (day + timedelta(hours=day_end_hour)).strftime("%Y-%m-%dT%H:%M:%S")
+
+
 def file_list_from_date_range(start_date_time, hour_count, xmrg_file_extension='gz'):
     """
     Function: file_list_from_date_range
@@ -78,6 +93,35 @@ def build_filename(date_time, xmrg_file_ext):
     except Exception as e:
         raise e
 
+def build_daily_filename(date_time, xmrg_file_ext):
+    '''
+    Builds the name of the 24 hour XMRG file for the day, 24hrxmrgMMDDYYYY, the format
+    get_collection_date_from_filename parses.
+    '''
+    file_name = date_time.strftime('24hrxmrg%m%d%Y')
+    if len(xmrg_file_ext):
+        file_name = f"{file_name}.{xmrg_file_ext}"
+    return file_name
+
+
+@contextmanager
+def atomic_write(file_path, mode='wb'):
+    '''
+    Opens a temporary file beside file_path to write to and, when the block finishes, renames it to file_path.
+    Other processes never see a partial file and a crash never leaves one, if the block fails the temporary
+    file is removed.
+    :param file_path: Full path of the file to write.
+    :param mode: open() mode, 'wb' or 'w'.
+    '''
+    temp_filepath = f"{file_path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_filepath, mode) as temp_file:
+            yield temp_file
+        os.replace(temp_filepath, file_path)
+    finally:
+        if os.path.exists(temp_filepath):
+            os.remove(temp_filepath)
+
 
 def http_download_file(download_url: str, file_name: str, destination_directory: str):
     start_time = time.time()
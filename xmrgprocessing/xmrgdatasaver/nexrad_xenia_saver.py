@@ -8,12 +8,17 @@ from sqlalchemy import select, update, exc
 import time
 from shapely.ops import unary_union
 
+# Observation types the weighted averages are saved as, the daily totals are kept apart from the hourly values.
+HOURLY_OBS_TYPE = 'precipitation_radar_weighted_average'
+DAILY_OBS_TYPE = 'precipitation_radar_daily_total'
+
 
 class nexrad_xenia_sqlite_saver(precipitation_saver):
     def __init__(self, sqlite_file):
         self._xenia_db = xeniaAlchemy()
         self._xenia_db.connect_sqlite_db(sqlite_file, False)
-        self._check_exists = True
+        # Observation types whose platforms and sensors have all been checked.
+        self._checked_obs_types = set()
         self._save_all_precip_values = True
         self._add_sensors = True
         self.sensor_ids = {}
@@ -27,7 +32,12 @@ class nexrad_xenia_sqlite_saver(precipitation_saver):
     @property
     def records_updated(self):
         return self._records_updated
-    def check_exists(self, platform_handle, xmrg_results_data):
+    def check_exists(self, platform_handle, xmrg_results_data, obs_type=HOURLY_OBS_TYPE):
+        '''
+        Adds the organisation, platform and sensor for the boundary if they don't exist.
+        :param obs_type: The observation type of the sensor.
+        :return: True if the platform exists, otherwise False.
+        '''
         org, platform_name, platform_type = platform_handle.split('.')
         self._logger.info(f"Checking organisation: {org} and platforms: {platform_handle} exist.")
         org_id = self._xenia_db.organizationExists(org)
@@ -38,11 +48,18 @@ class nexrad_xenia_sqlite_saver(precipitation_saver):
             self._logger.info(f"Adding platform. Org: {org_id} Platform Handle: {platform_handle} "
                                f"Short_Name: {platform_name}")
             # Figure out the center of the boundaries, we'll then use that for the latitude and longitude
-            # of the platform.
-            boundary_grid_data = xmrg_results_data.get_boundary_grid(platform_name)
-            poly_list = [x[0] for x in boundary_grid_data]
-            combined_polygons = unary_union(poly_list)
-            centroid = combined_polygons.centroid
+            # of the platform. The worker sends each boundary's centroid, results built without it fall back
+            # to the boundary's grid cells.
+            centroid = xmrg_results_data.get_boundary_centroid(platform_name)
+            if centroid is None:
+                boundary_grid_data = xmrg_results_data.get_boundary_grid(platform_name)
+                if boundary_grid_data:
+                    poly_list = [x[0] for x in boundary_grid_data]
+                    combined_polygons = unary_union(poly_list)
+                    centroid = combined_polygons.centroid
+            if centroid is None:
+                self._logger.error(f"Unable to locate platform: {platform_handle}, not adding it.")
+                return False
             platform_rec = platform(
                 row_entry_date=self.row_entry_date,
                 platform_handle=platform_handle,
@@ -58,17 +75,21 @@ class nexrad_xenia_sqlite_saver(precipitation_saver):
                 self._xenia_db.session.rollback()
                 self._logger.error(f"Failed to add platform: {platform_handle} for org_id: {org_id}, cannot continue")
                 self._logger.exception(e)
+                return False
         if self._add_sensors:
-            self._xenia_db.addNewSensor('precipitation_radar_weighted_average', 'mm',
+            self._xenia_db.addNewSensor(obs_type, 'mm',
                                         platform_handle,
                                         1,
                                         0,
                                         1, None, True)
 
-        return
+        return True
 
     def save(self, xmrg_results_data):
         try:
+            platforms_exist = True
+            obs_type = DAILY_OBS_TYPE if xmrg_results_data.period_hours == 24 else HOURLY_OBS_TYPE
+            check_exists = obs_type not in self._checked_obs_types
             for boundary_name, boundary_results in xmrg_results_data.get_boundary_data():
                 '''
                 if self.writePrecipToKML and xmrg_results_data.get_boundary_grid(boundary_name) is not None:
@@ -79,8 +100,9 @@ class nexrad_xenia_sqlite_saver(precipitation_saver):
                 '''
                 platform_handle = "nws.%s.radarcoverage" % (boundary_name)
                 self._logger.info(f"Saving platform: {platform_handle} {xmrg_results_data.datetime}")
-                if self._check_exists:
-                    self.check_exists(platform_handle, xmrg_results_data)
+                if check_exists:
+                    if not self.check_exists(platform_handle, xmrg_results_data, obs_type):
+                        platforms_exist = False
                 lat = 0.0
                 lon = 0.0
 
@@ -90,20 +112,21 @@ class nexrad_xenia_sqlite_saver(precipitation_saver):
                         if avg != -9999:
                             # Build a dict of m_type and sensor_id for each platform to make the inserts
                             # quicker.
-                            if platform_handle not in self.sensor_ids:
+                            sensor_key = (platform_handle, obs_type)
+                            if sensor_key not in self.sensor_ids:
                                 try:
                                     platform_info = self._xenia_db.session.query(platform) \
                                         .filter(platform.platform_handle == platform_handle) \
                                         .one()
                                 except Exception as e:
                                     self._logger.exception(e)
+                                    self._logger.error(f"Platform: {platform_handle} not found, "
+                                                       f"not adding {xmrg_results_data.datetime}.")
+                                    continue
                                 else:
-                                    m_type_id = self._xenia_db.mTypeExists('precipitation_radar_weighted_average',
-                                                                           'mm')
-                                    sensor_id = self._xenia_db.sensorExists('precipitation_radar_weighted_average',
-                                                                            'mm',
-                                                                            platform_handle, 1)
-                                    self.sensor_ids[platform_handle] = {
+                                    m_type_id = self._xenia_db.mTypeExists(obs_type, 'mm')
+                                    sensor_id = self._xenia_db.sensorExists(obs_type, 'mm', platform_handle, 1)
+                                    self.sensor_ids[sensor_key] = {
                                         'latitude': platform_info.fixed_latitude,
                                         'longitude': platform_info.fixed_longitude,
                                         'm_type_id': m_type_id,
@@ -116,11 +139,11 @@ class nexrad_xenia_sqlite_saver(precipitation_saver):
                             db_rec = multi_obs(
                                 row_entry_date=self.row_entry_date,
                                 platform_handle=platform_handle,
-                                sensor_id=self.sensor_ids[platform_handle]['sensor_id'],
-                                m_type_id=self.sensor_ids[platform_handle]['m_type_id'],
+                                sensor_id=self.sensor_ids[sensor_key]['sensor_id'],
+                                m_type_id=self.sensor_ids[sensor_key]['m_type_id'],
                                 m_date=xmrg_results_data.datetime,
-                                m_lon=self.sensor_ids[platform_handle]['latitude'],
-                                m_lat=self.sensor_ids[platform_handle]['longitude'],
+                                m_lon=self.sensor_ids[sensor_key]['latitude'],
+                                m_lat=self.sensor_ids[sensor_key]['longitude'],
                                 m_value=avg
                             )
                             try:
@@ -135,8 +158,8 @@ class nexrad_xenia_sqlite_saver(precipitation_saver):
                                     self._xenia_db.session.query(multi_obs)\
                                         .filter(multi_obs.platform_handle == platform_handle) \
                                         .filter(multi_obs.m_date == xmrg_results_data.datetime) \
-                                        .filter(multi_obs.m_type_id == self.sensor_ids[platform_handle]['m_type_id']) \
-                                        .filter(multi_obs.sensor_id == self.sensor_ids[platform_handle]['sensor_id']) \
+                                        .filter(multi_obs.m_type_id == self.sensor_ids[sensor_key]['m_type_id']) \
+                                        .filter(multi_obs.sensor_id == self.sensor_ids[sensor_key]['sensor_id']) \
                                         .update({"m_value": avg})
                                     self._xenia_db.session.commit()
                                     self._records_updated += 1
@@ -159,7 +182,9 @@ class nexrad_xenia_sqlite_saver(precipitation_saver):
                     self._logger.error(f"Platform: {platform_handle} Date: {xmrg_results_data.datetime} "
                                        f"Weighted AVG error")
 
-            self._check_exists = False
+            # Keep checking until every platform has been added.
+            if platforms_exist:
+                self._checked_obs_types.add(obs_type)
         except Exception as e:
             self._logger.exception(e)
         return
@@ -0,0 +1,161 @@
+import os
+import logging.config
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import timedelta
+
+import numpy as np
+from shapely import segmentize
+from shapely.geometry import box
+
+from ..boundary.boundariesparse import find_hrap_extent
+from ..geoXmrg import geoXmrg, hrapWindow
+from .xmrg_file_iterator import xmrg_file_iterator
+
+# Raw value given to masked cells when an hour is handed to geoXmrg, a negative missing data flag.
+MISSING_VALUE = -1
+
+
+@dataclass(frozen=True, eq=False)
+class xmrg_cube:
+    '''
+    The hourly grids of a date range for one HRAP extent, stacked into a (time, row, col) int16 array. Row 0 is the
+    southern most row, the same as geoXmrg.grid. Cells are masked for the hours whose file is missing or couldn't be
+    read, and for the cells of the extent that are off a file's grid.
+    '''
+    times: list
+    # Absolute (start_col, start_row, end_col, end_row) HRAP extent of the rows and columns, the ends are exclusive.
+    hrap_extent: tuple
+    data: np.ma.MaskedArray
+    data_multiplier: float
+    # The part of the extent on the files' grid, relative to the file origin. None if no file was read.
+    window: hrapWindow = None
+
+    @property
+    def precipitation(self):
+        '''
+        The scaled precipitation as a float masked array.
+        '''
+        return self.data.astype(np.float64) * self.data_multiplier
+
+    @property
+    def missing_hours(self):
+        '''
+        The times of the hours where no cells were read.
+        '''
+        return [self.times[hour] for hour in np.flatnonzero(np.ma.getmaskarray(self.data).all(axis=(1, 2)))]
+
+    def hour_index(self, date_time):
+        '''
+        :param date_time: datetime of one of the hours.
+        :return: Index of the hour in the first axis of data.
+        '''
+        return self.times.index(date_time)
+
+    def xmrg(self, hour):
+        '''
+        Returns one hour as a geoXmrg over window, as if it had been read with readAllRows, so the boundary weights
+        and statistics work on it without decoding the file again. Masked cells get the MISSING_VALUE flag.
+        :param hour: Index of the hour.
+        :return: geoXmrg, None if no file was read for the cube.
+        '''
+        if self.window is None:
+            return None
+        start_col, start_row, end_col, end_row = self.hrap_extent
+        window = self.window
+        rows = slice(window.yor + window.start_row - start_row, window.yor + window.end_row - start_row)
+        columns = slice(window.xor + window.start_col - start_col, window.xor + window.end_col - start_col)
+        xmrg = geoXmrg(None, None, self.data_multiplier)
+        xmrg.setGrid(window, self.data[hour, rows, columns].filled(MISSING_VALUE).astype(np.int16),
+                     self.times[hour].strftime('xmrg%m%d%Y%Hz'))
+        return xmrg
+
+
+class xmrg_cube_builder:
+    '''
+    Builds an xmrg_cube for a date range. The files are found the same way xmrg_file_iterator finds them and are
+    decompressed and decoded by a pool of threads, zlib releases the GIL while it inflates so the files are
+    decoded in parallel.
+    '''
+    def __init__(self, **kwargs):
+        self._logger = logging.getLogger('xmrg_cube_builder')
+        #We can provide the full path to where all the XMRG files would be.
+        self._full_xmrg_path = kwargs.get('full_xmrg_path', None)
+        #If we are using the /year/month template for the xmrg files, the
+        #base_xmrg_path is the parent directory where those sub-directories begin.
+        self._base_xmrg_path = kwargs.get('base_xmrg_path', None)
+        #Number of threads decoding files.
+        self._thread_count = kwargs.get('thread_count', os.cpu_count() or 4)
+        self._data_multiplier = kwargs.get('data_multiplier', 0.01)
+
+    @staticmethod
+    def hrap_extent_from_bbox(min_lat_lon, max_lat_lon, pad_cells=1):
+        '''
+        Computes the HRAP extent covering a lat/long bounding box. The box's edges are densified first, lines of
+        latitude are curves on the HRAP grid.
+        :param min_lat_lon: (latitude, longitude) of the lower left corner.
+        :param max_lat_lon: (latitude, longitude) of the upper right corner.
+        :param pad_cells: Number of cells to add on each side of the extent.
+        :return: (start_col, start_row, end_col, end_row) absolute HRAP extent, the ends are exclusive.
+        '''
+        bbox = box(min_lat_lon[1], min_lat_lon[0], max_lat_lon[1], max_lat_lon[0])
+        return find_hrap_extent(geoXmrg(None, None), segmentize(bbox, 0.1), pad_cells)
+
+    def file_paths(self, start_date, end_date):
+        '''
+        :return: List of (datetime, file path) for each hour from start_date up to, not including, end_date.
+        '''
+        file_iterator = xmrg_file_iterator(start_date=start_date, end_date=end_date,
+                                           base_xmrg_path=self._base_xmrg_path,
+                                           full_xmrg_path=self._full_xmrg_path)
+        return [(start_date + timedelta(hours=hour), file_path) for hour, file_path in enumerate(file_iterator)]
+
+    def build(self, start_date, end_date, min_lat_lon=None, max_lat_lon=None, hrap_extent=None):
+        '''
+        Reads the hourly files from start_date up to, not including, end_date into a cube.
+        :param start_date: datetime of the first hour.
+        :param end_date: datetime of the hour after the last hour.
+        :param min_lat_lon: (latitude, longitude) of the lower left corner of the area to read.
+        :param max_lat_lon: (latitude, longitude) of the upper right corner of the area to read.
+        :param hrap_extent: (start_col, start_row, end_col, end_row) absolute HRAP extent to read, used instead of
+          the bounding box.
+        :return: xmrg_cube
+        '''
+        if hrap_extent is None:
+            hrap_extent = self.hrap_extent_from_bbox(min_lat_lon, max_lat_lon)
+        start_col, start_row, end_col, end_row = hrap_extent
+        hours = self.file_paths(start_date, end_date)
+        data = np.zeros((len(hours), end_row - start_row, end_col - start_col), dtype=np.int16)
+        mask = np.ones(data.shape, dtype=bool)
+
+        def read_hour(hour):
+            file_date, file_path = hours[hour]
+            window = None
+            if not os.path.isfile(file_path):
+                self._logger.info(f"Missing file: {file_path}")
+                return window
+            try:
+                xmrg = geoXmrg(None, None, self._data_multiplier, hrap_extents=[hrap_extent])
+                xmrg.openFile(file_path, in_memory=True)
+                if xmrg.readFileHeader() and xmrg.readAllRows():
+                    window = xmrg.window
+                    rows = slice(window.yor + window.start_row - start_row,
+                                 window.yor + window.end_row - start_row)
+                    columns = slice(window.xor + window.start_col - start_col,
+                                    window.xor + window.end_col - start_col)
+                    #Each thread fills its own hour, so no locking is needed.
+                    data[hour, rows, columns] = xmrg.grid
+                    mask[hour, rows, columns] = False
+                else:
+                    self._logger.error(f"Failed to read file: {file_path}. {xmrg.lastErrorMsg}")
+                xmrg.cleanUp(False, False)
+            except Exception as e:
+                self._logger.exception(f"Failed to read file: {file_path}. {e}")
+            return window
+
+        with ThreadPoolExecutor(max_workers=self._thread_count) as executor:
+            windows = [window for window in executor.map(read_hour, range(len(hours))) if window is not None]
+
+        return xmrg_cube([file_date for file_date, file_path in hours], tuple(hrap_extent),
+                         np.ma.MaskedArray(data, mask=mask), self._data_multiplier,
+                         windows[0] if windows else None)
@@ -4,9 +4,11 @@ from datetime import timedelta
 from pathlib import Path
 from string import Template
 
-from ..xmrg_utilities import file_list_from_date_range, build_filename
+from ..xmrg_utilities import file_list_from_date_range, build_filename, build_daily_filename
 
 DEFAULT_XMRG_PATH = "{base_path}/{year}/{month}"
+#The 24 hour XMRG products cover 12Z to 12Z, the file for a day ends at 12Z that day.
+DEFAULT_DAY_END_HOUR = 12
 class xmrg_file_iterator:
     '''
     This class serves as an iterator for the xmrg files we want to process.
@@ -83,3 +85,52 @@ class xmrg_file_iterator:
         self._start_date = kwargs['start_date']
         self._end_date = kwargs['end_date']
         self._current_iterate_date = self._start_date
+
+
+class xmrg_daily_file_iterator(xmrg_file_iterator):
+    '''
+    Iterates the days from start_date up to end_date for daily totals. For each day this returns the path of the
+    day's 24 hour file when it exists. For a day without one, it returns a (24 hour file path, hourly file paths)
+    tuple, the 24 hour path without the .gz is the name the summed hours are reported under and the hourly paths
+    are the existing files for the 24 hours the day's file would cover.
+    '''
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        #Hour(UTC) the 24 hour period for a day ends at.
+        self._day_end_hour = kwargs.get('day_end_hour', DEFAULT_DAY_END_HOUR)
+        self._current_iterate_date = self._day_start(self._start_date)
+
+    def _day_start(self, date_time):
+        if date_time is None:
+            return None
+        return date_time.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def __next__(self):
+        if self._use_date_list:
+            if not self._date_list:
+                raise StopIteration
+            self._current_iterate_date = self._day_start(self._date_list.pop(0))
+        elif self._current_iterate_date >= self._end_date:
+            raise StopIteration
+        day = self._current_iterate_date
+        if not self._use_date_list:
+            self._current_iterate_date += timedelta(days=1)
+
+        daily_filepath = self.file_path(day, build_daily_filename(day, "gz"))
+        if os.path.isfile(daily_filepath):
+            return daily_filepath
+        day_end = day + timedelta(hours=self._day_end_hour)
+        hourly_filepaths = [self.file_path(hour, build_filename(hour, "gz"))
+                            for hour in (day_end - timedelta(hours=hour_count) for hour_count in range(23, -1, -1))]
+        self._logger.info(f"No 24 hour file: {daily_filepath}, using the hourly files.")
+        return (os.path.splitext(daily_filepath)[0],
+                [file_path for file_path in hourly_filepaths if os.path.isfile(file_path)])
+
+    def file_path(self, file_date, file_name):
+        if self._full_xmrg_path is None:
+            return self.get_path(file_date, file_name, self._base_xmrg_path, DEFAULT_XMRG_PATH)
+        return os.path.join(self._full_xmrg_path, file_name)
+
+    def setup_iterator(self, **kwargs):
+        super().setup_iterator(**kwargs)
+        self._current_iterate_date = self._day_start(self._start_date)